@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 # 058b1054e0406dfd1e1f146a212fee893b3d4b51
 from .models import User, Shop, Category, Product, Parameter, ProductParameter, Order, OrderItem, \
-    Contact, ConfirmEmailToken
+    Contact, ConfirmEmailToken, ImportRun
 
 
 @admin.register(User)
@@ -63,6 +63,11 @@ class ContactAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(ImportRun)
+class ImportRunAdmin(admin.ModelAdmin):
+    list_display = ('url', 'shop', 'state', 'rows_processed', 'created_at', 'finished_at')
+
+
 @admin.register(ConfirmEmailToken)
 class ConfirmEmailTokenAdmin(admin.ModelAdmin):
     list_display = ('user', 'key', 'created_at',)
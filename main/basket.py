@@ -0,0 +1,197 @@
+from collections import defaultdict
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, PositiveIntegerField, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+from ujson import loads as load_json
+
+from .catalog_cache import invalidate_shop
+from .models import Product, Order, OrderItem, Contact
+from .snapshots import drop_snapshots
+
+
+class BasketError(ValueError):
+    pass
+
+
+def number(value, error='Позиция корзины - {"product": id товара, "quantity": количество}'):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    raise BasketError(error)
+
+
+def basket_quantities(items):
+    """
+    Разбирает позиции корзины [{"product": id, "quantity": количество}, ...], переданные списком
+    или JSON-строкой, в словарь товар -> количество. Повторный товар заменяет прежнее количество.
+    """
+    if isinstance(items, str):
+        try:
+            items = load_json(items)
+        except ValueError:
+            raise BasketError('Позиции корзины - JSON-список')
+    if not isinstance(items, list):
+        raise BasketError('Позиции корзины - JSON-список')
+    quantities = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise BasketError('Позиция корзины - {"product": id товара, "quantity": количество}')
+        quantity = number(item.get('quantity'))
+        if quantity < 1:
+            raise BasketError('Количество товара должно быть больше нуля')
+        quantities[number(item.get('product'))] = quantity
+    return quantities
+
+
+def check_stock(quantities):
+    """
+    Проверяет наличие всех товаров корзины в нужном количестве одним запросом
+    """
+    stock = dict(Product.objects.filter(id__in=quantities).values_list('id', 'quantity'))
+    for product_id, quantity in quantities.items():
+        if product_id not in stock:
+            raise BasketError('Такого товара нет в наличии')
+        if stock[product_id] < quantity:
+            raise BasketError('Такого количества товаров нет в наличии')
+
+
+def add_items(order, quantities):
+    """
+    Добавляет товары в заказ одним запросом. Количество уже добавленных товаров заменяется
+    """
+    OrderItem.objects.bulk_create([OrderItem(order=order, product_id=product_id, quantity=quantity)
+                                   for product_id, quantity in quantities.items()],
+                                  update_conflicts=True, unique_fields=['order', 'product'], update_fields=['quantity'])
+
+
+def update_items(order, quantities):
+    """
+    Меняет количество уже добавленных в заказ товаров одним запросом
+    """
+    if quantities:
+        OrderItem.objects.filter(order=order, product_id__in=quantities).update(quantity=Case(
+            *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            output_field=PositiveIntegerField()))
+
+
+def update_totals(order_id):
+    """
+    Пересчитывает сохраненные итоги заказа одним запросом по его позициям при их изменении.
+    Позиции корзины считаются по текущей цене товара, оформленного заказа - по цене на момент оформления
+    """
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    Order.objects.filter(id=order_id).update(
+        items_count=Coalesce(Subquery(items.annotate(total=Sum('quantity')).values('total')), 0),
+        total_sum=Coalesce(Subquery(items.annotate(total=Sum(
+            F('quantity') * Coalesce('price', 'product__price_rrc'))).values('total')), 0))
+
+
+def quantity_changes(quantities, sign):
+    return Case(*[When(id=product_id, then=F('quantity') + sign * quantity)
+                  for product_id, quantity in quantities.items()], output_field=PositiveIntegerField())
+
+
+def lock_stock(product_ids):
+    """
+    Блокирует строки товаров по возрастанию id, поэтому одновременные заказы с общими товарами
+    выстраиваются в очередь без взаимных блокировок. Возвращает товар -> (остаток, в продаже, магазин, категория)
+    """
+    return {product_id: row for product_id, *row in Product.objects.select_for_update().filter(
+        id__in=product_ids).order_by('id').values_list('id', 'quantity', 'is_active', 'shop_id', 'category_id')}
+
+
+def changed_categories(stock):
+    categories = defaultdict(set)
+    for _, _, shop_id, category_id in stock.values():
+        categories[shop_id].add(category_id)
+    return {shop_id: sorted(category_ids) for shop_id, category_ids in categories.items()}
+
+
+def stock_changed(categories):
+    """
+    После фиксации транзакции сбрасывает кеш и снимки каталога магазинов, у товаров которых изменился остаток.
+    categories - магазин -> категории этих товаров
+    """
+    for shop_id, category_ids in categories.items():
+        invalidate_shop(shop_id, category_ids)
+        transaction.on_commit(partial(drop_snapshots, shop_id))
+
+
+def reserve_stock(order):
+    """
+    Списывает со склада товары заказа одним запросом после проверки остатков под блокировкой.
+    Если хоть одного товара не хватает, не списывает ничего. Возвращает магазин -> категории
+    товаров, у которых изменился остаток. Вызывается в транзакции.
+    """
+    quantities = dict(order.ordered_items.values_list('product_id', 'quantity'))
+    if not quantities:
+        raise BasketError('Корзина пуста')
+    stock = lock_stock(quantities)
+    missing = [product_id for product_id, quantity in quantities.items()
+               if product_id not in stock or not stock[product_id][1] or stock[product_id][0] < quantity]
+    if missing:
+        raise BasketError('Такого количества товаров нет в наличии: ' + ', '.join(map(str, sorted(missing))))
+    Product.objects.filter(id__in=quantities).update(quantity=quantity_changes(quantities, -1), updated_at=now())
+    # цены фиксируются на момент оформления, пока строки товаров заблокированы
+    order.ordered_items.update(price=Subquery(Product.objects.filter(id=OuterRef('product_id')).values('price_rrc')))
+    return changed_categories(stock)
+
+
+def release_stock(order):
+    """
+    Возвращает на склад товары заказа. Вызывается в транзакции
+    """
+    quantities = dict(order.ordered_items.values_list('product_id', 'quantity'))
+    stock = lock_stock(quantities)
+    Product.objects.filter(id__in=quantities).update(quantity=quantity_changes(quantities, 1), updated_at=now())
+    return changed_categories(stock)
+
+
+def checkout(user, order_id, contact_id):
+    """
+    Оформляет корзину пользователя: списывает товары со склада, резервирует их за заказом
+    на ORDER_RESERVATION_TIMEOUT и фиксирует цены и итоги заказа.
+    Возвращает заказ и магазин -> категории списанных товаров
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(id=order_id, user=user, order_state='basket').first()
+        if order is None:
+            raise BasketError('Корзина не найдена')
+        if not Contact.objects.filter(id=contact_id, user=user).exists():
+            raise BasketError('Контакт не найден')
+        categories = reserve_stock(order)
+        stock_changed(categories)
+        update_totals(order.id)
+        order.contact_id = contact_id
+        order.order_state = 'new'
+        order.reserved_until = now() + timedelta(seconds=settings.ORDER_RESERVATION_TIMEOUT)
+        order.save(update_fields=['contact', 'order_state', 'reserved_until'])
+    return order, categories
+
+
+def release_reservations():
+    """
+    Отменяет оформленные заказы, которые не подтвердили до конца резерва, и возвращает их товары на склад.
+    Возвращает число отмененных заказов и магазин -> категории возвращенных товаров
+    """
+    canceled, categories = 0, defaultdict(set)
+    expired = Order.objects.filter(order_state='new', reserved_until__lt=now())
+    for order_id in expired.values_list('id', flat=True):
+        with transaction.atomic():
+            # заказ могли подтвердить, пока до него дошла очередь
+            order = expired.select_for_update(skip_locked=True).filter(id=order_id).first()
+            if order is None:
+                continue
+            released = release_stock(order)
+            stock_changed(released)
+            for shop_id, category_ids in released.items():
+                categories[shop_id].update(category_ids)
+            Order.objects.filter(id=order.id).update(order_state='canceled', reserved_until=None)
+            canceled += 1
+    return canceled, {shop_id: sorted(category_ids) for shop_id, category_ids in categories.items()}
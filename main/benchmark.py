@@ -0,0 +1,279 @@
+import resource
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+from statistics import median, quantiles
+from time import monotonic
+
+import ujson
+import yaml
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+
+from .basket import checkout, BasketError
+from .importer import import_price_list
+from .models import Shop, Category, Parameter, Product, User, Contact, Order, OrderItem
+from .pagination import PAGE_SIZE
+from .price_list import read_price_list
+from .renderers import FastJSONRenderer
+from .search import search_products
+from .serializers import ProductSerializer, product_rows
+
+# Параметры синтетических товаров и возможные значения
+PARAMETERS = {
+    'Цвет': ['черный', 'белый', 'серебристый', 'золотой', 'синий', 'красный'],
+    'Диагональ (дюйм)': [5.5, 6.1, 6.4, 6.5, 6.7, 6.9],
+    'Разрешение (пикс)': ['1920x1080', '2340x1080', '2400x1080', '2778x1284'],
+    'Встроенная память (Гб)': [32, 64, 128, 256, 512],
+    'Оперативная память (Гб)': [2, 4, 6, 8, 12],
+    'Емкость аккумулятора (мАч)': [3000, 4000, 4500, 5000, 6000],
+    'Вес (г)': list(range(140, 240, 5)),
+    'Гарантия (мес)': [6, 12, 24],
+}
+# Словарь для наполнения каталога поискового бенчмарка
+KINDS = ['Смартфон', 'Ноутбук', 'Планшет', 'Наушники', 'Чехол', 'Телевизор', 'Холодильник', 'Пылесос',
+         'Фотоаппарат', 'Часы']
+BRANDS = ['Samsung', 'Apple', 'Xiaomi', 'Huawei', 'Honor', 'Realme', 'Sony', 'LG', 'Lenovo', 'Asus',
+          'Acer', 'Dell', 'HP', 'Philips', 'Bosch', 'Canon', 'Nikon', 'JBL', 'Redmi', 'Nokia']
+SERIES = ['Pro', 'Lite', 'Max', 'Mini', 'Plus', 'Ultra']
+COLORS = ['черный', 'белый', 'серебристый', 'золотой', 'синий', 'красный']
+MEMORY = ['32', '64', '128', '256', '512']
+# Поисковые запросы бенчмарка: товар по бренду и серии, по модели, по значению параметра
+SEARCH_QUERIES = ['смартфоны samsung pro', 'realme/m123451', 'красный ноутбук lenovo', 'наушники jbl черные',
+                  '"телевизор lg"']
+# Допустимое время поискового запроса, мс
+SEARCH_THRESHOLD = 50
+
+# Метрики, рост которых считается ухудшением, и метрики, падение которых считается ухудшением
+LOWER_IS_BETTER = ('wall_time', 'queries', 'peak_rss')
+HIGHER_IS_BETTER = ('rows_per_second',)
+# Допустимое ухудшение метрики относительно эталона
+THRESHOLD = 0.2
+
+
+def generate_goods(size, categories, seed=0):
+    """
+    Синтетические товары: несколько моделей в каждой категории, у товара от 3 до 8 параметров
+    """
+    random = Random(seed)
+    names = list(PARAMETERS)
+    for i in range(size):
+        category = random.choice(categories)
+        parameters = random.sample(names, random.randint(3, len(names)))
+        price = random.randint(10, 2000) * 100
+        yield {
+            'id': i + 1,
+            'category': category['id'],
+            'model': f'{category["name"].lower()}/model-{i + 1}',
+            'name': f'{category["name"]} {random.choice(["Pro", "Lite", "Max", "Mini", "Plus"])} {i + 1}',
+            'price': price,
+            'price_rrc': price + random.randint(0, 20) * 100,
+            'quantity': random.randint(0, 50),
+            'parameters': {name: random.choice(PARAMETERS[name]) for name in parameters},
+        }
+
+
+def generate_price_list(stream, size, format='yaml', shop='Синтетический магазин', seed=0):
+    """
+    Пишет в текстовый поток прайс-лист из size товаров в формате, который загружает partner_update_task.
+    Товары пишутся по одному, поэтому размер файла не ограничен памятью.
+    """
+    categories = [{'id': 1000 + i, 'name': f'Категория {i + 1}'}
+                  for i in range(min(max(size // 1000, 5), 500))]
+    goods = generate_goods(size, categories, seed)
+    if format == 'jsonl':
+        stream.write(ujson.dumps({'shop': shop, 'categories': categories}, ensure_ascii=False) + '\n')
+        for item in goods:
+            stream.write(ujson.dumps(item, ensure_ascii=False) + '\n')
+        return
+    stream.write(yaml.dump({'shop': shop, 'categories': categories}, Dumper=yaml.CSafeDumper,
+                           allow_unicode=True, sort_keys=False))
+    stream.write('goods:\n')
+    for item in goods:
+        stream.write(yaml.dump([item], Dumper=yaml.CSafeDumper, allow_unicode=True, sort_keys=False))
+
+
+def peak_rss():
+    """
+    Пиковый объем памяти процесса в Мб
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_benchmark(stream, format='yaml'):
+    """
+    Загружает прайс-лист из потока так же, как partner_update_task, и откатывает транзакцию,
+    чтобы не оставлять данных в базе. Возвращает время, число запросов, пиковую память и скорость.
+    Пиковая память считается за все время жизни процесса, поэтому прайс-листы
+    разного размера нужно загружать по возрастанию.
+    """
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    started = monotonic()
+    with connection.execute_wrapper(count_queries), transaction.atomic():
+        data = read_price_list(stream, format)
+        shop = Shop.objects.create(name=data['shop'])
+        result = import_price_list(shop, data)
+        transaction.set_rollback(True)
+    wall_time = monotonic() - started
+    rows = result['inserted'] + result['updated']
+    return {
+        'rows': rows,
+        'wall_time': round(wall_time, 3),
+        'queries': queries,
+        'peak_rss': round(peak_rss(), 1),
+        'rows_per_second': round(rows / wall_time, 1),
+    }
+
+
+def compare(result, baseline, threshold=THRESHOLD):
+    """
+    Сравнивает метрики с эталоном и возвращает список ухудшений больше threshold
+    """
+    regressions = []
+    for metric in LOWER_IS_BETTER:
+        if metric in baseline and result[metric] > baseline[metric] * (1 + threshold):
+            regressions.append(f'{metric}: {result[metric]} > {baseline[metric]}')
+    for metric in HIGHER_IS_BETTER:
+        if metric in baseline and result[metric] < baseline[metric] * (1 - threshold):
+            regressions.append(f'{metric}: {result[metric]} < {baseline[metric]}')
+    return regressions
+
+
+def populate_catalog(size):
+    """
+    Быстро наполняет каталог size товарами с параметрами одним INSERT ... SELECT на таблицу
+    и строит поисковые документы. Возвращает созданный магазин.
+    """
+    shop = Shop.objects.create(name='Синтетический магазин')
+    categories = [Category.objects.create(name=kind).id for kind in KINDS]
+    color, memory = (Parameter.objects.get_or_create(name=name)[0].id
+                     for name in ('Цвет', 'Встроенная память (Гб)'))
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO main_product (shop_id, category_id, name, model, price, price_rrc, quantity, is_active,
+                                      external_id, fingerprint, updated_at)
+            SELECT %(shop)s, (%(categories)s::int[])[1 + i %% 10],
+                   (%(kinds)s::text[])[1 + i %% 10] || ' ' || (%(brands)s::text[])[1 + i / 10 %% 20] || ' ' ||
+                   (%(series)s::text[])[1 + i / 200 %% 6] || ' ' || i %% 1000,
+                   lower((%(brands)s::text[])[1 + i / 10 %% 20]) || '/m' || i,
+                   1000 + i %% 100000, 1200 + i %% 100000, i %% 50, true, i::text, '', now()
+            FROM generate_series(1, %(size)s) AS i
+        """, {'shop': shop.id, 'categories': categories, 'kinds': KINDS, 'brands': BRANDS, 'series': SERIES,
+              'size': size})
+        cursor.execute("""
+            INSERT INTO main_productparameter (product_id, parameter_id, value)
+            SELECT id, %(color)s, (%(colors)s::text[])[1 + id %% 6] FROM main_product WHERE shop_id = %(shop)s
+            UNION ALL
+            SELECT id, %(memory)s, (%(memory_values)s::text[])[1 + id %% 5] FROM main_product WHERE shop_id = %(shop)s
+        """, {'shop': shop.id, 'color': color, 'colors': COLORS, 'memory': memory, 'memory_values': MEMORY})
+        # поисковые документы товаров строит триггер параметров
+        cursor.execute('ANALYZE main_product, main_productparameter')
+    return shop
+
+
+def run_search_benchmark(queries=SEARCH_QUERIES, repeat=20, limit=PAGE_SIZE):
+    """
+    Время поисковых запросов к каталогу в мс: медиана и 95-й перцентиль для каждого запроса
+    """
+    results = {}
+    for text in queries:
+        timings = []
+        for _ in range(repeat):
+            started = monotonic()
+            list(search_products(Product.objects.filter(is_active=True), text).values_list('id', 'rank')[:limit])
+            timings.append((monotonic() - started) * 1000)
+        results[text] = {'p50': round(median(timings), 1), 'p95': round(quantiles(timings, n=20)[-1], 1)}
+    return results
+
+
+def run_serialization_benchmark(queryset):
+    """
+    Сравнивает сериализацию списка товаров через ProductSerializer и JSONRenderer
+    с быстрой сериализацией из values_list() и orjson. Возвращает время в мс и ускорение.
+    """
+    started = monotonic()
+    model_content = JSONRenderer().render(ProductSerializer(queryset.all(), many=True).data)
+    model_time = monotonic() - started
+
+    started = monotonic()
+    values_content = FastJSONRenderer().render(product_rows.serialize(queryset.all()))
+    values_time = monotonic() - started
+
+    if model_content != values_content:
+        raise AssertionError('Быстрая сериализация отличается от ProductSerializer')
+    return {
+        'rows': queryset.count(),
+        'serializer_ms': round(model_time * 1000, 1),
+        'values_ms': round(values_time * 1000, 1),
+        'speedup': round(model_time / values_time, 1),
+    }
+
+
+def checkout_concurrently(orders, threads):
+    """
+    Оформляет корзины [(пользователь, заказ, контакт), ...] в threads потоках со своими соединениями с базой.
+    Возвращает id оформленных заказов
+    """
+    def run(order):
+        try:
+            return checkout(*order)[0].id
+        except BasketError:
+            return None
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(threads) as executor:
+        return [order_id for order_id in executor.map(run, orders) if order_id is not None]
+
+
+def run_checkout_benchmark(buyers=200, products=10, stock=50, threads=16, seed=0):
+    """
+    Нагрузочный тест оформления заказов: buyers покупателей одновременно оформляют корзины из общих
+    products товаров, которых на складе по stock штук - меньше, чем хотят купить все вместе.
+    Данные записываются в базу, потому что потоки работают в своих транзакциях, и удаляются после теста.
+    Возвращает товары, у которых списано не столько, сколько в оформленных заказах, число оформленных
+    и отклоненных заказов, минимальный остаток и пропускную способность в заказах в секунду.
+    """
+    random = Random(seed)
+    shop = Shop.objects.create(name='Нагрузочный магазин')
+    try:
+        category = Category.objects.create(name='Нагрузочный тест')
+        goods = Product.objects.bulk_create([
+            Product(shop=shop, category=category, model=f'load/{i}', name=f'Товар {i}', price=100, price_rrc=120,
+                    quantity=stock, external_id=str(i)) for i in range(products)])
+        users = User.objects.bulk_create([User(email=f'buyer{i}@load.test', is_active=True)
+                                          for i in range(buyers)])
+        contacts = Contact.objects.bulk_create([Contact(user=user, city='Москва', street='Тверская', phone='1')
+                                                for user in users])
+        orders = Order.objects.bulk_create([Order(user=user) for user in users])
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=random.randint(1, 3))
+                                       for order in orders for product in random.sample(goods, random.randint(1, 4))])
+
+        started = monotonic()
+        confirmed = checkout_concurrently(
+            [(order.user, order.id, contact.id) for order, contact in zip(orders, contacts)], threads)
+        wall_time = monotonic() - started
+
+        sold = Counter()
+        for product_id, quantity in OrderItem.objects.filter(order_id__in=confirmed).values_list(
+                'product_id', 'quantity'):
+            sold[product_id] += quantity
+        remaining = dict(Product.objects.filter(shop=shop).values_list('id', 'quantity'))
+        return {
+            # товары, остаток которых не сходится с оформленными заказами
+            'mismatched': [product.id for product in goods if remaining[product.id] != stock - sold[product.id]],
+            'confirmed': len(confirmed),
+            'rejected': buyers - len(confirmed),
+            'min_stock': min(remaining.values()),
+            'orders_per_second': round(buyers / wall_time, 1),
+        }
+    finally:
+        User.objects.filter(email__endswith='@load.test').delete()
+        Category.objects.filter(name='Нагрузочный тест').delete()
+        shop.delete()
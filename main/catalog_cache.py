@@ -0,0 +1,170 @@
+from functools import wraps
+from hashlib import md5
+from time import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Category
+
+# Версия всего каталога: меняется при любом изменении любого магазина
+CATALOG = 'catalog:version'
+HITS = 'catalog:hits'
+MISSES = 'catalog:misses'
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE]
+
+
+def shop_version(shop_id):
+    return f'{CATALOG}:shop:{shop_id}'
+
+
+def category_version(category_id):
+    return f'{CATALOG}:category:{category_id}'
+
+
+def versions(keys):
+    """
+    Текущие номера версий. Отсутствующая версия (еще не создана или вытеснена из кеша)
+    начинается с текущего времени в миллисекундах, чтобы не совпасть с прежними номерами
+    """
+    cache = get_cache()
+    found = cache.get_many(keys)
+    for key in set(keys) - set(found):
+        cache.add(key, int(time() * 1000), timeout=None)
+        found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(keys):
+    cache = get_cache()
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time() * 1000), timeout=None)
+
+
+def count(key):
+    cache = get_cache()
+    if not cache.add(key, 1, timeout=None):
+        cache.incr(key)
+
+
+def invalidate_shop(shop_id, category_ids=None):
+    """
+    Сбрасывает закешированные ответы каталога, которые зависят от магазина:
+    сам магазин, его категории category_ids (по умолчанию - все) и каталог целиком.
+    Выполняется после фиксации транзакции, чтобы в кеш не попали ответы, прочитанные до нее.
+    """
+    def invalidate():
+        ids = category_ids
+        if ids is None:
+            ids = Category.objects.filter(shops=shop_id).values_list('id', flat=True)
+        bump([CATALOG, shop_version(shop_id)] + [category_version(category_id) for category_id in ids])
+
+    transaction.on_commit(invalidate)
+
+
+def catalog_scope(request, *args, **kwargs):
+    return [CATALOG]
+
+
+def products_scope(request, *args, **kwargs):
+    """
+    Список товаров магазина или категории зависит только от их версий
+    """
+    shop_id = request.query_params.get('shop_id')
+    category_id = request.query_params.get('category_id')
+    keys = []
+    if shop_id:
+        keys.append(shop_version(shop_id))
+    if category_id:
+        keys.append(category_version(category_id))
+    return keys or [CATALOG]
+
+
+def request_digest(request, version_keys):
+    """
+    Отпечаток ответа каталога: адрес, отсортированные параметры запроса и текущие версии.
+    Считается один раз на запрос и служит ключом кеша и ETag
+    """
+    if getattr(request, 'catalog_digest', None) is None:
+        params = urlencode(sorted((key, value) for key, values in request.query_params.lists() for value in values))
+        numbers = ':'.join(str(number) for number in versions(version_keys))
+        request.catalog_digest = md5(f'{request.path}?{params}:{numbers}'.encode()).hexdigest()
+    return request.catalog_digest
+
+
+def response_key(request, version_keys):
+    return 'catalog:response:' + request_digest(request, version_keys)
+
+
+def conditional_response(scope):
+    """
+    Ставит ответам метода представления каталога сильный ETag по версиям каталога из scope(request, ...),
+    а не по содержимому, и отвечает 304 на If-None-Match с тем же ETag, не обращаясь к базе.
+    Формат ответа и сжатие входят в ETag, чтобы разные представления не совпадали.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            etag = '{}-{}'.format(request_digest(request, scope(request, *args, **kwargs)),
+                                  request.accepted_renderer.format)
+            etags = [f'"{etag}"', f'"{etag}-gzip"']
+            if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            if '*' in if_none_match:
+                if_none_match = etags[:1]
+            matched = [tag for tag in etags if tag in if_none_match or 'W/' + tag in if_none_match]
+            if matched:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': matched[0]})
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = f'"{etag}-gzip"' if response.get('Content-Encoding') == 'gzip' else f'"{etag}"'
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def cached_response(scope):
+    """
+    Кеширует успешные ответы метода представления каталога.
+    Ключ состоит из адреса, отсортированных параметров запроса и версий из scope(request, ...),
+    поэтому при изменении каталога старые ответы просто перестают запрашиваться.
+    При попадании в кеш ORM и сериализатор не вызываются.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            cache = get_cache()
+            key = response_key(request, scope(request, *args, **kwargs))
+            cached = cache.get(key)
+            if cached is not None:
+                count(HITS)
+                data, headers = cached
+                return Response(data, headers=headers)
+            count(MISSES)
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == 200 and isinstance(response, Response):
+                headers = {name: response[name] for name in ('Link',) if response.has_header(name)}
+                cache.set(key, (response.data, headers), settings.CATALOG_CACHE_TIMEOUT)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def cache_stats():
+    hits, misses = (get_cache().get(key, 0) for key in (HITS, MISSES))
+    return {'hits': hits, 'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0}
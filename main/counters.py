@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models import Count, IntegerField, Max, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .catalog_cache import CATALOG, bump, category_version
+from .models import Category, Product, ShopCategory
+
+# Счетчики товаров в продаже у категории и у связи категории с магазином
+COUNTER_FIELDS = ('product_count', 'in_stock_count', 'min_price', 'max_price')
+
+
+def aggregate(queryset, group, **aggregates):
+    """
+    Значения агрегатов queryset для строки внешнего запроса, к которой относится group
+    """
+    queryset = queryset.order_by().values(group)
+    return {name: Subquery(queryset.annotate(value=value).values('value'), output_field=IntegerField())
+            for name, value in aggregates.items()}
+
+
+def refresh_counters(shop_id, category_ids=None):
+    """
+    Пересчитывает счетчики товаров магазина в категориях category_ids (по умолчанию - во всех его категориях)
+    и итоговые счетчики этих категорий по всем магазинам. Пересчитываются только затронутые пары
+    магазин - категория, итоги категорий - по уже посчитанным парам, без обхода товаров других магазинов.
+    Категории блокируются по возрастанию id, как в refresh_facets. После фиксации транзакции
+    сбрасываются закешированные ответы каталога с этими категориями и списки категорий со счетчиками.
+    """
+    with transaction.atomic():
+        if category_ids is None:
+            category_ids = ShopCategory.objects.filter(shop_id=shop_id).values('category_id')
+        category_ids = list(Category.objects.select_for_update().filter(id__in=category_ids).order_by(
+            'id').values_list('id', flat=True))
+
+        products = Product.objects.filter(shop_id=OuterRef('shop_id'), category_id=OuterRef('category_id'),
+                                          is_active=True)
+        counters = aggregate(products, 'category_id', product_count=Count('id'),
+                             in_stock_count=Count('id', filter=Q(quantity__gt=0)),
+                             min_price=Min('price_rrc'), max_price=Max('price_rrc'))
+        ShopCategory.objects.filter(shop_id=shop_id, category_id__in=category_ids).update(
+            product_count=Coalesce(counters['product_count'], 0),
+            in_stock_count=Coalesce(counters['in_stock_count'], 0),
+            min_price=counters['min_price'], max_price=counters['max_price'])
+
+        links = ShopCategory.objects.filter(category_id=OuterRef('id'))
+        totals = aggregate(links, 'category_id', product_count=Sum('product_count'),
+                           in_stock_count=Sum('in_stock_count'), min_price=Min('min_price'), max_price=Max('max_price'))
+        changed = Category.objects.filter(id__in=category_ids).update(
+            product_count=Coalesce(totals['product_count'], 0),
+            in_stock_count=Coalesce(totals['in_stock_count'], 0),
+            min_price=totals['min_price'], max_price=totals['max_price'])
+        if changed:
+            transaction.on_commit(lambda: bump([CATALOG] + [category_version(category_id)
+                                                            for category_id in category_ids]))
@@ -0,0 +1,42 @@
+import zlib
+
+from .importer import batched
+from .renderers import dumps
+from .serializers import product_export_rows
+
+# Сколько товаров читать из курсора базы и кодировать за раз
+EXPORT_CHUNK_SIZE = 2000
+
+
+def export_products(queryset, lines=False):
+    """
+    Выгрузка товаров потоком байтов: JSON-массив или JSON Lines (lines=True).
+    Товары читаются серверным курсором частями по EXPORT_CHUNK_SIZE, поэтому память
+    не зависит от размера каталога.
+    """
+    values = queryset.order_by('id').values_list(*product_export_rows.lookups).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE)
+    if not lines:
+        yield b'['
+    separator = b''
+    for chunk in batched(values, EXPORT_CHUNK_SIZE):
+        rows = [dumps(row) for row in product_export_rows.rows(chunk)]
+        if lines:
+            yield b'\n'.join(rows) + b'\n'
+        else:
+            yield separator + b','.join(rows)
+            separator = b','
+    if not lines:
+        yield b']'
+
+
+def gzip_stream(chunks):
+    """
+    Сжимает поток байтов в gzip по мере чтения
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
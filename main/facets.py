@@ -0,0 +1,118 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+
+from .models import Category, CategoryFacet, Parameter, ProductParameter
+
+# Сколько строк сводки записывать одним запросом
+FACETS_BATCH_SIZE = 10000
+
+
+class FilterError(ValueError):
+    pass
+
+
+def parameter_filters(values):
+    """
+    Разбирает параметры запроса вида parameter=Цвет:черный в словарь имя -> список значений
+    """
+    filters = defaultdict(list)
+    for value in values:
+        name, separator, parameter_value = value.partition(':')
+        if not separator or not name:
+            raise FilterError('Фильтр по параметру задается как parameter=Имя:значение')
+        filters[name].append(parameter_value)
+    return filters
+
+
+def catalog_ids(params):
+    """
+    Условие на магазин и категорию из параметров запроса shop_id и category_id
+    """
+    query = Q()
+    for param in ('shop_id', 'category_id'):
+        value = params.get(param)
+        if not value:
+            continue
+        if not value.isdigit():
+            raise FilterError(f'{param} - целое число')
+        query &= Q(**{param: int(value)})
+    return query
+
+
+def price_range(params):
+    """
+    Условие на рекомендуемую розничную цену из параметров запроса price_min и price_max
+    """
+    query = Q()
+    for param, lookup in (('price_min', 'gte'), ('price_max', 'lte')):
+        value = params.get(param)
+        if not value:
+            continue
+        try:
+            price = int(value)
+        except ValueError:
+            price = -1
+        if price < 0:
+            raise FilterError(f'{param} - целое неотрицательное число')
+        query &= Q(**{f'price_rrc__{lookup}': price})
+    return query
+
+
+def filter_by_parameters(queryset, filters):
+    """
+    Товары, у которых есть все параметры из filters с одним из указанных значений.
+    Каждое условие - подзапрос EXISTS по индексу (parameter, value, product)
+    """
+    if not filters:
+        return queryset
+    parameters = dict(Parameter.objects.filter(name__in=filters).values_list('name', 'id'))
+    if len(parameters) < len(filters):
+        return queryset.none()
+    for name, values in filters.items():
+        queryset = queryset.filter(Exists(ProductParameter.objects.filter(
+            product=OuterRef('pk'), parameter_id=parameters[name], value__in=values)))
+    return queryset
+
+
+def group_facets(rows):
+    facets = defaultdict(dict)
+    for name, value, count in rows:
+        facets[name][value] = count
+    return facets
+
+
+def facet_counts(queryset):
+    """
+    Число товаров queryset с каждым значением каждого параметра одним запросом с группировкой
+    """
+    return group_facets(ProductParameter.objects.filter(product__in=queryset.values('id')).order_by().values_list(
+        'parameter__name', 'value').annotate(count=Count('id')))
+
+
+def category_facets(category_id):
+    """
+    Заранее посчитанная сводка значений параметров категории
+    """
+    return group_facets(CategoryFacet.objects.filter(category_id=category_id).values_list(
+        'parameter__name', 'value', 'count'))
+
+
+def refresh_facets(category_ids):
+    """
+    Пересчитывает сводку значений параметров категорий по товарам в продаже.
+    Категории блокируются по возрастанию id, поэтому загрузки магазинов с общими категориями
+    пересчитывают их по очереди и без взаимных блокировок.
+    """
+    with transaction.atomic():
+        category_ids = list(Category.objects.select_for_update().filter(id__in=category_ids).order_by(
+            'id').values_list('id', flat=True))
+        CategoryFacet.objects.filter(category_id__in=category_ids).delete()
+        counts = ProductParameter.objects.filter(
+            product__category_id__in=category_ids, product__is_active=True).order_by().values_list(
+            'product__category_id', 'parameter_id', 'value').annotate(count=Count('id'))
+        CategoryFacet.objects.bulk_create([
+            CategoryFacet(category_id=category_id, parameter_id=parameter_id, value=value, count=count)
+            for category_id, parameter_id, value, count in counts
+        ], batch_size=FACETS_BATCH_SIZE)
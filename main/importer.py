@@ -0,0 +1,293 @@
+from hashlib import blake2b
+from itertools import islice
+from datetime import timedelta
+from time import monotonic
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Max
+from django.utils.timezone import now
+from ujson import dumps as dump_json
+
+from .interning import parameter_cache, category_cache
+from .facets import refresh_facets
+from .counters import refresh_counters
+from .models import Shop, Category, Product, ProductParameter, CatalogVersion, StagedProduct
+
+# Размер пачки для групповых запросов к базе
+BATCH_SIZE = 1000
+# Позиций прайс-листа в одной части, которая обрабатывается отдельной задачей celery
+CHUNK_SIZE = 10000
+# Сколько хранятся устаревшие версии каталога и сколько ждать публикации незавершенной
+VERSION_TTL = timedelta(days=1)
+# Значений параметров в одном INSERT (не упираемся в лимит 65535 аргументов запроса)
+PARAMETERS_BATCH_SIZE = 10000
+
+
+def batched(iterable, size):
+    """
+    Разбивает последовательность на списки длиной не больше size
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_categories(categories):
+    """
+    Создает или переименовывает категории. Строки вставляются в порядке id,
+    поэтому параллельные загрузки разных магазинов не блокируют друг друга взаимно.
+    Категории, которые уже есть в кеше с тем же id и именем, не перезаписываются.
+    """
+    categories = sorted((category for category in categories
+                         if category_cache.get(category['name']) != category['id']),
+                        key=lambda category: category['id'])
+    if not categories:
+        return
+    Category.objects.bulk_create([Category(id=category['id'], name=category['name']) for category in categories],
+                                 update_conflicts=True, unique_fields=['id'], update_fields=['name'],
+                                 batch_size=BATCH_SIZE)
+    transaction.on_commit(lambda: category_cache.remember(
+        {category['name']: category['id'] for category in categories}))
+
+
+def link_categories(shop, category_ids):
+    """
+    Привязывает категории к магазину
+    """
+    through = Category.shops.through
+    through.objects.bulk_create([through(category_id=category_id, shop_id=shop.id)
+                                 for category_id in sorted(category_ids)],
+                                ignore_conflicts=True, batch_size=BATCH_SIZE)
+
+
+# Поля товара, которые берутся из прайс-листа и сравниваются при синхронизации
+PRODUCT_FIELDS = ('category_id', 'model', 'name', 'price', 'price_rrc', 'quantity', 'is_active')
+
+
+def product_key(item):
+    """
+    Стабильный ключ товара внутри магазина: id из прайс-листа, а если его нет - модель
+    """
+    return str(item.get('id', item['model']))
+
+
+def product_values(item):
+    """
+    Значения полей PRODUCT_FIELDS для позиции прайс-листа
+    """
+    return (item['category'], item['model'], item['name'], item['price'], item['price_rrc'], item['quantity'], True)
+
+
+def product_parameters(item):
+    """
+    Параметры позиции прайс-листа в том виде, в котором они хранятся в базе
+    """
+    return {name: str(value) for name, value in item.get('parameters', {}).items()}
+
+
+def product_fingerprint(item):
+    """
+    Хеш всех данных позиции прайс-листа: меняется, только если изменился сам товар или его параметры
+    """
+    data = dump_json([product_values(item), sorted(product_parameters(item).items())], ensure_ascii=False)
+    return blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+def write_parameters(products):
+    """
+    Перезаписывает параметры товаров. products - словарь id товара -> {имя параметра: значение}
+    """
+    if not products:
+        return
+    parameters = parameter_cache.resolve(name for values in products.values() for name in values)
+    ProductParameter.objects.filter(product_id__in=products).delete()
+    ProductParameter.objects.bulk_create([
+        ProductParameter(product_id=product_id, parameter_id=parameters[name], value=value)
+        for product_id, values in products.items()
+        for name, value in values.items()
+    ], batch_size=PARAMETERS_BATCH_SIZE)
+
+
+def staged_item(item):
+    """
+    Позиция прайс-листа для хранения в JSON: значения параметров уже строками,
+    как в базе (YAML, например, читает дату без кавычек как datetime.date)
+    """
+    return {**item, 'parameters': product_parameters(item)}
+
+
+def create_version(shop):
+    """
+    Заводит новую версию каталога магазина со следующим номером
+    """
+    with transaction.atomic():
+        shop = Shop.objects.select_for_update().get(id=shop.id)
+        number = shop.catalog_versions.aggregate(number=Max('number'))['number'] or 0
+        return CatalogVersion.objects.create(shop=shop, number=number + 1, base=shop.catalog_version)
+
+
+def stage_price_list(shop, data, batch_size=BATCH_SIZE, timings=None):
+    """
+    Первый этап загрузки: создает категории и записывает товары прайс-листа
+    в новую неопубликованную версию каталога. Возвращает эту версию.
+    В timings, если он передан, добавляется время разбора (parse) и записи в базу (db_write).
+    """
+    timings = {} if timings is None else timings
+    timings.setdefault('parse', 0)
+    timings.setdefault('db_write', 0)
+    version = create_version(shop)
+    category_cache.warm()
+    parameter_cache.warm()
+    with transaction.atomic():
+        import_categories(data.get('categories', []))
+        batches = batched(data.get('goods', []), batch_size)
+        while True:
+            started = monotonic()
+            batch = next(batches, None)
+            timings['parse'] += monotonic() - started
+            if batch is None:
+                break
+            started = monotonic()
+            StagedProduct.objects.bulk_create([
+                StagedProduct(version=version, position=version.size + position, external_id=product_key(item),
+                              data=staged_item(item))
+                for position, item in enumerate(batch)
+            ])
+            timings['db_write'] += monotonic() - started
+            version.size += len(batch)
+        version.save(update_fields=['size'])
+    return version
+
+
+def plan_chunk(version, start, end, batch_size=BATCH_SIZE):
+    """
+    Второй этап: сравнивает позиции версии с номерами [start, end) с опубликованным каталогом
+    и отмечает, какие товары нужно добавить или обновить. Каталог при этом не меняется,
+    поэтому части одной версии можно обрабатывать параллельно.
+    """
+    with transaction.atomic():
+        staged = version.staged_products.filter(position__gte=start, position__lt=end).order_by('position')
+        for batch in batched(staged.iterator(chunk_size=batch_size), batch_size):
+            matched = {
+                external_id: (product_id, fingerprint, is_active)
+                for external_id, product_id, fingerprint, is_active in Product.objects.filter(
+                    shop=version.shop_id, external_id__in=[row.external_id for row in batch]).values_list(
+                    'external_id', 'id', 'fingerprint', 'is_active')
+            }
+            for row in batch:
+                row.fingerprint = product_fingerprint(row.data)
+                if row.external_id not in matched:
+                    row.product_id, row.action, row.parameters_changed = None, 'insert', True
+                    continue
+                product_id, fingerprint, is_active = matched[row.external_id]
+                row.product_id = product_id
+                row.action = 'skip' if (fingerprint, is_active) == (row.fingerprint, True) else 'update'
+
+            changed = {row.product_id: row for row in batch if row.action == 'update'}
+            stored = {}
+            for product_id, name, value in ProductParameter.objects.filter(product_id__in=changed).values_list(
+                    'product_id', 'parameter__name', 'value'):
+                stored.setdefault(product_id, {})[name] = value
+            for row in batch:
+                if row.action != 'insert':
+                    row.parameters_changed = row.action == 'update' and (
+                        stored.get(row.product_id, {}) != product_parameters(row.data))
+
+            parameter_cache.resolve(name for row in batch if row.parameters_changed
+                                    for name in row.data.get('parameters', {}))
+            StagedProduct.objects.bulk_update(batch, ['fingerprint', 'product', 'action', 'parameters_changed'])
+
+
+def publish(version, category_ids, fingerprint=None, batch_size=BATCH_SIZE):
+    """
+    Последний этап: в одной транзакции применяет к каталогу изменения версии (только добавленные
+    и измененные товары, отмеченные plan_chunk), снимает с продажи товары, которых в ней нет,
+    привязывает категории к магазину и переключает Shop.catalog_version на эту версию.
+    Покупатели видят либо прежнюю версию каталога, либо новую целиком. Транзакция держит блокировку
+    магазина, поэтому ее длительность растет с числом изменений, но не с размером прайс-листа.
+    Если тем временем уже опубликована более новая версия, эта помечается устаревшей и возвращается None.
+    Версию, которую collect_versions уже пометил ошибочной или удалил, тоже не публикует и возвращает None.
+    """
+    result = {'inserted': 0, 'updated': 0, 'deactivated': 0}
+    with transaction.atomic():
+        shop = Shop.objects.select_for_update().get(id=version.shop_id)
+        # блокировка версии ждет или опережает collect_versions, который помечает ее ошибочной и удаляет
+        state = CatalogVersion.objects.select_for_update().filter(id=version.id).values_list('state', flat=True)
+        if state.first() != 'building':
+            return None
+        if version.number < shop.catalog_version:
+            CatalogVersion.objects.filter(id=version.id).update(state='retired')
+            return None
+        if version.base != shop.catalog_version:
+            # Пока версия готовилась, опубликовали другую - сравниваем заново с актуальным каталогом
+            plan_chunk(version, 0, version.size, batch_size)
+
+        staged = version.staged_products.filter(action__in=['insert', 'update']).order_by('position')
+        for batch in batched(staged.iterator(chunk_size=batch_size), batch_size):
+            created = {row.external_id: row for row in batch if row.action == 'insert'}
+            changed = [row for row in batch if row.action == 'update']
+            changed_parameters = {row.product_id: product_parameters(row.data)
+                                  for row in changed if row.parameters_changed}
+
+            if created:
+                Product.objects.bulk_create([
+                    Product(shop=shop, external_id=key, fingerprint=row.fingerprint,
+                            **dict(zip(PRODUCT_FIELDS, product_values(row.data))))
+                    for key, row in created.items()
+                ], update_conflicts=True, unique_fields=['shop', 'external_id'],
+                    update_fields=PRODUCT_FIELDS + ('fingerprint', 'updated_at'))
+                created_ids = dict(Product.objects.filter(shop=shop, external_id__in=created).values_list(
+                    'id', 'external_id'))
+                for product_id, key in created_ids.items():
+                    changed_parameters[product_id] = product_parameters(created[key].data)
+            if changed:
+                updated_at = now()
+                Product.objects.bulk_update([
+                    Product(id=row.product_id, fingerprint=row.fingerprint, updated_at=updated_at,
+                            **dict(zip(PRODUCT_FIELDS, product_values(row.data))))
+                    for row in changed
+                ], PRODUCT_FIELDS + ('fingerprint', 'updated_at'))
+            write_parameters(changed_parameters)
+
+            result['inserted'] += len(created)
+            result['updated'] += len(changed)
+
+        result['deactivated'] = Product.objects.filter(shop=shop, is_active=True).exclude(
+            Exists(version.staged_products.filter(external_id=OuterRef('external_id')))).update(
+            is_active=False, updated_at=now())
+        link_categories(shop, category_ids)
+
+        CatalogVersion.objects.filter(shop=shop, state='live').update(state='retired')
+        CatalogVersion.objects.filter(id=version.id).update(state='live', published_at=now())
+        Shop.objects.filter(id=shop.id).update(catalog_version=version.number, **(fingerprint or {}))
+    return result
+
+
+def collect_versions(ttl=VERSION_TTL):
+    """
+    Сборка мусора: удаляет позиции уже опубликованных и устаревших версий,
+    помечает ошибочными версии, которые не удалось опубликовать за ttl,
+    и удаляет устаревшие версии старше ttl. Опубликованная версия остается.
+    """
+    deadline = now() - ttl
+    CatalogVersion.objects.filter(state='building', created_at__lt=deadline).update(state='failed')
+    StagedProduct.objects.exclude(version__state='building').delete()
+    CatalogVersion.objects.filter(state__in=['retired', 'failed'], created_at__lt=deadline).delete()
+
+
+def import_price_list(shop, data, batch_size=BATCH_SIZE):
+    """
+    Загружает прайс-лист магазина целиком в текущем процессе и в одной транзакции
+    """
+    with transaction.atomic():
+        version = stage_price_list(shop, data, batch_size)
+        plan_chunk(version, 0, version.size, batch_size)
+        result = publish(version, [category['id'] for category in data.get('categories', [])],
+                         batch_size=batch_size)
+        if result is not None:
+            refresh_facets(Category.objects.filter(shops=shop).values_list('id', flat=True))
+            refresh_counters(shop.id)
+    return result
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+from django.db import transaction
+
+from .models import Category, Parameter
+
+# Сколько имен держать в кеше одного процесса
+MAXSIZE = 10000
+
+
+class InternCache:
+    """
+    Ограниченный по размеру (LRU) кеш имя -> id для справочников, которые повторяются
+    в каждой позиции прайс-листа. Живет в процессе воркера и переиспользуется всеми
+    частями загрузки, которые этот воркер обрабатывает.
+    """
+
+    def __init__(self, model, maxsize=MAXSIZE, create=False):
+        self.model = model
+        self.maxsize = maxsize
+        self.create = create
+        self.ids = OrderedDict()
+        self.warmed = False
+
+    def warm(self):
+        """
+        Заполняет кеш из базы. Вызывается один раз в начале загрузки
+        """
+        self.ids = OrderedDict(self.model.objects.order_by('id').values_list('name', 'id')[:self.maxsize])
+        self.warmed = True
+
+    def clear(self):
+        self.ids = OrderedDict()
+        self.warmed = False
+
+    def get(self, name):
+        return self.ids.get(name)
+
+    def remember(self, ids):
+        for name, pk in ids.items():
+            self.ids[name] = pk
+            self.ids.move_to_end(name)
+        while len(self.ids) > self.maxsize:
+            self.ids.popitem(last=False)
+
+    def resolve(self, names):
+        """
+        Возвращает словарь имя -> id для всех names. Имена, которых нет в кеше,
+        ищутся одним запросом, а если create - недостающие сначала создаются одним
+        INSERT ... ON CONFLICT DO NOTHING в отсортированном порядке, чтобы параллельные
+        загрузки не попадали в deadlock. Новые id попадают в кеш только после фиксации
+        транзакции, чтобы откат не оставил в нем несуществующих строк.
+        """
+        if not self.warmed:
+            self.warm()
+        result, missing = {}, set()
+        for name in set(names):
+            if name in self.ids:
+                result[name] = self.ids[name]
+                self.ids.move_to_end(name)
+            else:
+                missing.add(name)
+        if missing:
+            missing = sorted(missing)
+            if self.create:
+                self.model.objects.bulk_create([self.model(name=name) for name in missing], ignore_conflicts=True)
+            found = dict(self.model.objects.filter(name__in=missing).values_list('name', 'id'))
+            result.update(found)
+            transaction.on_commit(lambda: self.remember(found))
+        return result
+
+
+parameter_cache = InternCache(Parameter, create=True)
+category_cache = InternCache(Category)
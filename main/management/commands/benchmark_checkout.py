@@ -0,0 +1,23 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmark import run_checkout_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест оформления заказов: покупатели одновременно оформляют корзины из общих товаров. '
+            'Проверяет, что остатки не уходят в минус, и измеряет число заказов в секунду')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=10)
+        parser.add_argument('--stock', type=int, default=200)
+        parser.add_argument('--threads', type=int, default=16)
+
+    def handle(self, *args, **options):
+        result = run_checkout_benchmark(options['buyers'], options['products'], options['stock'], options['threads'])
+        self.stdout.write(json.dumps(result))
+        if result['mismatched']:
+            raise CommandError('Остаток не сходится с оформленными заказами: ' +
+                               ', '.join(map(str, result['mismatched'])))
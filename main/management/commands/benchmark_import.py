@@ -0,0 +1,42 @@
+import json
+from tempfile import TemporaryFile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmark import generate_price_list, run_benchmark, compare, THRESHOLD
+
+
+class Command(BaseCommand):
+    help = ('Замеряет загрузку синтетических прайс-листов: время, число запросов, пиковую память '
+            'и скорость. С --baseline завершается ошибкой, если метрики хуже эталона больше чем на --threshold')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--format', choices=('yaml', 'jsonl'), default='yaml')
+        parser.add_argument('--baseline', help='JSON-файл с эталонными метриками')
+        parser.add_argument('--threshold', type=float, default=THRESHOLD)
+        parser.add_argument('--save', action='store_true', help='Записать результаты в --baseline')
+
+    def handle(self, *args, **options):
+        results = {}
+        for size in sorted(options['sizes']):
+            with TemporaryFile('w+b') as file:
+                with open(file.fileno(), 'w', encoding='utf-8', closefd=False) as stream:
+                    generate_price_list(stream, size, options['format'])
+                file.seek(0)
+                results[str(size)] = run_benchmark(file, options['format'])
+            self.stdout.write(f'{size}: {json.dumps(results[str(size)])}')
+
+        if not options['baseline']:
+            return
+        if options['save']:
+            with open(options['baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2)
+            return
+
+        with open(options['baseline']) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = [f'{size} {regression}' for size, result in results.items()
+                       for regression in compare(result, baseline.get(size, {}), options['threshold'])]
+        if regressions:
+            raise CommandError('Загрузка стала медленнее эталона: ' + '; '.join(regressions))
@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.benchmark import populate_catalog, run_search_benchmark, SEARCH_QUERIES, SEARCH_THRESHOLD
+
+
+class Command(BaseCommand):
+    help = ('Замеряет полнотекстовый поиск товаров на синтетическом каталоге заданного размера. '
+            'Завершается ошибкой, если 95-й перцентиль времени запроса больше --threshold мс')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--threshold', type=float, default=SEARCH_THRESHOLD)
+        parser.add_argument('--query', action='append', dest='queries', help='Поисковый запрос (можно несколько)')
+
+    def handle(self, *args, **options):
+        # каталог заполняется в транзакции, которая затем откатывается
+        with transaction.atomic():
+            populate_catalog(options['size'])
+            results = run_search_benchmark(options['queries'] or SEARCH_QUERIES, options['repeat'])
+            transaction.set_rollback(True)
+
+        for text, timings in results.items():
+            self.stdout.write(f'{text}: {json.dumps(timings)}')
+        slow = [text for text, timings in results.items() if timings['p95'] > options['threshold']]
+        if slow:
+            raise CommandError(f'Поиск дольше {options["threshold"]} мс: ' + '; '.join(slow))
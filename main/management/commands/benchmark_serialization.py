@@ -0,0 +1,25 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main.benchmark import populate_catalog, run_serialization_benchmark
+from main.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает сериализацию списка товаров через ProductSerializer и быструю сериализацию '
+            'из values_list() на синтетических каталогах заданных размеров')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            # каталог заполняется в транзакции, которая затем откатывается
+            with transaction.atomic():
+                shop = populate_catalog(size)
+                result = run_serialization_benchmark(
+                    Product.objects.filter(shop=shop).order_by('category', '-name', 'id'))
+                transaction.set_rollback(True)
+            self.stdout.write(f'{size}: {json.dumps(result)}')
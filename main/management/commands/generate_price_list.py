@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from main.benchmark import generate_price_list
+
+
+class Command(BaseCommand):
+    help = 'Создает синтетический прайс-лист заданного размера для нагрузочного тестирования загрузки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('size', type=int, help='Количество товаров')
+        parser.add_argument('output', help='Путь к создаваемому файлу')
+        parser.add_argument('--format', choices=('yaml', 'jsonl'), default='yaml')
+        parser.add_argument('--shop', default='Синтетический магазин')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with open(options['output'], 'w', encoding='utf-8') as stream:
+            generate_price_list(stream, options['size'], options['format'], options['shop'], options['seed'])
+        self.stdout.write(f'Создан прайс-лист {options["output"]} на {options["size"]} товаров')
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.4 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+def merge_duplicate_parameters(apps, schema_editor):
+    # Одновременные загрузки могли создать параметры с одинаковым именем: остается параметр с меньшим id,
+    # значения товаров переносятся на него, если у товара еще нет значения оставшегося параметра
+    Parameter = apps.get_model('main', 'Parameter')
+    ProductParameter = apps.get_model('main', 'ProductParameter')
+    duplicates = Parameter.objects.values('name').annotate(
+        keep=models.Min('id'), count=models.Count('id')).filter(count__gt=1).order_by()
+    for row in duplicates:
+        for parameter_id in Parameter.objects.filter(name=row['name']).exclude(id=row['keep']).order_by(
+                'id').values_list('id', flat=True):
+            values = ProductParameter.objects.filter(parameter_id=parameter_id)
+            values.filter(product_id__in=ProductParameter.objects.filter(
+                parameter_id=row['keep']).values('product_id')).delete()
+            values.update(parameter_id=row['keep'])
+            Parameter.objects.filter(id=parameter_id).delete()
+    # отложенные проверки внешних ключей - до изменения таблицы в той же транзакции
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_parameters, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='parameter',
+            constraint=models.UniqueConstraint(fields=('name',), name='unique_parameter_name'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.1.4 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_parameter_unique_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=200, null=True, verbose_name='Идентификатор в прайс-листе'),
+        ),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('shop', 'external_id'), name='unique_shop_product'),
+        ),
+    ]
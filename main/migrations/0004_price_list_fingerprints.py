@@ -0,0 +1,33 @@
+# Generated by Django 4.1.4 on 2026-10-18 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_product_external_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=32, verbose_name='Хеш данных из прайс-листа'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Хеш содержимого прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='etag',
+            field=models.CharField(blank=True, max_length=200, verbose_name='ETag прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=100, verbose_name='Last-Modified прайса'),
+        ),
+    ]
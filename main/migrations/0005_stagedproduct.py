@@ -0,0 +1,41 @@
+# Generated by Django 4.1.4 on 2026-10-18 14:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_price_list_fingerprints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StagedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run', models.UUIDField(verbose_name='Загрузка')),
+                ('position', models.PositiveIntegerField(verbose_name='Номер позиции в прайс-листе')),
+                ('external_id', models.CharField(max_length=200, verbose_name='Идентификатор в прайс-листе')),
+                ('data', models.JSONField(verbose_name='Позиция прайс-листа')),
+                ('fingerprint', models.CharField(blank=True, max_length=32, verbose_name='Хеш данных из прайс-листа')),
+                ('action', models.CharField(blank=True, choices=[('insert', 'Новый товар'), ('update', 'Товар изменился'), ('skip', 'Без изменений')], max_length=10, verbose_name='Действие')),
+                ('parameters_changed', models.BooleanField(default=False, verbose_name='Параметры изменились')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.product', verbose_name='Продукт')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='staged_products', to='main.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Позиция загрузки',
+                'verbose_name_plural': 'Список позиций загрузки',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stagedproduct',
+            index=models.Index(fields=['run', 'position'], name='staged_run_position'),
+        ),
+        migrations.AddIndex(
+            model_name='stagedproduct',
+            index=models.Index(fields=['run', 'external_id'], name='staged_run_external_id'),
+        ),
+    ]
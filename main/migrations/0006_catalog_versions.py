@@ -0,0 +1,81 @@
+# Generated by Django 4.1.4 on 2026-10-18 14:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_staged_products(apps, schema_editor):
+    # Незавершенные загрузки не привязаны ни к одной версии каталога
+    apps.get_model('main', 'StagedProduct').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_stagedproduct'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_staged_products, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='Номер версии')),
+                ('base', models.PositiveIntegerField(default=0, verbose_name='Опубликованная версия на момент загрузки')),
+                ('state', models.CharField(choices=[('building', 'Загружается'), ('live', 'Опубликована'), ('retired', 'Устарела'), ('failed', 'Ошибка загрузки')], default='building', max_length=10, verbose_name='Статус')),
+                ('size', models.PositiveIntegerField(default=0, verbose_name='Количество позиций')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('published_at', models.DateTimeField(blank=True, null=True, verbose_name='Время публикации')),
+            ],
+            options={
+                'verbose_name': 'Версия каталога',
+                'verbose_name_plural': 'Список версий каталога',
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='stagedproduct',
+            name='staged_run_position',
+        ),
+        migrations.RemoveIndex(
+            model_name='stagedproduct',
+            name='staged_run_external_id',
+        ),
+        migrations.RemoveField(
+            model_name='stagedproduct',
+            name='run',
+        ),
+        migrations.RemoveField(
+            model_name='stagedproduct',
+            name='shop',
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='catalog_version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Опубликованная версия каталога'),
+        ),
+        migrations.AddField(
+            model_name='catalogversion',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_versions', to='main.shop', verbose_name='Магазин'),
+        ),
+        migrations.AddField(
+            model_name='stagedproduct',
+            name='version',
+            field=models.ForeignKey(default=0, on_delete=django.db.models.deletion.CASCADE, related_name='staged_products', to='main.catalogversion', verbose_name='Версия каталога'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='stagedproduct',
+            index=models.Index(fields=['version', 'position'], name='staged_version_position'),
+        ),
+        migrations.AddIndex(
+            model_name='stagedproduct',
+            index=models.Index(fields=['version', 'external_id'], name='staged_version_external_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='catalogversion',
+            constraint=models.UniqueConstraint(fields=('shop', 'number'), name='unique_catalog_version'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.1.4 on 2026-10-18 14:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_catalog_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(verbose_name='Ссылка на прайс')),
+                ('state', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершена'), ('not_modified', 'Прайс-лист не изменился'), ('failed', 'Ошибка')], default='queued', max_length=15, verbose_name='Статус')),
+                ('rows_total', models.PositiveIntegerField(default=0, verbose_name='Позиций в прайс-листе')),
+                ('rows_processed', models.PositiveIntegerField(default=0, verbose_name='Обработано позиций')),
+                ('download_time', models.FloatField(default=0, verbose_name='Скачивание')),
+                ('parse_time', models.FloatField(default=0, verbose_name='Разбор')),
+                ('db_write_time', models.FloatField(default=0, verbose_name='Запись позиций')),
+                ('plan_time', models.FloatField(default=0, verbose_name='Сравнение с каталогом')),
+                ('finalize_time', models.FloatField(default=0, verbose_name='Публикация')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Результат')),
+                ('errors', models.TextField(blank=True, verbose_name='Ошибки')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Время завершения')),
+                ('shop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='import_runs', to='main.shop', verbose_name='Магазин')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_runs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('version', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='import_runs', to='main.catalogversion', verbose_name='Версия каталога')),
+            ],
+            options={
+                'verbose_name': 'Загрузка прайс-листа',
+                'verbose_name_plural': 'Список загрузок прайс-листов',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
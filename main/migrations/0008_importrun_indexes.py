@@ -0,0 +1,21 @@
+# Generated by Django 4.1.4 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_importrun'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='importrun',
+            index=models.Index(fields=['shop', '-finished_at'], name='import_run_shop_finished'),
+        ),
+        migrations.AddIndex(
+            model_name='importrun',
+            index=models.Index(fields=['state', 'created_at'], name='import_run_state_created'),
+        ),
+    ]
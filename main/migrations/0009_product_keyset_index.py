@@ -0,0 +1,17 @@
+# Generated by Django 4.1.4 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_importrun_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-name', 'id'], name='product_category_name_id'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.1.4 on 2026-10-18 14:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+FILL_FACETS = """
+INSERT INTO main_categoryfacet (category_id, parameter_id, value, count)
+SELECT product.category_id, parameter.parameter_id, parameter.value, count(*)
+FROM main_productparameter parameter JOIN main_product product ON product.id = parameter.product_id
+WHERE product.is_active
+GROUP BY product.category_id, parameter.parameter_id, parameter.value
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=100, verbose_name='Значение')),
+                ('count', models.PositiveIntegerField(verbose_name='Количество товаров')),
+            ],
+            options={
+                'verbose_name': 'Значение параметра в категории',
+                'verbose_name_plural': 'Значения параметров в категориях',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productparameter',
+            index=models.Index(fields=['parameter', 'value', 'product'], name='product_parameter_value'),
+        ),
+        migrations.AddField(
+            model_name='categoryfacet',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='main.category', verbose_name='Категория'),
+        ),
+        migrations.AddField(
+            model_name='categoryfacet',
+            name='parameter',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='main.parameter', verbose_name='Параметр'),
+        ),
+        migrations.AddConstraint(
+            model_name='categoryfacet',
+            constraint=models.UniqueConstraint(fields=('category', 'parameter', 'value'), name='unique_category_facet'),
+        ),
+        migrations.RunSQL(FILL_FACETS, migrations.RunSQL.noop),
+    ]
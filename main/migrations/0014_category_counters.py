@@ -0,0 +1,96 @@
+# Generated by Django 4.1.4 on 2026-10-18 15:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+FILL_COUNTERS = """
+UPDATE main_category_shops link
+SET product_count = counters.product_count, in_stock_count = counters.in_stock_count,
+    min_price = counters.min_price, max_price = counters.max_price
+FROM (SELECT category_id, shop_id, count(*) AS product_count, count(*) FILTER (WHERE quantity > 0) AS in_stock_count,
+             min(price_rrc) AS min_price, max(price_rrc) AS max_price
+      FROM main_product WHERE is_active GROUP BY category_id, shop_id) counters
+WHERE link.category_id = counters.category_id AND link.shop_id = counters.shop_id;
+
+UPDATE main_category category
+SET product_count = totals.product_count, in_stock_count = totals.in_stock_count,
+    min_price = totals.min_price, max_price = totals.max_price
+FROM (SELECT category_id, sum(product_count) AS product_count, sum(in_stock_count) AS in_stock_count,
+             min(min_price) AS min_price, max(max_price) AS max_price
+      FROM main_category_shops GROUP BY category_id) totals
+WHERE category.id = totals.category_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_product_listing_indexes'),
+    ]
+
+    operations = [
+        # связь категорий с магазинами становится явной моделью на той же таблице
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='ShopCategory',
+                fields=[
+                    ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.category', verbose_name='Категория')),
+                    ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.shop', verbose_name='Магазин')),
+                ],
+                options={
+                    'verbose_name': 'Категория магазина',
+                    'verbose_name_plural': 'Список категорий магазинов',
+                    'db_table': 'main_category_shops',
+                    'unique_together': {('category', 'shop')},
+                },
+            ),
+            migrations.AlterField(
+                model_name='category',
+                name='shops',
+                field=models.ManyToManyField(blank=True, related_name='categories', through='main.ShopCategory', to='main.shop', verbose_name='Магазины'),
+            ),
+        ]),
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Товаров в продаже'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='in_stock_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Товаров в наличии'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='min_price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Минимальная цена'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='max_price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Максимальная цена'),
+        ),
+        migrations.AddField(
+            model_name='shopcategory',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Товаров в продаже'),
+        ),
+        migrations.AddField(
+            model_name='shopcategory',
+            name='in_stock_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Товаров в наличии'),
+        ),
+        migrations.AddField(
+            model_name='shopcategory',
+            name='min_price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Минимальная цена'),
+        ),
+        migrations.AddField(
+            model_name='shopcategory',
+            name='max_price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Максимальная цена'),
+        ),
+        migrations.RunSQL(FILL_COUNTERS, migrations.RunSQL.noop),
+    ]
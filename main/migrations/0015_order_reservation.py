@@ -0,0 +1,22 @@
+# Generated by Django 4.1.4 on 2026-10-18 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_category_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='reserved_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Товары зарезервированы до'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('order_state', 'new')), fields=['reserved_until'], name='order_reservation'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.1.4 on 2026-10-18 15:19
+
+from django.db import migrations, models
+
+
+FILL_TOTALS = """
+UPDATE main_orderitem item SET price = product.price_rrc
+FROM main_order o, main_product product
+WHERE o.id = item.order_id AND o.order_state <> 'basket' AND product.id = item.product_id;
+
+UPDATE main_order o SET items_count = totals.items_count, total_sum = totals.total_sum
+FROM (SELECT item.order_id, sum(item.quantity) AS items_count,
+             sum(item.quantity * coalesce(item.price, product.price_rrc)) AS total_sum
+      FROM main_orderitem item JOIN main_product product ON product.id = item.product_id
+      GROUP BY item.order_id) totals
+WHERE o.id = totals.order_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_order_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество товаров'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_sum',
+            field=models.PositiveIntegerField(default=0, verbose_name='Сумма заказа'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Цена при оформлении'),
+        ),
+        migrations.RunSQL(FILL_TOTALS, migrations.RunSQL.noop),
+    ]
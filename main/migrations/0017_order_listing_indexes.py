@@ -0,0 +1,21 @@
+# Generated by Django 4.1.4 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-dt', '-id'], name='order_user_dt'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-dt', '-id'], name='order_dt'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:02
+
+from django.db import migrations
+
+
+# Поисковый документ товара поддерживается базой при любой записи товаров и параметров:
+# из импорта, админки или ORM. Триггер параметров срабатывает один раз на запрос,
+# поэтому групповые вставки параметров пересчитывают каждый товар один раз
+CREATE_TRIGGERS = """
+CREATE FUNCTION main_product_search_document(bigint, text, text) RETURNS tsvector
+LANGUAGE sql STABLE AS $$
+    SELECT setweight(to_tsvector('russian', coalesce($2, '')), 'A') ||
+           setweight(to_tsvector('russian', coalesce($3, '')), 'B') ||
+           setweight(to_tsvector('russian', coalesce((
+               SELECT string_agg(value, ' ') FROM main_productparameter WHERE product_id = $1), '')), 'C')
+$$;
+
+CREATE FUNCTION main_product_search_vector() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := main_product_search_document(NEW.id, NEW.name, NEW.model);
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER product_search_vector BEFORE INSERT OR UPDATE OF name, model ON main_product
+FOR EACH ROW EXECUTE FUNCTION main_product_search_vector();
+
+CREATE FUNCTION main_productparameter_search_vector() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE main_product SET search_vector = main_product_search_document(id, name, model)
+    WHERE id IN (SELECT product_id FROM changed_parameters);
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER productparameter_insert_search_vector AFTER INSERT ON main_productparameter
+REFERENCING NEW TABLE AS changed_parameters
+FOR EACH STATEMENT EXECUTE FUNCTION main_productparameter_search_vector();
+
+CREATE TRIGGER productparameter_update_search_vector AFTER UPDATE ON main_productparameter
+REFERENCING NEW TABLE AS changed_parameters
+FOR EACH STATEMENT EXECUTE FUNCTION main_productparameter_search_vector();
+
+CREATE TRIGGER productparameter_delete_search_vector AFTER DELETE ON main_productparameter
+REFERENCING OLD TABLE AS changed_parameters
+FOR EACH STATEMENT EXECUTE FUNCTION main_productparameter_search_vector();
+
+UPDATE main_product SET search_vector = main_product_search_document(id, name, model);
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER productparameter_delete_search_vector ON main_productparameter;
+DROP TRIGGER productparameter_update_search_vector ON main_productparameter;
+DROP TRIGGER productparameter_insert_search_vector ON main_productparameter;
+DROP FUNCTION main_productparameter_search_vector();
+DROP TRIGGER product_search_vector ON main_product;
+DROP FUNCTION main_product_search_vector();
+DROP FUNCTION main_product_search_document(bigint, text, text);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_order_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
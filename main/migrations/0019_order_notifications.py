@@ -0,0 +1,26 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+# письма о заказах, оформленных до отправки из очереди, уже отправлены
+MARK_NOTIFIED = "UPDATE main_order SET notifications_sent = 2 WHERE order_state <> 'basket'"
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_product_search_vector_triggers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='notifications_sent',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Отправлено писем о заказе'),
+        ),
+        migrations.RunSQL(MARK_NOTIFIED, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('notifications_sent__lt', 2), models.Q(('order_state', 'basket'), _negated=True)), fields=['id'], name='order_notification_pending'),
+        ),
+    ]
@@ -3,8 +3,9 @@ from datetime import datetime, timedelta
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractUser, PermissionsMixin
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
-from django.db.models import Sum
 from django.utils.translation import gettext_lazy as _
 from django_rest_passwordreset.tokens import get_token_generator
 
@@ -20,6 +21,30 @@ STATE_CHOICES = (
     ('canceled', 'Заказ отменен'),
 )
 
+# Писем о каждом оформленном заказе: покупателю и менеджерам
+ORDER_NOTIFICATIONS = 2
+
+CATALOG_VERSION_STATE_CHOICES = (
+    ('building', 'Загружается'),
+    ('live', 'Опубликована'),
+    ('retired', 'Устарела'),
+    ('failed', 'Ошибка загрузки'),
+)
+
+IMPORT_STATE_CHOICES = (
+    ('queued', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершена'),
+    ('not_modified', 'Прайс-лист не изменился'),
+    ('failed', 'Ошибка'),
+)
+
+STAGED_ACTION_CHOICES = (
+    ('insert', 'Новый товар'),
+    ('update', 'Товар изменился'),
+    ('skip', 'Без изменений'),
+)
+
 USER_TYPE_CHOICES = (
     ('shop', 'Магазин'),
     ('buyer', 'Покупатель'),
@@ -131,6 +156,10 @@ class Shop(models.Model):
     user = models.OneToOneField(User, verbose_name='Пользователь', blank=True, null=True,
                                 on_delete=models.CASCADE)
     state = models.BooleanField(verbose_name='Cтатус получения заказов', default=True)
+    etag = models.CharField(max_length=200, verbose_name='ETag прайса', blank=True)
+    last_modified = models.CharField(max_length=100, verbose_name='Last-Modified прайса', blank=True)
+    content_hash = models.CharField(max_length=64, verbose_name='Хеш содержимого прайса', blank=True)
+    catalog_version = models.PositiveIntegerField(verbose_name='Опубликованная версия каталога', default=0)
 
     class Meta:
         verbose_name = 'Магазин'
@@ -143,7 +172,13 @@ class Shop(models.Model):
 
 class Category(models.Model):
     name = models.CharField(max_length=40, verbose_name='Название')
-    shops = models.ManyToManyField(Shop, verbose_name='Магазины', related_name='categories', blank=True)
+    shops = models.ManyToManyField(Shop, verbose_name='Магазины', related_name='categories', blank=True,
+                                   through='ShopCategory')
+    # счетчики товаров в продаже всех магазинов, пересчитываются вместе с ShopCategory
+    product_count = models.PositiveIntegerField(verbose_name='Товаров в продаже', default=0)
+    in_stock_count = models.PositiveIntegerField(verbose_name='Товаров в наличии', default=0)
+    min_price = models.PositiveIntegerField(verbose_name='Минимальная цена', null=True, blank=True)
+    max_price = models.PositiveIntegerField(verbose_name='Максимальная цена', null=True, blank=True)
 
     class Meta:
         verbose_name = 'Категория'
@@ -154,6 +189,27 @@ class Category(models.Model):
         return self.name
 
 
+class ShopCategory(models.Model):
+    """
+    Связь категории с магазином и счетчики товаров магазина в продаже в этой категории
+    """
+    category = models.ForeignKey(Category, verbose_name='Категория', on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', on_delete=models.CASCADE)
+    product_count = models.PositiveIntegerField(verbose_name='Товаров в продаже', default=0)
+    in_stock_count = models.PositiveIntegerField(verbose_name='Товаров в наличии', default=0)
+    min_price = models.PositiveIntegerField(verbose_name='Минимальная цена', null=True, blank=True)
+    max_price = models.PositiveIntegerField(verbose_name='Максимальная цена', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Категория магазина'
+        verbose_name_plural = "Список категорий магазинов"
+        db_table = 'main_category_shops'
+        unique_together = [('category', 'shop')]
+
+    def __str__(self):
+        return f'{self.shop} - {self.category}'
+
+
 class Product(models.Model):
     category = models.ForeignKey(Category, verbose_name='Категория', related_name='products', blank=True,
                                  on_delete=models.CASCADE)
@@ -164,12 +220,34 @@ class Product(models.Model):
     quantity = models.PositiveIntegerField(verbose_name='Количество')
     shop = models.ForeignKey(Shop, verbose_name='Магазин', related_query_name='products', on_delete=models.CASCADE)
     is_active = models.BooleanField(verbose_name='В наличии', default=True)
-
+    external_id = models.CharField(max_length=200, verbose_name='Идентификатор в прайс-листе', null=True, blank=True)
+    fingerprint = models.CharField(max_length=32, verbose_name='Хеш данных из прайс-листа', blank=True)
+    search_vector = SearchVectorField(verbose_name='Поисковый документ', null=True, editable=False)
+    updated_at = models.DateTimeField(verbose_name='Дата изменения', auto_now=True)
 
     class Meta:
         verbose_name = 'Продукт'
         verbose_name_plural = "Список продуктов"
         ordering = ('category', '-name',)
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'external_id'], name='unique_shop_product'),
+        ]
+        indexes = [
+            models.Index(fields=['category', '-name', 'id'], name='product_category_name_id'),
+            GinIndex(fields=['search_vector'], name='product_search_vector'),
+            models.Index(fields=['updated_at'], name='product_updated_at'),
+            # списки товаров в продаже: магазина по категориям, по цене в категории, магазине и каталоге,
+            # по названию во всем каталоге
+            models.Index(fields=['shop', 'category', '-name', 'id'], condition=models.Q(is_active=True),
+                         name='product_active_shop_category'),
+            models.Index(fields=['category', 'price_rrc', 'id'], condition=models.Q(is_active=True),
+                         name='product_active_category_price'),
+            models.Index(fields=['shop', 'price_rrc', 'id'], condition=models.Q(is_active=True),
+                         name='product_active_shop_price'),
+            models.Index(fields=['price_rrc', 'id'], condition=models.Q(is_active=True),
+                         name='product_active_price'),
+            models.Index(fields=['-name', 'id'], condition=models.Q(is_active=True), name='product_active_name'),
+        ]
 
     def __str__(self):
         return self.name
@@ -182,6 +260,9 @@ class Parameter(models.Model):
         verbose_name = 'Имя параметра'
         verbose_name_plural = "Список имен параметров"
         ordering = ('-name',)
+        constraints = [
+            models.UniqueConstraint(fields=['name'], name='unique_parameter_name'),
+        ]
 
     def __str__(self):
         return self.name
@@ -201,6 +282,115 @@ class ProductParameter(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product', 'parameter'], name='unique_product_parameter'),
         ]
+        indexes = [
+            models.Index(fields=['parameter', 'value', 'product'], name='product_parameter_value'),
+        ]
+
+
+class CategoryFacet(models.Model):
+    """
+    Сколько товаров в продаже в категории имеют данное значение параметра.
+    Пересчитывается после каждой загрузки прайс-листа для категорий магазина.
+    """
+    category = models.ForeignKey(Category, verbose_name='Категория', related_name='facets', on_delete=models.CASCADE)
+    parameter = models.ForeignKey(Parameter, verbose_name='Параметр', related_name='facets',
+                                  on_delete=models.CASCADE)
+    value = models.CharField(verbose_name='Значение', max_length=100)
+    count = models.PositiveIntegerField(verbose_name='Количество товаров')
+
+    class Meta:
+        verbose_name = 'Значение параметра в категории'
+        verbose_name_plural = 'Значения параметров в категориях'
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'parameter', 'value'], name='unique_category_facet'),
+        ]
+
+
+class CatalogVersion(models.Model):
+    """
+    Версия каталога магазина, собранная из одного прайс-листа.
+    Становится видимой покупателям, когда Shop.catalog_version переключается на ее номер.
+    """
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='catalog_versions', on_delete=models.CASCADE)
+    number = models.PositiveIntegerField(verbose_name='Номер версии')
+    base = models.PositiveIntegerField(verbose_name='Опубликованная версия на момент загрузки', default=0)
+    state = models.CharField(verbose_name='Статус', choices=CATALOG_VERSION_STATE_CHOICES, max_length=10,
+                             default='building')
+    size = models.PositiveIntegerField(verbose_name='Количество позиций', default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(verbose_name='Время публикации', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Версия каталога'
+        verbose_name_plural = "Список версий каталога"
+        ordering = ('-created_at',)
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'number'], name='unique_catalog_version'),
+        ]
+
+    def __str__(self):
+        return f'{self.shop} v{self.number}'
+
+
+class StagedProduct(models.Model):
+    """
+    Позиция прайс-листа в версии каталога, которая еще не опубликована.
+    Заполняется на первом этапе импорта и применяется к Product одной транзакцией при публикации.
+    """
+    version = models.ForeignKey(CatalogVersion, verbose_name='Версия каталога', related_name='staged_products',
+                                on_delete=models.CASCADE)
+    position = models.PositiveIntegerField(verbose_name='Номер позиции в прайс-листе')
+    external_id = models.CharField(max_length=200, verbose_name='Идентификатор в прайс-листе')
+    data = models.JSONField(verbose_name='Позиция прайс-листа')
+    fingerprint = models.CharField(max_length=32, verbose_name='Хеш данных из прайс-листа', blank=True)
+    product = models.ForeignKey(Product, verbose_name='Продукт', related_name='+', blank=True, null=True,
+                                on_delete=models.CASCADE)
+    action = models.CharField(verbose_name='Действие', choices=STAGED_ACTION_CHOICES, max_length=10, blank=True)
+    parameters_changed = models.BooleanField(verbose_name='Параметры изменились', default=False)
+
+    class Meta:
+        verbose_name = 'Позиция загрузки'
+        verbose_name_plural = "Список позиций загрузки"
+        indexes = [
+            models.Index(fields=['version', 'position'], name='staged_version_position'),
+            models.Index(fields=['version', 'external_id'], name='staged_version_external_id'),
+        ]
+
+
+class ImportRun(models.Model):
+    """
+    Загрузка прайс-листа: состояние, прогресс и длительность каждого этапа в секундах
+    """
+    user = models.ForeignKey(User, verbose_name='Пользователь', related_name='import_runs', on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, verbose_name='Магазин', related_name='import_runs', blank=True, null=True,
+                             on_delete=models.CASCADE)
+    version = models.ForeignKey(CatalogVersion, verbose_name='Версия каталога', related_name='import_runs',
+                                blank=True, null=True, on_delete=models.SET_NULL)
+    url = models.URLField(verbose_name='Ссылка на прайс')
+    state = models.CharField(verbose_name='Статус', choices=IMPORT_STATE_CHOICES, max_length=15, default='queued')
+    rows_total = models.PositiveIntegerField(verbose_name='Позиций в прайс-листе', default=0)
+    rows_processed = models.PositiveIntegerField(verbose_name='Обработано позиций', default=0)
+    download_time = models.FloatField(verbose_name='Скачивание', default=0)
+    parse_time = models.FloatField(verbose_name='Разбор', default=0)
+    db_write_time = models.FloatField(verbose_name='Запись позиций', default=0)
+    plan_time = models.FloatField(verbose_name='Сравнение с каталогом', default=0)
+    finalize_time = models.FloatField(verbose_name='Публикация', default=0)
+    result = models.JSONField(verbose_name='Результат', blank=True, null=True)
+    errors = models.TextField(verbose_name='Ошибки', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(verbose_name='Время завершения', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'Загрузка прайс-листа'
+        verbose_name_plural = "Список загрузок прайс-листов"
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['shop', '-finished_at'], name='import_run_shop_finished'),
+            models.Index(fields=['state', 'created_at'], name='import_run_state_created'),
+        ]
+
+    def __str__(self):
+        return f'{self.url} ({self.state})'
 
 
 class Contact(models.Model):
@@ -233,18 +423,32 @@ class Order(models.Model):
     contact = models.ForeignKey(Contact, verbose_name='Контакт',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
+    reserved_until = models.DateTimeField(verbose_name='Товары зарезервированы до', null=True, blank=True)
+    # итоги заказа пересчитываются при каждом изменении позиций, после оформления - по ценам на момент оформления
+    items_count = models.PositiveIntegerField(verbose_name='Количество товаров', default=0)
+    total_sum = models.PositiveIntegerField(verbose_name='Сумма заказа', default=0)
+    # сколько писем о заказе из notifications.order_messages уже отправлено
+    notifications_sent = models.PositiveSmallIntegerField(verbose_name='Отправлено писем о заказе', default=0)
 
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = "Список заказов"
         ordering = ('-dt',)
+        indexes = [
+            models.Index(fields=['reserved_until'], condition=models.Q(order_state='new'), name='order_reservation'),
+            # списки заказов покупателя и партнера - от новых к старым с продолжением по курсору (dt, id)
+            models.Index(fields=['user', '-dt', '-id'], name='order_user_dt'),
+            models.Index(fields=['-dt', '-id'], name='order_dt'),
+            models.Index(fields=['id'], name='order_notification_pending', condition=models.Q(
+                notifications_sent__lt=ORDER_NOTIFICATIONS) & ~models.Q(order_state='basket')),
+        ]
 
     def __str__(self):
         return str(self.dt)
 
     @property
     def sum(self):
-        return self.ordered_items.aggregate(total=Sum("quantity"))["total"]
+        return self.items_count
 
 
 class OrderItem(models.Model):
@@ -255,6 +459,7 @@ class OrderItem(models.Model):
                                      blank=True,
                                      on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(verbose_name='Количество')
+    price = models.PositiveIntegerField(verbose_name='Цена при оформлении', null=True, blank=True)
 
     class Meta:
         verbose_name = 'Заказанная позиция'
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+
+from .models import Order, ORDER_NOTIFICATIONS
+
+
+def order_messages(order):
+    """
+    Письма о новом заказе по порядку отправки: покупателю и менеджерам из RECIPIENTS_EMAIL.
+    Их ORDER_NOTIFICATIONS, Order.notifications_sent - сколько из них уже отправлено
+    """
+    user_email = order.user.email
+    return [
+        EmailMessage('Заказ в интернет-магазине', f'Номер вашего заказа {order.id}', settings.EMAIL_HOST_USER,
+                     [user_email]),
+        EmailMessage(f'Новый заказ {order.id}', f'Пользователь {user_email} разместил заказ №{order.id}',
+                     settings.EMAIL_HOST_USER, settings.RECIPIENTS_EMAIL),
+    ]
+
+
+def pending_orders():
+    """
+    Оформленные заказы, письма о которых отправлены не все
+    """
+    return Order.objects.filter(notifications_sent__lt=ORDER_NOTIFICATIONS).exclude(order_state='basket')
+
+
+def send_order_emails(limit):
+    """
+    Отправляет неотправленные письма первых limit заказов из очереди через одно соединение с почтовым сервером.
+    Каждое письмо отмечается в заказе сразу после отправки, поэтому после ошибки отправка продолжается
+    со следующего письма, а не с начала заказа. Возвращает число отправленных писем
+    """
+    orders = list(pending_orders().select_related('user').order_by('id')[:limit])
+    if not orders:
+        return 0
+    sent = 0
+    with get_connection() as connection:
+        for order in orders:
+            for message in order_messages(order)[order.notifications_sent:]:
+                connection.send_messages([message])
+                Order.objects.filter(id=order.id).update(notifications_sent=F('notifications_sent') + 1)
+                sent += 1
+    return sent
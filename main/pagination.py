@@ -0,0 +1,165 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+
+import ujson
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.utils.urls import replace_query_param
+
+# Размер страницы каталога по умолчанию и максимальный
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Сортировки списка товаров: поле и порядок id среди равных, как в индексах товаров в продаже,
+# чтобы страница читалась проходом по индексу в одну или другую сторону
+ORDERINGS = {
+    'price': ('price_rrc', 'id'),
+    '-price': ('-price_rrc', '-id'),
+    'name': ('name', '-id'),
+    '-name': ('-name', 'id'),
+}
+
+
+class CursorError(ValueError):
+    pass
+
+
+def position(product):
+    """
+    Позиция товара в каталоге: экземпляр модели или строка быстрой сериализации
+    """
+    if isinstance(product, dict):
+        return [product['category'], product['name'], product['id']]
+    return [product.category_id, product.name, product.id]
+
+
+def encode_cursor(product):
+    return urlsafe_b64encode(ujson.dumps(position(product)).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        category_id, name, pk = ujson.loads(urlsafe_b64decode(cursor.encode()))
+    except (Base64Error, ValueError, TypeError):
+        raise CursorError('Неверный курсор')
+    if not (isinstance(category_id, int) and isinstance(name, str) and isinstance(pk, int)):
+        raise CursorError('Неверный курсор')
+    return category_id, name, pk
+
+
+def encode_ordering_cursor(product, ordering):
+    field = ORDERINGS[ordering][0].lstrip('-')
+    if isinstance(product, dict):
+        key = [ordering, product[field], product['id']]
+    else:
+        key = [ordering, getattr(product, field), product.id]
+    return urlsafe_b64encode(ujson.dumps(key).encode()).decode()
+
+
+def decode_ordering_cursor(cursor, ordering):
+    try:
+        cursor_ordering, value, pk = ujson.loads(urlsafe_b64decode(cursor.encode()))
+    except (Base64Error, ValueError, TypeError):
+        raise CursorError('Неверный курсор')
+    value_type = str if ORDERINGS[ordering][0].endswith('name') else int
+    if cursor_ordering != ordering or not (isinstance(value, value_type) and isinstance(pk, int)):
+        raise CursorError('Неверный курсор')
+    return value, pk
+
+
+def product_ordering(value):
+    if value and value not in ORDERINGS:
+        raise CursorError('Сортировка - одна из: ' + ', '.join(ORDERINGS))
+    return value or None
+
+
+def page_size(value):
+    try:
+        size = int(value) if value else PAGE_SIZE
+    except ValueError:
+        raise CursorError('Неверный размер страницы')
+    if size < 1:
+        raise CursorError('Неверный размер страницы')
+    return min(size, MAX_PAGE_SIZE)
+
+
+def products_page(queryset, cursor=None, limit=PAGE_SIZE, rows=list, ordering=None):
+    """
+    Страница товаров в порядке Product.Meta.ordering (category, -name) и id после товара из cursor.
+    Вместо OFFSET продолжает с позиции курсора, поэтому любая страница стоит как первая
+    и не сдвигается, если во время просмотра каталог обновляется.
+    Порядок смешанный, поэтому позиция ищется двумя запросами по индексу (category, -name, id):
+    остаток категории курсора и следующие категории. rows превращает выборку в список товаров.
+    С ordering из ORDERINGS товары идут в этом порядке.
+    Возвращает товары и курсор следующей страницы.
+    """
+    if ordering is not None:
+        return ordered_page(queryset, ordering, cursor, limit, rows)
+    ordered = queryset.order_by('category_id', '-name', 'id')
+    if cursor is None:
+        page = rows(ordered[:limit + 1])
+    else:
+        category_id, name, pk = decode_cursor(cursor)
+        page = rows(ordered.filter(Q(name__lt=name) | Q(id__gt=pk), category_id=category_id,
+                                   name__lte=name)[:limit + 1])
+        if len(page) <= limit:
+            page += rows(ordered.filter(category_id__gt=category_id)[:limit + 1 - len(page)])
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1])
+    return page, None
+
+
+def ordered_page(queryset, ordering, cursor, limit, rows):
+    """
+    Страница товаров в порядке ORDERINGS[ordering] после товара из cursor. Нестрогая граница
+    по полю сортировки ограничивает проход по индексу, остальное условие отсекает равные до курсора
+    """
+    field, tie = ORDERINGS[ordering]
+    ordered = queryset.order_by(field, tie)
+    if cursor is not None:
+        value, pk = decode_ordering_cursor(cursor, ordering)
+        name = field.lstrip('-')
+        after, tie_after = ('lt' if field.startswith('-') else 'gt'), ('lt' if tie.startswith('-') else 'gt')
+        ordered = ordered.filter(Q(**{f'{name}__{after}': value}) | Q(**{name: value, f'id__{tie_after}': pk}),
+                                 **{f'{name}__{after}e': value})
+    page = rows(ordered[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_ordering_cursor(page[limit - 1], ordering)
+    return page, None
+
+
+def encode_order_cursor(order):
+    return urlsafe_b64encode(ujson.dumps([order.dt.isoformat(), order.id]).encode()).decode()
+
+
+def decode_order_cursor(cursor):
+    try:
+        dt, pk = ujson.loads(urlsafe_b64decode(cursor.encode()))
+        dt = parse_datetime(dt) if isinstance(dt, str) else None
+    except (Base64Error, ValueError, TypeError):
+        raise CursorError('Неверный курсор')
+    if dt is None or not isinstance(pk, int):
+        raise CursorError('Неверный курсор')
+    return dt, pk
+
+
+def orders_page(queryset, cursor=None, limit=PAGE_SIZE):
+    """
+    Страница заказов от новых к старым (dt, id по убыванию) после заказа из cursor.
+    Как и products_page, продолжает с позиции курсора без OFFSET. Возвращает заказы и курсор следующей страницы.
+    """
+    ordered = queryset.order_by('-dt', '-id')
+    if cursor is not None:
+        dt, pk = decode_order_cursor(cursor)
+        ordered = ordered.filter(Q(dt__lt=dt) | Q(dt=dt, id__lt=pk), dt__lte=dt)
+    page = list(ordered[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_order_cursor(page[limit - 1])
+    return page, None
+
+
+def next_link(request, cursor):
+    """
+    Заголовок Link со ссылкой на следующую страницу
+    """
+    return '<{}>; rel="next"'.format(replace_query_param(request.build_absolute_uri(), 'cursor', cursor))
@@ -0,0 +1,164 @@
+from hashlib import sha256
+from itertools import chain
+from tempfile import TemporaryFile
+
+from requests import get
+from ujson import loads as load_json
+from yaml import CSafeLoader, events, nodes
+
+# Размер куска при скачивании прайс-листа
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+
+def download(url, etag='', last_modified='', chunk_size=CHUNK_SIZE):
+    """
+    Скачивает прайс-лист кусками во временный файл, не держа его целиком в памяти.
+    Запрос условный: если сервер ответил 304 Not Modified, возвращается None.
+    Иначе возвращается пара (файл, заголовки ETag/Last-Modified и sha256 содержимого).
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    file = TemporaryFile()
+    content_hash = sha256()
+    try:
+        with get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            if response.status_code == 304:
+                file.close()
+                return None
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size):
+                content_hash.update(chunk)
+                file.write(chunk)
+    except Exception:
+        file.close()
+        raise
+    file.seek(0)
+    return file, {'etag': response.headers.get('ETag', ''),
+                  'last_modified': response.headers.get('Last-Modified', ''),
+                  'content_hash': content_hash.hexdigest()}
+
+
+def price_list_format(url):
+    """
+    Формат прайс-листа по расширению файла: построчный JSON или YAML
+    """
+    if url.split('?')[0].endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'yaml'
+
+
+def _compose_node(loader):
+    """
+    Собирает узел YAML из потока событий libyaml
+    """
+    event = loader.get_event()
+    if isinstance(event, events.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(nodes.ScalarNode, event.value, event.implicit)
+        return nodes.ScalarNode(tag, event.value, style=event.style)
+    if isinstance(event, events.SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(nodes.SequenceNode, None, event.implicit)
+        value = []
+        while not loader.check_event(events.SequenceEndEvent):
+            value.append(_compose_node(loader))
+        loader.get_event()
+        return nodes.SequenceNode(tag, value)
+    if isinstance(event, events.MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(nodes.MappingNode, None, event.implicit)
+        value = []
+        while not loader.check_event(events.MappingEndEvent):
+            value.append((_compose_node(loader), _compose_node(loader)))
+        loader.get_event()
+        return nodes.MappingNode(tag, value)
+    raise ValueError(f'Неподдерживаемая конструкция YAML: {event}')
+
+
+def iter_yaml(stream):
+    """
+    Разбирает YAML прайс-лист по событиям libyaml (CSafeLoader).
+    Возвращает пары (ключ, значение) верхнего уровня, а goods - по одному товару,
+    так что в памяти одновременно находится только текущая позиция.
+    """
+    loader = CSafeLoader(stream)
+    try:
+        loader.get_event()
+        if loader.check_event(events.StreamEndEvent):
+            return
+        loader.get_event()
+        if not isinstance(loader.get_event(), events.MappingStartEvent):
+            raise ValueError('Прайс-лист должен быть словарем')
+        while not loader.check_event(events.MappingEndEvent):
+            key = loader.construct_document(_compose_node(loader))
+            if key == 'goods' and loader.check_event(events.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(events.SequenceEndEvent):
+                    yield key, loader.construct_document(_compose_node(loader))
+                loader.get_event()
+            else:
+                value = loader.construct_document(_compose_node(loader))
+                if key != 'goods':
+                    yield key, value
+    finally:
+        loader.dispose()
+
+
+def iter_jsonl(stream):
+    """
+    Разбирает построчный JSON: в первой строке shop и categories, в каждой следующей - один товар
+    """
+    lines = (line for line in stream if line.strip())
+    header = load_json(next(lines, '{}'))
+    for key, value in header.items():
+        if key != 'goods':
+            yield key, value
+    for item in header.get('goods') or []:
+        yield 'goods', item
+    for line in lines:
+        yield 'goods', load_json(line)
+
+
+PARSERS = {
+    'yaml': iter_yaml,
+    'jsonl': iter_jsonl,
+}
+
+
+# Разделы прайс-листа, которые нужны до начала загрузки товаров
+HEADER = {'shop', 'categories'}
+
+
+def _goods(items):
+    for key, value in items:
+        if key == 'goods':
+            yield value
+
+
+def read_price_list(stream, format='yaml'):
+    """
+    Читает прайс-лист потоково. Возвращает словарь с shop и categories,
+    а goods - ленивый итератор по товарам, который читает файл по мере обработки.
+    Если shop и categories идут в файле после goods, файл читается дважды:
+    сначала заголовок, затем товары.
+    """
+    items = PARSERS[format](stream)
+    data = {}
+    for key, value in items:
+        if key != 'goods':
+            data[key] = value
+        elif HEADER.issubset(data):
+            data['goods'] = _goods(chain([(key, value)], items))
+            return data
+    stream.seek(0)
+    data.setdefault('categories', [])
+    data['goods'] = _goods(PARSERS[format](stream))
+    return data
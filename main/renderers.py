@@ -0,0 +1,29 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+default = JSONEncoder().default
+
+
+def dumps(data):
+    """
+    Компактный JSON без экранирования не-ASCII символов, как у JSONRenderer.
+    JSONRenderer всегда экранирует \\u2028 и \\u2029, поэтому здесь тоже.
+    """
+    return orjson.dumps(data, default=default).replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+        b'\xe2\x80\xa9', b'\\u2029')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson. Компактный вывод без экранирования не-ASCII символов совпадает
+    с JSONRenderer байт в байт, остальные случаи (отступы, ensure_ascii) отдаются JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (self.ensure_ascii or not self.compact or
+                self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
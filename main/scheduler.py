@@ -0,0 +1,94 @@
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db.models import Count, DateTimeField, DurationField, Exists, ExpressionWrapper, F, OuterRef, Q, \
+    Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Least, Power
+from django.utils.timezone import now
+
+from .models import Shop, ImportRun
+
+# Загрузки, которые еще не завершились
+ACTIVE_STATES = ('queued', 'running')
+# Загрузки, после которых каталог магазина считается свежим
+FINISHED_STATES = ('done', 'not_modified')
+# Больше скольких неудач подряд интервал между попытками загрузки уже не растет
+MAX_BACKOFF_STEPS = 5
+
+
+def url_host(url):
+    return urlparse(url).hostname or ''
+
+
+def stale_shops():
+    """
+    Магазины с прайс-листом, которые пора загрузить: сначала те, что не загружались никогда,
+    затем по времени последней попытки загрузки, в том числе неудачной. После неудачных загрузок
+    подряд следующая попытка откладывается на IMPORT_INTERVAL * 2 ** число неудач, поэтому магазины
+    с недоступным прайс-листом не занимают места загрузок остальных магазинов
+    """
+    last_attempt = ImportRun.objects.filter(shop=OuterRef('pk')).order_by('-created_at').values('created_at')[:1]
+    # неудачные загрузки после последней успешной
+    failures = ImportRun.objects.filter(shop=OuterRef('pk'), state='failed').exclude(Exists(ImportRun.objects.filter(
+        shop=OuterRef('shop'), state__in=FINISHED_STATES, created_at__gt=OuterRef('created_at')))).order_by().values(
+        'shop').annotate(count=Count('id')).values('count')
+    backoff = ExpressionWrapper(Value(timedelta(seconds=settings.IMPORT_INTERVAL)) * Power(
+        2, Least(F('failures'), MAX_BACKOFF_STEPS)), output_field=DurationField())
+    return Shop.objects.filter(url__isnull=False, user__isnull=False).exclude(url='').annotate(
+        attempted_at=Subquery(last_attempt), failures=Coalesce(Subquery(failures), 0)).annotate(
+        retry_at=ExpressionWrapper(F('attempted_at') + backoff, output_field=DateTimeField())).filter(
+        Q(attempted_at__isnull=True) | Q(retry_at__lte=now())).order_by(
+        F('attempted_at').asc(nulls_first=True), 'id').select_related('user')
+
+
+def schedule_imports():
+    """
+    Создает загрузки прайс-листов самых устаревших магазинов, не превышая
+    IMPORT_CONCURRENCY одновременных загрузок всего и IMPORT_HOST_CONCURRENCY с одного сервера.
+    Возвращает созданные загрузки, запускать их должен вызывающий код.
+    """
+    active = ImportRun.objects.filter(
+        state__in=ACTIVE_STATES,
+        created_at__gte=now() - timedelta(seconds=settings.IMPORT_RUN_TIMEOUT)).values_list('shop_id', 'user_id', 'url')
+    busy_shops = set()
+    # ручные загрузки нового магазина - без магазина, по пользователю и адресу прайс-листа
+    busy_price_lists = set()
+    hosts = Counter()
+    for shop_id, user_id, url in active:
+        busy_shops.add(shop_id)
+        busy_price_lists.add((user_id, url))
+        hosts[url_host(url)] += 1
+
+    slots = settings.IMPORT_CONCURRENCY - sum(hosts.values())
+    runs = []
+    if slots <= 0:
+        return runs
+    for shop in stale_shops().iterator():
+        host = url_host(shop.url)
+        if (shop.id in busy_shops or (shop.user_id, shop.url) in busy_price_lists or
+                hosts[host] >= settings.IMPORT_HOST_CONCURRENCY):
+            continue
+        runs.append(ImportRun.objects.create(user=shop.user, shop=shop, url=shop.url))
+        hosts[host] += 1
+        if len(runs) >= slots:
+            break
+    return runs
+
+
+def import_throughput(period=timedelta(hours=24)):
+    """
+    Пропускная способность загрузок за период: магазинов в час и позиций в секунду
+    (по суммарному времени всех этапов), чтобы подбирать число воркеров
+    """
+    stats = ImportRun.objects.filter(state__in=FINISHED_STATES, finished_at__gte=now() - period).aggregate(
+        shops=Count('shop', distinct=True),
+        rows=Sum('rows_processed'),
+        seconds=Sum(F('download_time') + F('parse_time') + F('db_write_time') + F('plan_time') +
+                    F('finalize_time')))
+    hours = period.total_seconds() / 3600
+    return {
+        'shops_per_hour': stats['shops'] / hours,
+        'rows_per_second': (stats['rows'] or 0) / stats['seconds'] if stats['seconds'] else 0,
+    }
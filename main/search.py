@@ -0,0 +1,17 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+
+# Конфигурация полнотекстового поиска Postgres: русская морфология.
+# Product.search_vector по этой же конфигурации поддерживают триггеры базы (миграция 0018):
+# название важнее модели, модель важнее значений параметров
+SEARCH_CONFIG = 'russian'
+
+
+def search_products(queryset, text):
+    """
+    Товары queryset, подходящие под поисковую строку, от самых релевантных.
+    Строка разбирается как в поисковиках: слова через пробел, "фраза", -исключение, or
+    """
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    return queryset.filter(search_vector=query).annotate(
+        rank=SearchRank(F('search_vector'), query)).order_by('-rank', 'id')
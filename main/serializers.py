@@ -1,7 +1,8 @@
 import requests
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from .models import User, Contact, Shop, Category, Product, Order, OrderItem
+from django.db import models
+from .models import User, Contact, Shop, Category, Product, Order, OrderItem, ImportRun
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -29,7 +30,7 @@ class ShopSerializer(serializers.ModelSerializer):
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ('id', 'name',)
+        fields = ('id', 'name', 'product_count', 'in_stock_count', 'min_price', 'max_price')
         read_only_fields = ('id',)
 
 
@@ -40,19 +41,83 @@ class ProductSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class ProductExportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ('id', 'name', 'model', 'category', 'shop', 'price_rrc', 'quantity', 'is_active', 'updated_at')
+        read_only_fields = fields
+
+
+class ValuesSerializer:
+    """
+    Быстрая сериализация списков только для чтения: строки строятся из кортежей values_list()
+    без создания экземпляров моделей. Подходит для ModelSerializer, все поля которого - простые
+    поля модели или первичные ключи связей, и дает те же данные, что и ModelSerializer.
+    Даты преобразуются полями сериализатора.
+    """
+    field_types = (models.AutoField, models.BigAutoField, models.CharField, models.IntegerField,
+                   models.PositiveIntegerField, models.BooleanField, models.ForeignKey)
+    converted_types = (models.DateTimeField,)
+
+    def __init__(self, serializer_class):
+        model = serializer_class.Meta.model
+        self.names = tuple(serializer_class.Meta.fields)
+        fields = [model._meta.get_field(name) for name in self.names]
+        for field in fields:
+            if not isinstance(field, self.field_types + self.converted_types):
+                raise TypeError(f'Поле {field.name} не поддерживается быстрой сериализацией')
+        self.lookups = tuple(field.attname for field in fields)
+        serializer_fields = serializer_class().fields
+        self.converters = {index: serializer_fields[field.name].to_representation
+                           for index, field in enumerate(fields) if isinstance(field, self.converted_types)}
+
+    def rows(self, values):
+        """
+        Превращает кортежи values_list(*lookups) в словари
+        """
+        names = self.names
+        if not self.converters:
+            return [dict(zip(names, row)) for row in values]
+        rows = []
+        for row in values:
+            row = list(row)
+            for index, convert in self.converters.items():
+                if row[index] is not None:
+                    row[index] = convert(row[index])
+            rows.append(dict(zip(names, row)))
+        return rows
+
+    def serialize(self, queryset):
+        return self.rows(queryset.values_list(*self.lookups))
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
-        fields = ('id', 'order', 'product', 'quantity')
-        read_only_fields = ('id',)
+        fields = ('id', 'order', 'product', 'quantity', 'price')
+        read_only_fields = ('id', 'price')
 
 
 class OrderSerializer(serializers.ModelSerializer):
     ordered_items = OrderItemSerializer(read_only=True, many=True)
-    total_sum = serializers.IntegerField()
     contact = ContactSerializer(read_only=True)
 
     class Meta:
         model = Order
-        fields = ('id', 'user', 'order_state', 'dt', 'contact', 'ordered_items', 'total_sum')
-        read_only_fields = ('id',)
+        fields = ('id', 'user', 'order_state', 'dt', 'contact', 'ordered_items', 'items_count', 'total_sum')
+        read_only_fields = ('id', 'items_count', 'total_sum')
+
+
+class ImportRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportRun
+        fields = ('id', 'url', 'shop', 'state', 'rows_total', 'rows_processed', 'download_time', 'parse_time',
+                  'db_write_time', 'plan_time', 'finalize_time', 'result', 'errors', 'created_at', 'finished_at')
+        read_only_fields = fields
+
+
+# Быстрая сериализация списков каталога
+shop_rows = ValuesSerializer(ShopSerializer)
+category_rows = ValuesSerializer(CategorySerializer)
+product_rows = ValuesSerializer(ProductSerializer)
+product_export_rows = ValuesSerializer(ProductExportSerializer)
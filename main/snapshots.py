@@ -0,0 +1,100 @@
+import gzip
+from hashlib import md5, sha256
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from .catalog_cache import get_cache, versions, shop_version
+from .models import Shop, Product
+from .pagination import products_page, next_link, PAGE_SIZE
+from .renderers import FastJSONRenderer
+from .serializers import product_rows
+
+# Параметры запроса, при которых ответ можно отдать из снимка
+SNAPSHOT_PARAMS = {'shop_id', 'category_id', 'cursor', 'limit'}
+
+
+def pointer_key(shop_id):
+    """
+    Ключ с версией снимков магазина, которые сейчас отдаются: версия каталога и версия кеша магазина
+    на начало подготовки снимков
+    """
+    return f'catalog:snapshot:{shop_id}'
+
+
+def page_key(shop_id, category_id, version, cursor):
+    cursor_hash = md5((cursor or '').encode()).hexdigest()
+    return f'catalog:snapshot:{shop_id}:{category_id or ""}:{version}:{cursor_hash}'
+
+
+def build_snapshots(shop_id):
+    """
+    Готовит сжатые страницы списка товаров магазина и каждой его категории в том виде,
+    в котором их отдает ProductAPIView со страницей по умолчанию. Каждая страница хранится
+    вместе с sha256 содержимого и курсором следующей. Снимки включаются, только если за время
+    подготовки не была опубликована новая версия каталога и не менялись остатки товаров магазина.
+    """
+    cache = get_cache()
+    cached_version = versions([shop_version(shop_id)])
+    catalog_version = Shop.objects.values_list('catalog_version', flat=True).get(id=shop_id)
+    # страницы пишутся под своей версией, поэтому запоздавшая подготовка по старым остаткам
+    # не перезапишет страницы, на которые уже переключились
+    version = f'{catalog_version}.{cached_version[0]}'
+    products = Product.objects.filter(shop_id=shop_id, is_active=True)
+    category_ids = products.order_by('category_id').values_list('category_id', flat=True).distinct()
+    renderer = FastJSONRenderer()
+    pages = 0
+    for category_id in [None, *category_ids]:
+        queryset = products if category_id is None else products.filter(category_id=category_id)
+        cursor = None
+        while True:
+            page, next_cursor = products_page(queryset, cursor, PAGE_SIZE, product_rows.serialize)
+            content = renderer.render(page)
+            cache.set(page_key(shop_id, category_id, version, cursor),
+                      (gzip.compress(content), sha256(content).hexdigest(), next_cursor),
+                      settings.CATALOG_SNAPSHOT_TIMEOUT)
+            pages += 1
+            if next_cursor is None:
+                break
+            cursor = next_cursor
+    if (Shop.objects.filter(id=shop_id, catalog_version=catalog_version).exists() and
+            versions([shop_version(shop_id)]) == cached_version):
+        cache.set(pointer_key(shop_id), version, settings.CATALOG_SNAPSHOT_TIMEOUT)
+    return pages
+
+
+def drop_snapshots(shop_id):
+    """
+    Отключает снимки магазина до подготовки новых
+    """
+    get_cache().delete(pointer_key(shop_id))
+
+
+def snapshot_response(request):
+    """
+    Ответ из готового снимка, если запрос - страница товаров одного магазина (и категории)
+    размером по умолчанию в формате JSON. Иначе None.
+    """
+    params = request.query_params
+    shop_id, category_id = params.get('shop_id', ''), params.get('category_id', '')
+    if (not shop_id.isdigit() or category_id and not category_id.isdigit() or
+            not SNAPSHOT_PARAMS.issuperset(params) or params.get('limit', str(PAGE_SIZE)) != str(PAGE_SIZE) or
+            request.accepted_renderer.format != 'json'):
+        return None
+    cache = get_cache()
+    version = cache.get(pointer_key(shop_id))
+    snapshot = version is not None and cache.get(page_key(shop_id, category_id, version, params.get('cursor')))
+    if not snapshot:
+        return None
+
+    content, content_hash, cursor = snapshot
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(content, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(content), content_type='application/json')
+    response['Vary'] = 'Accept-Encoding'
+    response['X-Content-Hash'] = content_hash
+    if cursor:
+        response['Link'] = next_link(request, cursor)
+    return response
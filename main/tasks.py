@@ -1,59 +1,218 @@
-from django.core.validators import URLValidator
-from django.http import JsonResponse
-from django.core.exceptions import ValidationError
-from rest_framework.permissions import IsAuthenticated
-from yaml import load as load_yaml, Loader
-from requests import get
-from .models import Shop, Product, Category, Parameter, ProductParameter
-from .serializers import ShopSerializer, UserSerializer, ContactSerializer, CategorySerializer, ProductSerializer, \
-    OrderItemSerializer, OrderSerializer
-from celery import shared_task
-
-@shared_task()
-def partner_update_task(request, user, *args, **kwargs):
-    permission_classes = [IsAuthenticated]
-
-    if not user.is_authenticated:
-        return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
-
-    if user.type != 'shop':
-        return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
-
-    url = request.get('url')
-    if url:
-        validate_url = URLValidator()
-        try:
-            validate_url(url)
-        except ValidationError as e:
-            return JsonResponse({'Status': False, 'Error': str(e)})
-        else:
-            stream = get(url).content
-
-            data = load_yaml(stream, Loader=Loader)
-
-            shop, _ = Shop.objects.get_or_create(name=data['shop'], user=user, url=url)
-
-            for category in data['categories']:
-                category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-                category_object.shops.add(shop.id)
-                category_object.save()
-            Product.objects.filter(shop=shop.id).delete()
-            for item in data['goods']:
-                product, _ = Product.objects.get_or_create(name=item['name'],
-                                                           category_id=item['category'],
-                                                           model=item['model'],
-                                                           price=item['price'],
-                                                           price_rrc=item['price_rrc'],
-                                                           quantity=item['quantity'],
-                                                           is_active=True,
-                                                           shop=shop
-                                                           )
-                for name, value in item['parameters'].items():
-                    parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                    ProductParameter.objects.get_or_create(product=product,
-                                                           parameter=parameter_object,
-                                                           value=value)
-
-            return JsonResponse({'Status': True, 'Message': 'Прайс-лист обновлен'})
-
-    return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
\ No newline at end of file
+import logging
+from random import uniform
+from smtplib import SMTPException
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.timezone import now
+from .models import Shop, Category, ImportRun
+from .importer import stage_price_list, plan_chunk, publish, collect_versions, CHUNK_SIZE
+from .price_list import download, read_price_list, price_list_format
+from .catalog_cache import invalidate_shop, get_cache
+from .facets import refresh_facets
+from .counters import refresh_counters
+from .basket import release_reservations
+from .notifications import pending_orders, send_order_emails
+from .snapshots import build_snapshots, drop_snapshots, pointer_key
+from .scheduler import schedule_imports, import_throughput
+from celery import shared_task, chord
+
+logger = logging.getLogger(__name__)
+
+
+def fail_import(run_id, error):
+    """
+    Помечает загрузку прайс-листа ошибочной
+    """
+    ImportRun.objects.filter(id=run_id).update(state='failed', errors=str(error), finished_at=now())
+
+
+@shared_task()
+def partner_update_task(run_id):
+    """
+    Первый этап загрузки прайс-листа: скачивание, разбор и запись позиций в новую версию каталога.
+    Затем части прайс-листа обрабатываются параллельно, а finalize_import_task публикует версию.
+    """
+    run = ImportRun.objects.select_related('user').get(id=run_id)
+    ImportRun.objects.filter(id=run_id).update(state='running')
+    try:
+        shop = Shop.objects.filter(user=run.user, url=run.url).first()
+        started = monotonic()
+        downloaded = download(run.url, shop.etag, shop.last_modified) if shop else download(run.url)
+        download_time = monotonic() - started
+
+        if downloaded is None:
+            ImportRun.objects.filter(id=run_id).update(state='not_modified', shop=shop, download_time=download_time,
+                                                       finished_at=now())
+            return {'Status': True, 'Message': 'Прайс-лист не изменился'}
+
+        stream, fingerprint = downloaded
+        with stream:
+            if shop and shop.content_hash == fingerprint['content_hash']:
+                ImportRun.objects.filter(id=run_id).update(state='not_modified', shop=shop,
+                                                           download_time=download_time, finished_at=now())
+                return {'Status': True, 'Message': 'Прайс-лист не изменился'}
+
+            timings = {}
+            started = monotonic()
+            data = read_price_list(stream, price_list_format(run.url))
+            timings['parse'] = monotonic() - started
+
+            shop, _ = Shop.objects.get_or_create(name=data['shop'], user=run.user, url=run.url)
+
+            version = stage_price_list(shop, data, timings=timings)
+
+        ImportRun.objects.filter(id=run_id).update(shop=shop, version=version, rows_total=version.size,
+                                                   download_time=download_time, parse_time=timings['parse'],
+                                                   db_write_time=timings['db_write'])
+    except Exception as error:
+        fail_import(run_id, error)
+        raise
+
+    categories = [category['id'] for category in data['categories']]
+    finalize = finalize_import_task.s(run_id, categories, fingerprint)
+    chunks = [import_chunk_task.s(run_id, start, min(start + CHUNK_SIZE, version.size))
+              for start in range(0, version.size, CHUNK_SIZE)]
+    if chunks:
+        chord(chunks)(finalize)
+    else:
+        finalize.delay([])
+
+    return {'Status': True, 'Message': 'Прайс-лист отправлен на загрузку'}
+
+
+@shared_task()
+def import_chunk_task(run_id, start, end):
+    """
+    Сравнивает часть версии каталога с опубликованным каталогом
+    """
+    run = ImportRun.objects.select_related('version').get(id=run_id)
+    try:
+        started = monotonic()
+        plan_chunk(run.version, start, end)
+        ImportRun.objects.filter(id=run_id).update(plan_time=F('plan_time') + (monotonic() - started),
+                                                   rows_processed=F('rows_processed') + (end - start))
+    except Exception as error:
+        fail_import(run_id, error)
+        raise
+
+
+@shared_task()
+def finalize_import_task(results, run_id, categories, fingerprint):
+    """
+    Публикует версию каталога после обработки всех частей
+    """
+    run = ImportRun.objects.select_related('version').get(id=run_id)
+    try:
+        started = monotonic()
+        result = publish(run.version, categories, fingerprint)
+        if result is not None:
+            refresh_facets(Category.objects.filter(shops=run.shop_id).values_list('id', flat=True))
+            refresh_counters(run.shop_id)
+            invalidate_shop(run.shop_id)
+            drop_snapshots(run.shop_id)
+        ImportRun.objects.filter(id=run_id).update(state='done', result=result, finalize_time=monotonic() - started,
+                                                   finished_at=now())
+    except Exception as error:
+        fail_import(run_id, error)
+        raise
+    if result is not None:
+        build_snapshots_task.delay(run.shop_id)
+    return result
+
+
+@shared_task()
+def build_snapshots_task(shop_id):
+    """
+    Готовит снимки каталога магазина после публикации новой версии
+    """
+    return build_snapshots(shop_id)
+
+
+@shared_task()
+def collect_catalog_versions_task():
+    """
+    Периодически удаляет старые версии каталога
+    """
+    collect_versions()
+
+
+@shared_task()
+def schedule_imports_task():
+    """
+    Периодически ставит в очередь обновление прайс-листов магазинов
+    и сообщает пропускную способность загрузок
+    """
+    scheduled = 0
+    for run in schedule_imports():
+        # Случайная задержка, чтобы загрузки всех магазинов не попадали на базу одновременно
+        partner_update_task.apply_async((run.id,), countdown=uniform(0, settings.IMPORT_JITTER))
+        scheduled += 1
+    throughput = import_throughput()
+    logger.info('Запланировано загрузок: %s, магазинов в час: %.1f, позиций в секунду: %.1f',
+                scheduled, throughput['shops_per_hour'], throughput['rows_per_second'])
+    return {'scheduled': scheduled, **throughput}
+
+
+def schedule_snapshots(shop_id):
+    """
+    Ставит подготовку снимков каталога магазина после изменения остатков не чаще раза в CATALOG_SNAPSHOT_DELAY:
+    остатки, изменившиеся за это время, попадут в одни и те же снимки
+    """
+    if get_cache().add(pointer_key(shop_id) + ':scheduled', True, settings.CATALOG_SNAPSHOT_DELAY):
+        build_snapshots_task.apply_async((shop_id,), countdown=settings.CATALOG_SNAPSHOT_DELAY)
+
+
+@shared_task()
+def refresh_counters_task(categories):
+    """
+    Пересчитывает счетчики товаров категорий магазинов [(магазин, [категории]), ...] после изменения остатков
+    и заново готовит снимки каталога этих магазинов
+    """
+    for shop_id, category_ids in categories:
+        refresh_counters(shop_id, category_ids)
+        schedule_snapshots(shop_id)
+
+
+@shared_task()
+def release_reservations_task():
+    """
+    Периодически отменяет заказы, которые не подтвердили до конца резерва, и возвращает товары на склад
+    """
+    canceled, categories = release_reservations()
+    refresh_counters_task(list(categories.items()))
+    if canceled:
+        logger.info('Отменено заказов с истекшим резервом: %s', canceled)
+    return canceled
+
+
+# Пачки писем о заказах отправляет одна задача за раз
+ORDER_EMAILS_LOCK = 'orders:emails:lock'
+
+
+@shared_task(bind=True, rate_limit=settings.ORDER_EMAIL_RATE_LIMIT, max_retries=settings.ORDER_EMAIL_MAX_RETRIES)
+def send_order_emails_task(self):
+    """
+    Отправляет письма о новых заказах из очереди пачками до ORDER_EMAIL_BATCH_SIZE заказов,
+    каждая пачка - через одно соединение с почтовым сервером. Запускается после оформления заказа
+    и периодически. Если сервер недоступен, повторяет отправку с растущей задержкой
+    """
+    if not cache.add(ORDER_EMAILS_LOCK, True, settings.ORDER_EMAIL_LOCK_TIMEOUT):
+        return 0
+    error = None
+    try:
+        sent = send_order_emails(settings.ORDER_EMAIL_BATCH_SIZE)
+    except (SMTPException, OSError) as e:
+        error = e
+    finally:
+        cache.delete(ORDER_EMAILS_LOCK)
+    if error is not None:
+        # Случайная задержка в пределах удвоенной, чтобы повторы не приходили на сервер одновременно
+        countdown = uniform(0, settings.ORDER_EMAIL_RETRY_DELAY * 2 ** self.request.retries)
+        raise self.retry(exc=error, countdown=countdown)
+    if pending_orders().exists():
+        # следующая пачка - отдельным запуском, не чаще ORDER_EMAIL_RATE_LIMIT
+        send_order_emails_task.delay()
+    return sent
@@ -2,7 +2,8 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter
 from .views import RegisterAccountAPIView, PartnerUpdateAPIView, PartnerStateAPIView, UserAPIView, ConfirmAccountAPIView, LoginUserAPIView, \
     ContactAPIView, PasswordResetAPIView, PasswordResetConfirmAPIView, ShopViewSet, CategoryViewSet, ProductAPIView, BasketAPIView, \
-    OrderAPIView, PartnerOrderAPIView
+    OrderAPIView, PartnerOrderAPIView, PartnerUpdateStatusAPIView, CatalogCacheStatsAPIView, \
+    ProductFacetsAPIView, ProductExportAPIView
 
 
 app_name = 'main'
@@ -20,10 +21,14 @@ urlpatterns = [
     path('user/password_reset/confirm', PasswordResetConfirmAPIView.as_view()),
     # path('shops', ShopAPIView.as_view()),
     path('products', ProductAPIView.as_view()),
+    path('products/cache', CatalogCacheStatsAPIView.as_view()),
+    path('products/facets', ProductFacetsAPIView.as_view()),
+    path('products/export', ProductExportAPIView.as_view()),
     # path('categories', CategoryAPIView.as_view()),
     path('basket', BasketAPIView.as_view()),
     path('order', OrderAPIView.as_view()),
     path('partner/update', PartnerUpdateAPIView.as_view()),
+    path('partner/update/<int:pk>', PartnerUpdateStatusAPIView.as_view()),
     path('partner/state', PartnerStateAPIView.as_view()),
     path('partner/orders', PartnerOrderAPIView.as_view()),
     path('user/details', UserAPIView.as_view())
@@ -1,26 +1,41 @@
+from datetime import datetime, time
+
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.validators import URLValidator
-from django.core.mail import send_mail
 from django.core.exceptions import ValidationError
-from django.http import JsonResponse
-from django.conf import settings
-from django.db.models import Q, Sum, F
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from django.db import transaction
+from django.db.models import Q
 from requests import get
 from distutils.util import strtobool
 from yaml import load as load_yaml, Loader
-from ujson import loads as load_json
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import viewsets
-from .serializers import ShopSerializer, UserSerializer, ContactSerializer, CategorySerializer, ProductSerializer, \
-    OrderItemSerializer, OrderSerializer
+from .serializers import ShopSerializer, UserSerializer, ContactSerializer, CategorySerializer, OrderSerializer, \
+    ImportRunSerializer, shop_rows, category_rows, product_rows
 from .models import Shop, Product, Category, Parameter, ProductParameter, User, ConfirmEmailToken, Contact, Order, \
-    OrderItem
-from main.tasks import partner_update_task
+    OrderItem, ImportRun, STATE_CHOICES
+from .renderers import FastJSONRenderer
+from .catalog_cache import cached_response, conditional_response, catalog_scope, products_scope, invalidate_shop, \
+    cache_stats
+from .export import export_products, gzip_stream
+from .facets import parameter_filters, catalog_ids, price_range, filter_by_parameters, facet_counts, \
+    category_facets, FilterError
+from .search import search_products
+from .snapshots import snapshot_response
+from .pagination import products_page, orders_page, page_size, product_ordering, next_link, CursorError, \
+    ORDERINGS
+from .basket import basket_quantities, check_stock, add_items, update_items, update_totals, checkout, number, \
+    BasketError
+from main.tasks import partner_update_task, refresh_counters_task, send_order_emails_task
 
 
 class RegisterAccountAPIView(APIView):
@@ -212,15 +227,47 @@ class ShopViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     queryset = Shop.objects.all()
     serializer_class = ShopSerializer
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
     ordering = ['-name']
 
+    @conditional_response(catalog_scope)
+    @cached_response(catalog_scope)
+    def list(self, request, *args, **kwargs):
+        return Response(shop_rows.serialize(self.filter_queryset(self.get_queryset())))
+
+    @conditional_response(catalog_scope)
+    @cached_response(catalog_scope)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
     ordering = ['-name']
 
+    @conditional_response(catalog_scope)
+    @cached_response(catalog_scope)
+    def list(self, request, *args, **kwargs):
+        return Response(category_rows.serialize(self.filter_queryset(self.get_queryset())))
+
+    @conditional_response(catalog_scope)
+    @cached_response(catalog_scope)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class CatalogCacheStatsAPIView(APIView):
+    """
+    Счетчики попаданий и промахов кеша каталога
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(cache_stats())
+
 
 class PartnerUpdateAPIView(APIView):
     """
@@ -233,9 +280,23 @@ class PartnerUpdateAPIView(APIView):
         """
         Вызываем функцию из celery
         """
-        user_serializer = UserSerializer(request.user)
-        partner_update_task.delay(request.data, user_serializer.data, *args, **kwargs)
-        return JsonResponse({'status': True})
+        if request.user.type != 'shop':
+            return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
+
+        url = request.data.get('url')
+        if not url:
+            return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
+
+        try:
+            URLValidator()(url)
+        except ValidationError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)})
+
+        # магазин известен заранее, если прайс-лист уже загружался, - планировщик не запустит его загрузку повторно
+        run = ImportRun.objects.create(user=request.user, url=url,
+                                       shop=Shop.objects.filter(user=request.user, url=url).first())
+        partner_update_task.delay(run.id)
+        return JsonResponse({'status': True, 'id': run.id})
         # # Старый вариант без Celery
         # if not request.user.is_authenticated:
         #     return JsonResponse({'Status': False, 'Error': 'Log in required'}, status=403)
@@ -283,6 +344,20 @@ class PartnerUpdateAPIView(APIView):
         # return JsonResponse({'Status': False, 'Errors': 'Не указаны все необходимые аргументы'})
 
 
+class PartnerUpdateStatusAPIView(APIView):
+    """
+    Статус загрузки прайс-листа
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk, *args, **kwargs):
+        run = ImportRun.objects.filter(pk=pk, user=request.user).first()
+        if run is None:
+            return JsonResponse({'Status': False, 'Error': 'Загрузка не найдена'}, status=404)
+        serializer = ImportRunSerializer(run)
+        return Response(serializer.data)
+
+
 class PartnerStateAPIView(APIView):
     """
     Класс для статуса заказов
@@ -311,7 +386,10 @@ class PartnerStateAPIView(APIView):
 
         if state:
             try:
-                Shop.objects.filter(user=request.user.id).update(state=strtobool(state))
+                shops = Shop.objects.filter(user=request.user.id)
+                shops.update(state=strtobool(state))
+                for shop_id in shops.values_list('id', flat=True):
+                    invalidate_shop(shop_id)
                 return JsonResponse({'Status': True, 'Message': f'Статус магазина изменен на {state}'})
             except ValueError as error:
                 return JsonResponse({'Status': False, 'Errors': str(error)})
@@ -326,72 +404,181 @@ class PartnerOrderAPIView(APIView):
         if request.user.type != 'shop':
             return JsonResponse({'Status': False, 'Error': 'Только для магазинов'}, status=403)
 
-        order = Order.objects.filter(
-            ordered_items__product__shop__user_id=request.user.id).exclude(order_state='basket').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product__price_rrc'))).distinct()
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        # заказы с товарами магазинов партнера, без соединения с позициями и DISTINCT
+        orders = Order.objects.filter(id__in=OrderItem.objects.filter(
+            product__shop__user_id=request.user.id).values('order_id')).exclude(order_state='basket')
+        return order_list(request, orders)
+
+
+def parse_moment(value):
+    """
+    Момент времени из параметра запроса: дата и время ISO 8601 или дата (начало дня). None, если не разобрать
+    """
+    try:
+        moment = parse_datetime(value) or datetime.combine(parse_date(value), time())
+    except (ValueError, TypeError):
+        return None
+    return make_aware(moment) if is_naive(moment) else moment
+
+
+def filter_orders(orders, params):
+    """
+    Заказы по фильтрам: статусы через запятую (order_state) и период оформления date_from - date_to
+    """
+    states = [state for state in params.get('order_state', '').split(',') if state]
+    if states:
+        if not set(states) <= {state for state, _ in STATE_CHOICES}:
+            raise FilterError('Статус заказа - один из: ' + ', '.join(state for state, _ in STATE_CHOICES))
+        orders = orders.filter(order_state__in=states)
+    for param, lookup in (('date_from', 'dt__gte'), ('date_to', 'dt__lte')):
+        if params.get(param):
+            moment = parse_moment(params[param])
+            if moment is None:
+                raise FilterError(f'Неверная дата {param}')
+            orders = orders.filter(**{lookup: moment})
+    return orders
+
+
+def order_list(request, orders):
+    """
+    Страница заказов с позициями и контактами, ссылка на следующую страницу - в заголовке Link.
+    Позиции всей страницы загружаются одним запросом, контакты - в том же запросе, что и заказы
+    """
+    try:
+        orders = filter_orders(orders, request.query_params).select_related('contact').prefetch_related(
+            'ordered_items')
+        page, cursor = orders_page(orders, request.query_params.get('cursor'),
+                                   page_size(request.query_params.get('limit')))
+    except (CursorError, FilterError) as e:
+        return JsonResponse({'Status': False, 'Error': str(e)}, status=400)
+
+    headers = {'Link': next_link(request, cursor)} if cursor else None
+    return Response(OrderSerializer(page, many=True).data, headers=headers)
+
+
+def catalog_products(params):
+    """
+    Товары в продаже по фильтрам каталога: магазин, категория, цена и значения параметров
+    """
+    query = Q(is_active=True) & catalog_ids(params) & price_range(params)
+    return filter_by_parameters(Product.objects.filter(query), parameter_filters(params.getlist('parameter')))
 
 
 class ProductAPIView(APIView):
     '''
     Просмотр товаров
     '''
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
 
+    @conditional_response(products_scope)
     def get(self, request, *args, **kwargs):
-        query = Q(is_active=True)
-        shop_id = request.query_params.get('shop_id')
-        category_id = request.query_params.get('category_id')
+        # страницы товаров магазина готовятся заранее после каждой загрузки прайс-листа
+        response = snapshot_response(request)
+        if response is not None:
+            return response
+        return self.products(request, *args, **kwargs)
+
+    @cached_response(products_scope)
+    def products(self, request, *args, **kwargs):
+        # товары отдаются постранично, ссылка на следующую страницу - в заголовке Link
+        try:
+            products = catalog_products(request.query_params)
+            limit = page_size(request.query_params.get('limit'))
+            ordering = product_ordering(request.query_params.get('ordering'))
+            search = request.query_params.get('search')
+            if search:
+                # результаты поиска - первые limit самых релевантных товаров или первые limit по ordering
+                products = search_products(products, search)
+                if ordering:
+                    products = products.order_by(*ORDERINGS[ordering])
+                products, cursor = product_rows.serialize(products[:limit]), None
+            else:
+                products, cursor = products_page(products, request.query_params.get('cursor'), limit,
+                                                 product_rows.serialize, ordering)
+        except (CursorError, FilterError) as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400)
 
-        if shop_id:
-            query = query & Q(shop_id=shop_id)
+        headers = {'Link': next_link(request, cursor)} if cursor else None
+        return Response(products, headers=headers)
 
-        if category_id:
-            query = query & Q(category_id=category_id)
 
-        queryset = Product.objects.filter(
-            query).select_related(
-            'shop', 'category').prefetch_related(
-            'product_parameters__parameter').distinct()
+class ProductFacetsAPIView(APIView):
+    """
+    Количество товаров с каждым значением каждого параметра при текущих фильтрах каталога
+    """
 
-        serializer = ProductSerializer(queryset, many=True)
-        return Response(serializer.data)
+    @conditional_response(products_scope)
+    @cached_response(products_scope)
+    def get(self, request, *args, **kwargs):
+        try:
+            # по одной категории сводка посчитана заранее при загрузке прайс-листов
+            if set(request.query_params) == {'category_id'}:
+                catalog_ids(request.query_params)
+                return Response(category_facets(request.query_params['category_id']))
+            products = catalog_products(request.query_params)
+        except FilterError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400)
+        search = request.query_params.get('search')
+        if search:
+            products = search_products(products, search)
+        return Response(facet_counts(products))
+
+
+class ProductExportAPIView(APIView):
+    """
+    Выгрузка каталога целиком потоком: JSON-массив или JSON Lines (output=jsonl), со сжатием gzip,
+    если клиент его принимает. С updated_since выгружаются все товары, измененные после этого
+    момента, включая снятые с продажи, чтобы их можно было удалить из индекса.
+    """
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        output = params.get('output', 'json')
+        if output not in ('json', 'jsonl'):
+            return JsonResponse({'Status': False, 'Error': 'Формат выгрузки - json или jsonl'}, status=400)
+
+        try:
+            products = Product.objects.filter(catalog_ids(params))
+        except FilterError as e:
+            return JsonResponse({'Status': False, 'Error': str(e)}, status=400)
+        updated_since = params.get('updated_since')
+        if updated_since:
+            updated_since = parse_moment(updated_since)
+            if updated_since is None:
+                return JsonResponse({'Status': False, 'Error': 'Неверная дата updated_since'}, status=400)
+            products = products.filter(updated_at__gte=updated_since)
+        else:
+            products = products.filter(is_active=True)
+
+        content = export_products(products, lines=output == 'jsonl')
+        content_type = 'application/x-ndjson' if output == 'jsonl' else 'application/json'
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = StreamingHttpResponse(gzip_stream(content), content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = StreamingHttpResponse(content, content_type=content_type)
+        response['Vary'] = 'Accept-Encoding'
+        return response
 
 
 class BasketAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        basket = Order.objects.filter(
-            ordered_items__product__shop__user_id=request.user.id).exclude(order_state='basket').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product__price_rrc'))).distinct()
-        # basket = Order.objects.filter(
-        #     user_id=request.user.id, order_state='basket')
-        serializer = OrderSerializer(basket, many=True)
-        return Response(serializer.data)
+        return order_list(request, Order.objects.filter(user_id=request.user.id, order_state='basket'))
 
     def post(self, request, *args, **kwargs):
+        # все позиции проверяются и добавляются вместе: либо все, либо ни одной
         if {'items'}.issubset(request.data):
-            items = load_json(request.data.get('items'))
-            order, _ = Order.objects.get_or_create(user=request.user, order_state='basket')
-            for order_item in items:
-                order_item.update({'order': order.id})
-                serializer = OrderItemSerializer(data=order_item)
-                product = Product.objects.filter(id=order_item['product']).values('quantity')
-                print(order_item)
-                if product:
-                    if product[0]['quantity'] >= order_item['quantity']:
-                        if serializer.is_valid():
-                            serializer.save()
-                        else:
-                            return Response({'status': False, 'error': serializer.errors},
-                                            status=status.HTTP_403_FORBIDDEN)
-                    else:
-                        return Response({'status': False, 'error': 'Такого количества товаров нет в наличии'},
-                                        status=status.HTTP_403_FORBIDDEN)
-                else:
-                    return Response({'status': False, 'error': 'Такого товара нет в наличии'},
-                                    status=status.HTTP_403_FORBIDDEN)
+            try:
+                quantities = basket_quantities(request.data.get('items'))
+                with transaction.atomic():
+                    check_stock(quantities)
+                    order, _ = Order.objects.get_or_create(user=request.user, order_state='basket')
+                    add_items(order, quantities)
+                    update_totals(order.id)
+            except BasketError as e:
+                return Response({'status': False, 'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
         else:
             return Response({'status': False, 'error': 'Необходимо указать поля "items"'},
                             status=status.HTTP_403_FORBIDDEN)
@@ -400,16 +587,15 @@ class BasketAPIView(APIView):
 
     def put(self, request, *args, **kwargs):
         if {'items'}.issubset(request.data):
-            items = load_json(request.data.get('items'))
-            order, _ = Order.objects.get_or_create(user=request.user, order_state='basket')
-            for order_item in items:
-                product = Product.objects.filter(id=order_item['product']).values('quantity')
-                if product[0]['quantity'] >= order_item['quantity']:
-                    OrderItem.objects.filter(order=order.id, product=order_item['product']) \
-                        .update(quantity=order_item['quantity'])
-                else:
-                    return Response({'status': False, 'error': 'Такого количества товаров нет в наличии'},
-                                    status=status.HTTP_403_FORBIDDEN)
+            try:
+                quantities = basket_quantities(request.data.get('items'))
+                with transaction.atomic():
+                    check_stock(quantities)
+                    order, _ = Order.objects.get_or_create(user=request.user, order_state='basket')
+                    update_items(order, quantities)
+                    update_totals(order.id)
+            except BasketError as e:
+                return Response({'status': False, 'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
         else:
             return Response({'status': False, 'error': 'Необходимо указать поля "items"'},
                             status=status.HTTP_403_FORBIDDEN)
@@ -417,15 +603,20 @@ class BasketAPIView(APIView):
         return Response({"status": True})
 
     def delete(self, request, *args, **kwargs):
+        # удаляются только позиции корзины пользователя: товары оформленных заказов зарезервированы на складе
         if {'items'}.issubset(request.data):
-            for id in request.data['items'].split(','):
-                if OrderItem.objects.filter(pk=int(id)).exists():
-                    order_item = OrderItem.objects.get(pk=int(id))
-                    order_item.delete()
-                    return Response({'status': True}, status=status.HTTP_200_OK)
-                else:
+            ids = str(request.data['items']).split(',')
+            if not all(item_id.strip().isdigit() for item_id in ids):
+                return Response({'status': False, 'error': 'id позиций - числа через запятую'},
+                                status=status.HTTP_403_FORBIDDEN)
+            with transaction.atomic():
+                order = Order.objects.filter(user=request.user, order_state='basket').first()
+                deleted = order and order.ordered_items.filter(id__in=[int(item_id) for item_id in ids]).delete()[0]
+                if not deleted:
                     return Response({'status': False, 'error': 'Такой позиции нет в корзине'},
                                     status=status.HTTP_403_FORBIDDEN)
+                update_totals(order.id)
+            return Response({'status': True}, status=status.HTTP_200_OK)
         else:
             return Response({'status': False, 'error': 'Необходимо указать id позиции'},
                             status=status.HTTP_403_FORBIDDEN)
@@ -435,21 +626,20 @@ class OrderAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        order = Order.objects.filter(
-            ordered_items__product__shop__user_id=request.user.id).exclude(order_state='new').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product__price_rrc'))).distinct()
-        serializer = OrderSerializer(order, many=True)
-        return Response(serializer.data)
+        return order_list(request, Order.objects.filter(user_id=request.user.id).exclude(order_state='basket'))
 
     def post(self, request, *args, **kwargs):
         if {'id', 'contact'}.issubset(request.data):
-            order = Order.objects.filter(pk=int(request.data['id'])).update(contact=int(request.data['contact']),
-                                                                            order_state='new')
-            user_email = request.user.email
-            user_message = f'Номер вашего заказа {order}'
-            send_mail('Заказ в интернет-магазине', user_message, settings.EMAIL_HOST_USER, [user_email])
-            partner_message = f'Пользователь {user_email} разместил заказ №{order}'
-            send_mail(f'Новый заказ {order}', partner_message, settings.EMAIL_HOST_USER, settings.RECIPIENTS_EMAIL)
+            # товары списываются со склада при оформлении и возвращаются, если заказ не подтвердят вовремя
+            try:
+                order_id, contact_id = (number(request.data[key], 'id и contact - числа') for key in ('id', 'contact'))
+                order, categories = checkout(request.user, order_id, contact_id)
+            except BasketError as e:
+                return Response({'status': False, 'error': str(e)}, status=status.HTTP_403_FORBIDDEN)
+            transaction.on_commit(lambda: refresh_counters_task.delay(list(categories.items())))
+            # письма отправляет воркер из очереди заказов, ответ не ждет почтового сервера
+            transaction.on_commit(send_order_emails_task.delay)
+            order = order.id
         else:
             return Response({'status': False, 'error': 'Необходимо указать id и contact'},
                             status=status.HTTP_403_FORBIDDEN)
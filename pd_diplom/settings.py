@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -181,8 +182,56 @@ SPECTACULAR_SETTINGS = {
     'SERVE_INCLUDE_SCHEMA': False,
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+# Кеш ответов каталога (товары, магазины, категории)
+CATALOG_CACHE = 'default'
+CATALOG_CACHE_TIMEOUT = 60 * 60  # секунд, устаревшие версии вытесняются и раньше
+CATALOG_SNAPSHOT_TIMEOUT = 7 * 24 * 60 * 60  # сколько хранить снимки каталога магазина, секунд
+CATALOG_SNAPSHOT_DELAY = 60  # через сколько секунд после изменения остатков заново готовить снимки
+
 CELERY_BROKER_URL = "redis://localhost:6379"
 CELERY_RESULT_BACKEND = "redis://localhost:6379"
+CELERY_BEAT_SCHEDULE = {
+    'collect-catalog-versions': {
+        'task': 'main.tasks.collect_catalog_versions_task',
+        'schedule': 60 * 60,
+    },
+    'schedule-imports': {
+        'task': 'main.tasks.schedule_imports_task',
+        'schedule': 5 * 60,
+    },
+    'release-reservations': {
+        'task': 'main.tasks.release_reservations_task',
+        'schedule': 5 * 60,
+    },
+    'send-order-emails': {
+        'task': 'main.tasks.send_order_emails_task',
+        'schedule': 60,
+    },
+}
+
+# Сколько секунд оформленный заказ держит товары на складе, пока его не подтвердят
+ORDER_RESERVATION_TIMEOUT = 24 * 60 * 60
+# Кому отправлять уведомления о новых заказах, адреса через запятую
+RECIPIENTS_EMAIL = [email for email in os.getenv('RECIPIENTS_EMAIL', '').split(',') if email]
+# Письма о заказах отправляются задачей Celery через одно соединение с почтовым сервером на пачку заказов
+ORDER_EMAIL_BATCH_SIZE = 100  # заказов в пачке
+ORDER_EMAIL_RATE_LIMIT = os.getenv('ORDER_EMAIL_RATE_LIMIT', '60/m')  # пачек на одного воркера
+ORDER_EMAIL_LOCK_TIMEOUT = 10 * 60  # через сколько секунд снимается блокировка зависшей отправки
+ORDER_EMAIL_MAX_RETRIES = 5  # повторов при недоступном почтовом сервере
+ORDER_EMAIL_RETRY_DELAY = 30  # задержка первого повтора, секунд, каждый следующий - вдвое дольше
+
+# Плановое обновление прайс-листов всех магазинов
+IMPORT_INTERVAL = 24 * 60 * 60  # как часто обновлять прайс каждого магазина, секунд
+IMPORT_CONCURRENCY = 8  # одновременных загрузок всего
+IMPORT_HOST_CONCURRENCY = 2  # одновременных загрузок с одного сервера поставщика
+IMPORT_JITTER = 60  # случайная задержка запуска загрузки, секунд
+IMPORT_RUN_TIMEOUT = 6 * 60 * 60  # через сколько секунд незавершенная загрузка не считается активной
 
 AUTHENTICATION_BACKENDS = (
     'django.contrib.auth.backends.ModelBackend',
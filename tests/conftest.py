@@ -0,0 +1,23 @@
+import pytest
+from django.core.cache import caches
+from main.interning import parameter_cache, category_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_intern_caches():
+    """
+    Кеши имен живут в процессе, а тестовые транзакции откатываются - очищаем их между тестами
+    """
+    yield
+    parameter_cache.clear()
+    category_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def local_cache(settings):
+    """
+    Вместо Redis в тестах - кеш в памяти процесса, свой для каждого теста
+    """
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    yield
+    caches['default'].clear()
@@ -0,0 +1,62 @@
+import json
+from io import StringIO, BytesIO
+
+import pytest
+from django.core.management import call_command, CommandError
+from main.benchmark import generate_price_list, run_benchmark, compare
+from main.models import Shop, Product
+from main.price_list import read_price_list
+
+
+def price_list_file(size, format):
+    stream = StringIO()
+    generate_price_list(stream, size, format)
+    return BytesIO(stream.getvalue().encode())
+
+
+@pytest.mark.parametrize('format', ['yaml', 'jsonl'])
+def test_generate_price_list(format):
+    data = read_price_list(price_list_file(50, format), format)
+    goods = list(data['goods'])
+    assert len(goods) == 50
+    assert len(data['categories']) == 5
+    assert {item['category'] for item in goods} <= {category['id'] for category in data['categories']}
+    assert all(len(item['parameters']) >= 3 for item in goods)
+
+
+def test_generate_price_list_is_reproducible():
+    assert price_list_file(20, 'yaml').getvalue() == price_list_file(20, 'yaml').getvalue()
+
+
+@pytest.mark.django_db
+def test_run_benchmark():
+    result = run_benchmark(price_list_file(1000, 'jsonl'), 'jsonl')
+    assert result['rows'] == 1000
+    assert result['queries'] < 60
+    assert result['rows_per_second'] > 0
+    assert not Shop.objects.exists()
+    assert not Product.objects.exists()
+
+
+def test_compare():
+    baseline = {'wall_time': 1, 'queries': 10, 'peak_rss': 100, 'rows_per_second': 1000}
+    assert compare({'wall_time': 1.1, 'queries': 10, 'peak_rss': 90, 'rows_per_second': 900}, baseline) == []
+    assert compare({'wall_time': 1.5, 'queries': 20, 'peak_rss': 100, 'rows_per_second': 500}, baseline) == [
+        'wall_time: 1.5 > 1', 'queries: 20 > 10', 'rows_per_second: 500 < 1000']
+
+
+@pytest.mark.django_db
+def test_benchmark_import_command(tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    call_command('benchmark_import', '--sizes', '100', '--baseline', str(baseline), '--save', stdout=StringIO())
+    assert set(json.loads(baseline.read_text())) == {'100'}
+
+    baseline.write_text(json.dumps({'100': {'queries': 1}}))
+    with pytest.raises(CommandError):
+        call_command('benchmark_import', '--sizes', '100', '--baseline', str(baseline), stdout=StringIO())
+
+
+def test_generate_price_list_command(tmp_path):
+    output = tmp_path / 'shop.jsonl'
+    call_command('generate_price_list', '30', str(output), '--format', 'jsonl', stdout=StringIO())
+    assert len(output.read_text(encoding='utf-8').splitlines()) == 31
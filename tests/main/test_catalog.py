@@ -0,0 +1,544 @@
+import gzip
+from hashlib import sha256
+
+import pytest
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from model_bakery import baker
+from rest_framework.test import APIClient
+from rest_framework.renderers import JSONRenderer
+from main.benchmark import populate_catalog, run_search_benchmark, run_serialization_benchmark, SEARCH_QUERIES
+from main.catalog_cache import cache_stats, invalidate_shop, bump, versions, shop_version
+from main.facets import filter_by_parameters, category_facets
+from main.importer import import_price_list
+from main.renderers import FastJSONRenderer
+from main.serializers import ProductSerializer, ShopSerializer, CategorySerializer, ImportRunSerializer, \
+    ValuesSerializer, product_rows, shop_rows, category_rows
+from main.search import search_products
+from main.snapshots import build_snapshots, drop_snapshots
+from main.pagination import products_page, ORDERINGS, PAGE_SIZE
+from main.models import Product, Category, Shop, User, Parameter, ProductParameter
+
+
+@pytest.fixture
+def client():
+    return APIClient()
+
+
+@pytest.fixture
+def catalog():
+    """
+    Три категории, в каждой товары с повторяющимися названиями
+    """
+    shop = Shop.objects.create(name='test_shop')
+    categories = [Category.objects.create(name=f'category {i}') for i in range(3)]
+    return [baker.make(Product, shop=shop, category=categories[i % 3], name=f'product {i % 4}')
+            for i in range(30)]
+
+
+def read_pages(client, url):
+    pages = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.append(response.json())
+        url = response.headers.get('Link', '').partition('<')[2].partition('>')[0]
+    return pages
+
+
+def catalog_order(products):
+    products = sorted(products, key=lambda product: product.id)
+    products = sorted(products, key=lambda product: product.name, reverse=True)
+    return [product.id for product in sorted(products, key=lambda product: product.category_id)]
+
+
+@pytest.mark.django_db
+def test_product_pages(client, catalog):
+    pages = read_pages(client, '/api/v1/products?limit=7')
+    assert [len(page) for page in pages] == [7, 7, 7, 7, 2]
+    assert [product['id'] for page in pages for product in page] == catalog_order(catalog)
+
+
+@pytest.mark.django_db
+def test_product_pages_by_category(client, catalog):
+    category_id = catalog[0].category_id
+    pages = read_pages(client, f'/api/v1/products?limit=4&category_id={category_id}')
+    assert [product['id'] for page in pages for product in page] == catalog_order(
+        [product for product in catalog if product.category_id == category_id])
+
+
+@pytest.mark.django_db
+def test_product_page_cost_does_not_grow(client, catalog):
+    """
+    Страница из середины каталога стоит столько же запросов, сколько первая, без OFFSET и COUNT
+    """
+    url = '/api/v1/products?limit=5'
+    counts = []
+    while url:
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        assert 'OFFSET' not in sql and 'COUNT' not in sql
+        counts.append(len(context.captured_queries))
+        url = response.headers.get('Link', '').partition('<')[2].partition('>')[0]
+    assert max(counts) <= 2
+
+
+@pytest.mark.django_db
+def test_product_pages_are_stable_under_import(client, catalog):
+    response = client.get('/api/v1/products?limit=10')
+    seen = [product['id'] for product in response.json()]
+    next_url = response.headers['Link'].partition('<')[2].partition('>')[0]
+    # до курсора добавляется товар, а один из просмотренных снимается с продажи
+    baker.make(Product, shop=catalog[0].shop, category=catalog[0].category, name='product 9')
+    Product.objects.filter(id=seen[0]).update(is_active=False)
+
+    pages = read_pages(client, next_url)
+    rest = [product['id'] for page in pages for product in page]
+    assert rest == catalog_order(catalog)[10:]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('ordering, key', [
+    ('price', lambda product: (product.price_rrc, product.id)),
+    ('-price', lambda product: (-product.price_rrc, -product.id)),
+    ('name', lambda product: (product.name, -product.id)),
+    ('-name', lambda product: (product.name, -product.id)),
+])
+def test_product_pages_ordering(client, catalog, ordering, key):
+    for i, product in enumerate(catalog):
+        product.price_rrc = 1000 + i % 7 * 100
+        product.save()
+    pages = read_pages(client, f'/api/v1/products?limit=4&ordering={ordering}&price_min=1100&price_max=1500')
+    expected = sorted((product for product in catalog if 1100 <= product.price_rrc <= 1500), key=key,
+                      reverse=ordering == '-name')
+    assert [product['id'] for page in pages for product in page] == [product.id for product in expected]
+
+
+@pytest.mark.django_db
+def test_product_price_range(client, catalog):
+    Product.objects.filter(id__in=[catalog[0].id, catalog[1].id]).update(price_rrc=50)
+    response = client.get('/api/v1/products?price_max=50')
+    assert {product['id'] for product in response.json()} == {catalog[0].id, catalog[1].id}
+    assert client.get('/api/v1/products?price_min=51&price_max=50').json() == []
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('query', ['cursor=bad', 'cursor=WzEsMl0=', 'limit=0', 'limit=x', 'ordering=quantity',
+                                   'ordering=price&cursor=WzEsMl0=', 'price_min=-1', 'price_max=x', 'shop_id=abc',
+                                   'category_id=abc'])
+def test_product_pages_bad_request(client, query):
+    response = client.get(f'/api/v1/products?{query}')
+    assert response.status_code == 400
+    assert response.json()['Status'] is False
+
+
+@pytest.fixture
+def large_catalog():
+    shop = populate_catalog(20000)
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE main_product SET is_active = false WHERE id % 10 = 0')
+        cursor.execute('ANALYZE main_product')
+    return shop
+
+
+@pytest.mark.django_db
+def test_product_listings_use_indexes(large_catalog):
+    """
+    Списки товаров читаются по частичным индексам товаров в продаже, без полного прохода и сортировки
+    """
+    products = Product.objects.filter(is_active=True)
+    category_id = products.values_list('category_id', flat=True).first()
+    plans = {
+        'product_active_category_price': products.filter(category_id=category_id, price_rrc__gte=5000).order_by(
+            *ORDERINGS['price']),
+        'product_active_shop_price': products.filter(shop=large_catalog, category_id__gt=category_id).order_by(
+            *ORDERINGS['-price']),
+        'product_active_price': products.filter(price_rrc__lte=9000).order_by(*ORDERINGS['price']),
+        'product_active_name': products.order_by(*ORDERINGS['-name']),
+        'product_active_shop_category': products.filter(shop=large_catalog).order_by('category_id', '-name', 'id'),
+    }
+    for index, queryset in plans.items():
+        plan = queryset[:PAGE_SIZE + 1].explain()
+        assert index in plan
+        assert 'Seq Scan' not in plan and 'Sort' not in plan
+
+
+@pytest.mark.django_db
+def test_product_ordering_page_uses_index(large_catalog):
+    first, cursor = products_page(Product.objects.filter(is_active=True), limit=PAGE_SIZE, ordering='-price')
+    queryset = Product.objects.filter(is_active=True)
+    # запрос следующей страницы - тот же проход по индексу от позиции курсора
+    with CaptureQueriesContext(connection) as context:
+        page, _ = products_page(queryset, cursor, PAGE_SIZE, ordering='-price')
+    assert page[0].price_rrc <= first[-1].price_rrc
+    with connection.cursor() as db_cursor:
+        db_cursor.execute('EXPLAIN ' + context.captured_queries[0]['sql'])
+        plan = '\n'.join(row[0] for row in db_cursor.fetchall())
+    assert 'product_active_price' in plan and 'Seq Scan' not in plan and 'Sort' not in plan
+
+
+@pytest.mark.django_db
+def test_product_list_is_cached(client, catalog):
+    first = client.get('/api/v1/products?limit=5&shop_id=%s' % catalog[0].shop_id)
+    with CaptureQueriesContext(connection) as context:
+        second = client.get('/api/v1/products?shop_id=%s&limit=5' % catalog[0].shop_id)
+    assert context.captured_queries == []
+    assert second.json() == first.json()
+    assert second.headers['Link'] == first.headers['Link']
+    assert cache_stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+@pytest.mark.django_db
+def test_product_cache_invalidated_by_import(client, catalog, django_capture_on_commit_callbacks):
+    product = catalog[0]
+    url = f'/api/v1/products?category_id={product.category_id}'
+    other_url = '/api/v1/products?category_id=%s' % catalog[1].category_id
+    client.get(url)
+    client.get(other_url)
+    product.shop.categories.add(product.category)
+    Product.objects.filter(id=product.id).update(is_active=False)
+    with django_capture_on_commit_callbacks(execute=True):
+        invalidate_shop(product.shop_id)
+
+    assert product.id not in [item['id'] for item in client.get(url).json()]
+    client.get(other_url)
+    assert cache_stats()['hits'] == 1
+
+
+@pytest.mark.django_db
+def test_shop_cache_invalidated_by_state(client, django_capture_on_commit_callbacks):
+    user = User.objects.create_user(email='shop@test.ru', type='shop', is_active=True)
+    shop = Shop.objects.create(name='test_shop', user=user)
+    assert client.get(f'/api/v1/shops/{shop.id}/').json()['state'] is True
+
+    client.force_authenticate(user)
+    with django_capture_on_commit_callbacks(execute=True):
+        client.post('/api/v1/partner/state', {'state': 'false'})
+    client.force_authenticate(None)
+    assert client.get(f'/api/v1/shops/{shop.id}/').json()['state'] is False
+
+
+@pytest.mark.django_db
+def test_cache_stats_for_admin_only(client):
+    assert client.get('/api/v1/products/cache').status_code == 401
+    client.force_authenticate(User.objects.create_superuser(email='admin@test.ru', password='admin'))
+    assert client.get('/api/v1/products/cache').json() == {'hits': 0, 'misses': 0, 'hit_rate': 0}
+
+
+@pytest.mark.django_db
+def test_product_snapshots(client, catalog):
+    shop_id = catalog[0].shop_id
+    urls = [f'/api/v1/products?shop_id={shop_id}',
+            f'/api/v1/products?shop_id={shop_id}&category_id={catalog[0].category_id}']
+    expected = [client.get(url) for url in urls]
+    caches['default'].clear()
+    build_snapshots(shop_id)
+
+    for url, response in zip(urls, expected):
+        with CaptureQueriesContext(connection) as context:
+            snapshot = client.get(url)
+        assert context.captured_queries == []
+        assert snapshot.content == response.content
+        assert snapshot['X-Content-Hash'] == sha256(response.content).hexdigest()
+
+    compressed = client.get(urls[0], HTTP_ACCEPT_ENCODING='gzip, deflate')
+    assert compressed['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.content) == expected[0].content
+
+
+@pytest.mark.django_db
+def test_product_snapshot_pages(client, catalog, monkeypatch):
+    monkeypatch.setattr('main.snapshots.PAGE_SIZE', 7)
+    shop_id = catalog[0].shop_id
+    expected = read_pages(client, f'/api/v1/products?shop_id={shop_id}&limit=7')
+    assert build_snapshots(shop_id) == 5 + 3 * 2
+    with CaptureQueriesContext(connection) as context:
+        assert read_pages(client, f'/api/v1/products?shop_id={shop_id}&limit=7') == expected
+    assert context.captured_queries == []
+
+
+@pytest.mark.django_db
+def test_product_snapshots_dropped(client, catalog):
+    shop_id = catalog[0].shop_id
+    build_snapshots(shop_id)
+    drop_snapshots(shop_id)
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(f'/api/v1/products?shop_id={shop_id}')
+    assert context.captured_queries
+    assert 'X-Content-Hash' not in response
+
+
+@pytest.mark.django_db
+def test_late_snapshot_build_does_not_overwrite_pages(client, catalog, monkeypatch):
+    shop_id = catalog[0].shop_id
+    url = f'/api/v1/products?shop_id={shop_id}'
+
+    def quantities():
+        return {row['id']: row['quantity'] for row in client.get(url).json()}
+
+    # подготовка снимков начинается до изменения остатков, а заканчивается после
+    started = versions([shop_version(shop_id)])
+    Product.objects.filter(id=catalog[0].id).update(quantity=0)
+    bump([shop_version(shop_id)])
+    build_snapshots(shop_id)
+    assert quantities()[catalog[0].id] == 0
+
+    calls = iter([started])
+    monkeypatch.setattr('main.snapshots.versions', lambda keys: next(calls, None) or versions(keys))
+    Product.objects.filter(id=catalog[0].id).update(quantity=catalog[0].quantity)
+    build_snapshots(shop_id)
+    monkeypatch.undo()
+    Product.objects.filter(id=catalog[0].id).update(quantity=0)
+    assert 'X-Content-Hash' in client.get(url)
+    assert quantities()[catalog[0].id] == 0
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('url', ['/api/v1/products?shop_id={shop}', '/api/v1/products?category_id={category}',
+                                 '/api/v1/products/facets?category_id={category}', '/api/v1/shops/',
+                                 '/api/v1/shops/{shop}/', '/api/v1/categories/', '/api/v1/categories/{category}/'])
+def test_conditional_get(client, catalog, url, django_capture_on_commit_callbacks):
+    catalog[0].shop.categories.set({product.category for product in catalog})
+    url = url.format(shop=catalog[0].shop_id, category=catalog[0].category_id)
+    response = client.get(url)
+    etag = response['ETag']
+    assert client.get(url)['ETag'] == etag
+
+    with CaptureQueriesContext(connection) as context:
+        not_modified = client.get(url, HTTP_IF_NONE_MATCH=f'"other", W/{etag}')
+    assert not_modified.status_code == 304
+    assert not_modified['ETag'] == etag
+    assert not_modified.content == b''
+    assert context.captured_queries == []
+    assert client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code == 200
+
+    with django_capture_on_commit_callbacks(execute=True):
+        invalidate_shop(catalog[0].shop_id)
+    changed = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert changed.status_code == 200
+    assert changed['ETag'] != etag
+
+
+@pytest.mark.django_db
+def test_conditional_get_representations(client, catalog):
+    url = f'/api/v1/products?shop_id={catalog[0].shop_id}'
+    etag = client.get(url)['ETag']
+    assert client.get(url, HTTP_ACCEPT='text/html')['ETag'] != etag
+    assert client.get(url + '&limit=5')['ETag'] != etag
+
+    build_snapshots(catalog[0].shop_id)
+    assert client.get(url)['ETag'] == etag
+    compressed = client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+    assert compressed['ETag'] == etag[:-1] + '-gzip"'
+    assert client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=compressed['ETag']).status_code == 304
+
+
+@pytest.mark.django_db
+def test_conditional_get_after_shop_state(client, django_capture_on_commit_callbacks):
+    user = User.objects.create_user(email='shop@test.ru', type='shop', is_active=True)
+    shop = Shop.objects.create(name='test_shop', user=user)
+    etag = client.get(f'/api/v1/shops/{shop.id}/')['ETag']
+
+    client.force_authenticate(user)
+    with django_capture_on_commit_callbacks(execute=True):
+        client.post('/api/v1/partner/state', {'state': 'false'})
+    client.force_authenticate(None)
+    response = client.get(f'/api/v1/shops/{shop.id}/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response.json()['state'] is False
+
+
+@pytest.fixture
+def search_catalog():
+    shop = Shop.objects.create(name='test_shop')
+    import_price_list(shop, {
+        'shop': 'test_shop',
+        'categories': [{'id': 1, 'name': 'Смартфоны'}],
+        'goods': [
+            {'id': 1, 'category': 1, 'model': 'apple/iphone-13', 'name': 'Смартфон Apple iPhone 13', 'price': 1,
+             'price_rrc': 1, 'quantity': 1, 'parameters': {'Цвет': 'красный'}},
+            {'id': 2, 'category': 1, 'model': 'samsung/galaxy-s22', 'name': 'Смартфон Samsung Galaxy S22',
+             'price': 1, 'price_rrc': 1, 'quantity': 1, 'parameters': {'Цвет': 'черный'}},
+            {'id': 3, 'category': 1, 'model': 'xiaomi/redmi-10', 'name': 'Чехол для Xiaomi Redmi 10', 'price': 1,
+             'price_rrc': 1, 'quantity': 1, 'parameters': {'Цвет': 'красный', 'Материал': 'силикон'}},
+        ]})
+    return dict(Product.objects.values_list('external_id', 'id'))
+
+
+def search(client, text):
+    response = client.get('/api/v1/products', {'search': text})
+    assert response.status_code == 200
+    return [product['id'] for product in response.json()]
+
+
+@pytest.mark.django_db
+def test_product_search(client, search_catalog):
+    assert search(client, 'смартфоны') == [search_catalog['1'], search_catalog['2']]
+    assert search(client, 'galaxy') == [search_catalog['2']]
+    assert search(client, 'силикона') == [search_catalog['3']]
+    assert search(client, 'смартфон -samsung') == [search_catalog['1']]
+    assert search(client, 'телевизор') == []
+
+
+@pytest.mark.django_db
+def test_product_search_ranking(client, search_catalog):
+    """
+    Совпадение в названии важнее совпадения в модели, а оно важнее совпадения в параметрах
+    """
+    assert search(client, 'redmi') == [search_catalog['3']]
+    assert search(client, 'красный')[0] in (search_catalog['1'], search_catalog['3'])
+    Product.objects.filter(id=search_catalog['2']).update(name='Красный смартфон')
+    caches['default'].clear()
+    assert search(client, 'красный')[0] == search_catalog['2']
+
+
+@pytest.mark.django_db
+def test_product_search_vector_follows_import(client, search_catalog):
+    shop = Shop.objects.get()
+    import_price_list(shop, {
+        'shop': 'test_shop',
+        'categories': [{'id': 1, 'name': 'Смартфоны'}],
+        'goods': [
+            {'id': 1, 'category': 1, 'model': 'apple/iphone-14', 'name': 'Смартфон Apple iPhone 14', 'price': 1,
+             'price_rrc': 1, 'quantity': 1, 'parameters': {'Цвет': 'синий'}},
+            {'id': 4, 'category': 1, 'model': 'honor/x8', 'name': 'Смартфон Honor X8', 'price': 1,
+             'price_rrc': 1, 'quantity': 1, 'parameters': {}},
+        ]})
+    assert search(client, 'синий') == [search_catalog['1']]
+    assert search(client, 'красный') == []
+    assert search(client, 'honor') == list(Product.objects.filter(external_id='4').values_list('id', flat=True))
+
+
+@pytest.mark.django_db
+def test_product_search_vector_follows_orm_writes(search_catalog):
+    def found(text):
+        return list(search_products(Product.objects.all(), text).values_list('id', flat=True))
+
+    product = Product.objects.create(shop=Shop.objects.get(), category_id=1, model='honor/x8',
+                                     name='Смартфон Honor X8', price=1, price_rrc=1, quantity=1)
+    assert found('honor') == [product.id]
+
+    product.name = 'Планшет Honor Pad'
+    product.save()
+    assert found('планшет') == [product.id]
+    assert product.id not in found('смартфон')
+
+    value = ProductParameter.objects.create(product=product, parameter=Parameter.objects.get(name='Цвет'),
+                                            value='зеленый')
+    assert found('зеленый') == [product.id]
+    ProductParameter.objects.filter(id=value.id).update(value='желтый')
+    assert found('желтый') == [product.id] and found('зеленый') == []
+    value.delete()
+    assert found('желтый') == []
+
+
+@pytest.mark.django_db
+def test_search_benchmark(large_catalog):
+    """
+    Поиск читает товары по GIN-индексу поискового документа. Время запросов выводит команда benchmark_search
+    """
+    results = run_search_benchmark(repeat=2)
+    assert set(results) == set(SEARCH_QUERIES)
+    assert all(set(timings) == {'p50', 'p95'} for timings in results.values())
+    for text in SEARCH_QUERIES:
+        plan = search_products(Product.objects.filter(is_active=True), text)[:PAGE_SIZE].explain()
+        assert 'product_search_vector' in plan and 'Seq Scan' not in plan
+
+    # large_catalog снимает с продажи каждый десятый товар, а вид товара тоже повторяется через десять
+    names = search_products(Product.objects.all(), '"телевизор lg"').values_list('name', flat=True)
+    assert names and all(name.lower().startswith('телевизор lg') for name in names)
+
+
+def product_ids(client, query):
+    response = client.get(f'/api/v1/products?{query}')
+    assert response.status_code == 200
+    return {product['id'] for product in response.json()}
+
+
+@pytest.mark.django_db
+def test_product_parameter_filters(client, search_catalog):
+    assert product_ids(client, 'parameter=Цвет:красный') == {search_catalog['1'], search_catalog['3']}
+    assert product_ids(client, 'parameter=Цвет:красный&parameter=Материал:силикон') == {search_catalog['3']}
+    assert product_ids(client, 'parameter=Цвет:красный&parameter=Цвет:черный') == set(search_catalog.values())
+    assert product_ids(client, 'parameter=Вес:100') == set()
+    assert client.get('/api/v1/products?parameter=Цвет').status_code == 400
+
+
+@pytest.mark.django_db
+def test_product_parameter_filter_uses_index(search_catalog):
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+    products = filter_by_parameters(Product.objects.all(), {'Цвет': ['красный'], 'Материал': ['силикон']})
+    assert 'product_parameter_value' in products.explain()
+
+
+@pytest.mark.django_db
+def test_product_facets(client, search_catalog):
+    response = client.get('/api/v1/products/facets?parameter=Цвет:красный')
+    assert response.json() == {'Цвет': {'красный': 2}, 'Материал': {'силикон': 1}}
+    response = client.get('/api/v1/products/facets?search=смартфон')
+    assert response.json() == {'Цвет': {'красный': 1, 'черный': 1}}
+
+
+@pytest.mark.django_db
+def test_category_facets_are_precomputed(client, search_catalog):
+    category_id = Product.objects.get(id=search_catalog['1']).category_id
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(f'/api/v1/products/facets?category_id={category_id}')
+    assert response.json() == {'Цвет': {'красный': 2, 'черный': 1}, 'Материал': {'силикон': 1}}
+    assert len(context.captured_queries) == 1
+    assert 'main_categoryfacet' in context.captured_queries[0]['sql']
+
+    import_price_list(Shop.objects.get(), {
+        'shop': 'test_shop',
+        'categories': [{'id': 1, 'name': 'Смартфоны'}],
+        'goods': [{'id': 1, 'category': 1, 'model': 'apple/iphone-13', 'name': 'Смартфон Apple iPhone 13',
+                   'price': 1, 'price_rrc': 1, 'quantity': 1, 'parameters': {'Цвет': 'синий'}}]})
+    assert category_facets(category_id) == {'Цвет': {'синий': 1}}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('query', ['category_id=abc', 'shop_id=abc', 'category_id=1&shop_id=abc', 'price_min=x'])
+def test_product_facets_bad_request(client, query):
+    response = client.get(f'/api/v1/products/facets?{query}')
+    assert response.status_code == 400
+    assert response.json()['Status'] is False
+
+
+@pytest.mark.django_db
+def test_fast_serialization_is_byte_compatible(client):
+    shop = Shop.objects.create(name='Магазин "Ёлка" \\ 😀')
+    category = Category.objects.create(name='Категория\u2028с разделителем')
+    for name in ('Товар "в кавычках"', 'Back\\slash\tтаб', 'Строка\u2029абзац', '</script>'):
+        baker.make(Product, shop=shop, category=category, name=name)
+
+    products = Product.objects.order_by('category', '-name', 'id')
+    for serializer, rows, queryset in ((ProductSerializer, product_rows, products),
+                                       (ShopSerializer, shop_rows, Shop.objects.all()),
+                                       (CategorySerializer, category_rows, Category.objects.all())):
+        assert FastJSONRenderer().render(rows.serialize(queryset)) == JSONRenderer().render(
+            serializer(queryset, many=True).data)
+
+    assert client.get('/api/v1/shops/').content == JSONRenderer().render(
+        ShopSerializer(Shop.objects.all(), many=True).data)
+    assert client.get('/api/v1/products').content == JSONRenderer().render(
+        ProductSerializer(products, many=True).data)
+
+
+def test_fast_serialization_supported_fields():
+    with pytest.raises(TypeError):
+        ValuesSerializer(ImportRunSerializer)
+
+
+@pytest.mark.django_db
+def test_serialization_benchmark():
+    shop = populate_catalog(2000)
+    products = Product.objects.filter(shop=shop).order_by('category', '-name', 'id')
+    assert FastJSONRenderer().render(product_rows.serialize(products.all())) == JSONRenderer().render(
+        ProductSerializer(products.all(), many=True).data)
+    # время и ускорение выводит команда benchmark_serialization
+    result = run_serialization_benchmark(products)
+    assert result['rows'] == 2000
+    assert set(result) == {'rows', 'serializer_ms', 'values_ms', 'speedup'}
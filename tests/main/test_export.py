@@ -0,0 +1,94 @@
+import gzip
+import json
+import tracemalloc
+from datetime import timedelta
+
+import pytest
+from django.utils.timezone import now
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from main.benchmark import populate_catalog
+from main.importer import import_price_list
+from main.models import Shop, Product
+from main.serializers import ProductExportSerializer
+from tests.main.test_import import make_price_list
+
+
+@pytest.fixture
+def client():
+    return APIClient()
+
+
+@pytest.fixture
+def shop():
+    shop = Shop.objects.create(name='test_shop')
+    import_price_list(shop, make_price_list(10))
+    return shop
+
+
+def export(client, query='', **headers):
+    response = client.get(f'/api/v1/products/export?{query}', **headers)
+    assert response.status_code == 200
+    return b''.join(response.streaming_content)
+
+
+@pytest.mark.django_db
+def test_export_json(client, shop):
+    content = export(client)
+    assert content == JSONRenderer().render(
+        ProductExportSerializer(Product.objects.filter(is_active=True).order_by('id'), many=True).data)
+    assert len(json.loads(content)) == 10
+    assert json.loads(content)[0]['updated_at'].endswith('Z')
+
+
+@pytest.mark.django_db
+def test_export_jsonl(client, shop):
+    lines = export(client, 'output=jsonl&category_id=1').splitlines()
+    assert len(lines) == 5
+    assert all(json.loads(line)['category'] == 1 for line in lines)
+    assert export(client, f'output=jsonl&shop_id={shop.id + 1}') == b''
+    assert export(client, f'shop_id={shop.id + 1}') == b'[]'
+
+
+@pytest.mark.django_db
+def test_export_gzip(client, shop):
+    content = export(client, 'output=jsonl', HTTP_ACCEPT_ENCODING='gzip')
+    assert gzip.decompress(content) == export(client, 'output=jsonl')
+
+
+@pytest.mark.django_db
+def test_export_updated_since(client, shop):
+    since = now()
+    Product.objects.update(updated_at=since - timedelta(days=1))
+    import_price_list(shop, make_price_list(8))
+    changed = [json.loads(line) for line in export(
+        client, 'output=jsonl&updated_since=' + since.isoformat().replace('+', '%2B')).splitlines()]
+    assert [(product['id'], product['is_active']) for product in changed] == list(
+        Product.objects.filter(external_id__in=['8', '9']).order_by('id').values_list('id', 'is_active'))
+    assert not any(product['is_active'] for product in changed)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('query', ['output=xml', 'updated_since=yesterday', 'updated_since=2024-13-01',
+                                   'shop_id=x', 'category_id=x'])
+def test_export_bad_request(client, query):
+    assert client.get(f'/api/v1/products/export?{query}').status_code == 400
+
+
+@pytest.mark.django_db
+def test_export_memory_is_flat(client, monkeypatch):
+    """
+    Пиковое потребление памяти при выгрузке не зависит от размера каталога
+    """
+    monkeypatch.setattr('main.export.EXPORT_CHUNK_SIZE', 100)
+    peaks = []
+    for size in (500, 5000):
+        Product.objects.all().delete()
+        populate_catalog(size)
+        response = client.get('/api/v1/products/export?output=jsonl')
+        tracemalloc.start()
+        rows = sum(chunk.count(b'\n') for chunk in response.streaming_content)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        assert rows == size
+    assert peaks[1] < peaks[0] * 2
@@ -0,0 +1,422 @@
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import yaml
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Count, Max, Min, Q
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+from main.counters import COUNTER_FIELDS
+from main.importer import import_price_list, stage_price_list, plan_chunk, publish, collect_versions
+from main.interning import InternCache, parameter_cache
+from main.tasks import partner_update_task
+from pd_diplom.celery import app as celery_app
+from main.models import Shop, Category, Product, Parameter, ProductParameter, User, Order, OrderItem, \
+    StagedProduct, CatalogVersion, ImportRun, ShopCategory
+
+
+def make_price_list(size, shop='test_shop'):
+    return {
+        'shop': shop,
+        'categories': [{'id': 1, 'name': 'Смартфоны'}, {'id': 2, 'name': 'Аксессуары'}],
+        'goods': [{'id': i,
+                   'category': 1 + i % 2,
+                   'model': f'model/{i}',
+                   'name': f'Товар {i}',
+                   'price': 100 + i,
+                   'price_rrc': 120 + i,
+                   'quantity': i % 7,
+                   'parameters': {'Цвет': 'черный' if i % 2 else 'белый', 'Диагональ (дюйм)': 6.5}}
+                  for i in range(size)],
+    }
+
+
+class PriceListHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        if server.etag and self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if server.etag:
+            self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(server.content)))
+        self.end_headers()
+        self.wfile.write(server.content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def price_list_server():
+    """
+    Локальный HTTP-сервер поставщика, отдающий прайс-лист с ETag
+    """
+    server = HTTPServer(('127.0.0.1', 0), PriceListHandler)
+    server.etag = '"v1"'
+    server.requests = 0
+    server.content = yaml.dump(make_price_list(10), allow_unicode=True).encode()
+    server.url = f'http://127.0.0.1:{server.server_port}/shop.yaml'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def writes(context):
+    return [query['sql'] for query in context.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+
+
+def catalog_writes(context):
+    return [sql for sql in writes(context) if 'main_importrun' not in sql]
+
+
+def start_import(user, url):
+    run = ImportRun.objects.create(user=user, url=url)
+    partner_update_task(run.id)
+    run.refresh_from_db()
+    return run
+
+
+@pytest.fixture(autouse=True)
+def celery_eager():
+    celery_app.conf.task_always_eager = True
+    yield
+    celery_app.conf.task_always_eager = False
+
+
+@pytest.fixture
+def shop():
+    return Shop.objects.create(name='test_shop')
+
+
+@pytest.fixture
+def client():
+    return APIClient()
+
+
+@pytest.fixture
+def partner():
+    return User.objects.create_user(email='partner@test.ru', type='shop', is_active=True)
+
+
+@pytest.mark.django_db
+def test_import_price_list(shop):
+    result = import_price_list(shop, make_price_list(10))
+    assert result == {'inserted': 10, 'updated': 0, 'deactivated': 0}
+    assert Product.objects.filter(shop=shop).count() == 10
+    assert set(Category.objects.filter(shops=shop).values_list('name', flat=True)) == {'Смартфоны', 'Аксессуары'}
+    assert Parameter.objects.count() == 2
+    assert ProductParameter.objects.count() == 20
+    product = Product.objects.get(model='model/3')
+    assert dict(product.product_parameters.values_list('parameter__name', 'value')) == {
+        'Цвет': 'черный', 'Диагональ (дюйм)': '6.5'}
+
+
+@pytest.mark.django_db
+def test_import_price_list_twice(shop):
+    import_price_list(shop, make_price_list(10))
+    result = import_price_list(shop, make_price_list(5))
+    assert result == {'inserted': 0, 'updated': 0, 'deactivated': 5}
+    assert Product.objects.filter(shop=shop).count() == 10
+    assert Product.objects.filter(shop=shop, is_active=True).count() == 5
+    assert Parameter.objects.count() == 2
+    assert Category.objects.count() == 2
+
+
+def counters(**filters):
+    return Product.objects.filter(is_active=True, **filters).aggregate(
+        product_count=Count('id'), in_stock_count=Count('id', filter=Q(quantity__gt=0)),
+        min_price=Min('price_rrc'), max_price=Max('price_rrc'))
+
+
+@pytest.mark.django_db
+def test_category_counters(shop):
+    other = Shop.objects.create(name='other_shop')
+    import_price_list(shop, make_price_list(10))
+    import_price_list(other, make_price_list(4, 'other_shop'))
+    assert Category.objects.values('product_count', 'in_stock_count', 'min_price', 'max_price').get(id=1) == {
+        'product_count': 7, 'in_stock_count': 5, 'min_price': 120, 'max_price': 128}
+
+    for size in (5, 1):
+        import_price_list(shop, make_price_list(size))
+        for category in Category.objects.all():
+            assert {field: getattr(category, field) for field in COUNTER_FIELDS} == counters(category=category)
+        for link in ShopCategory.objects.all():
+            assert {field: getattr(link, field) for field in COUNTER_FIELDS} == counters(
+                category_id=link.category_id, shop_id=link.shop_id)
+    assert ShopCategory.objects.values_list('product_count', 'min_price').get(shop=shop, category_id=2) == (0, None)
+
+
+@pytest.mark.django_db
+def test_category_counters_follow_partner_update(price_list_server, partner):
+    start_import(partner, price_list_server.url)
+    data = make_price_list(10)
+    data['goods'][3]['quantity'] = 0
+    data['goods'][5]['price_rrc'] = 1000
+    price_list_server.content = yaml.dump(data, allow_unicode=True).encode()
+    price_list_server.etag = '"v2"'
+    start_import(partner, price_list_server.url)
+    assert Category.objects.values_list('in_stock_count', 'max_price').get(id=2) == (3, 1000)
+
+
+@pytest.mark.django_db
+def test_category_counters_are_served_without_extra_queries(client, shop):
+    import_price_list(shop, make_price_list(10))
+    with CaptureQueriesContext(connection) as context:
+        response = client.get('/api/v1/categories/')
+    assert len(context.captured_queries) == 1
+    assert {category['id']: category['product_count'] for category in response.json()} == {1: 5, 2: 5}
+    assert client.get('/api/v1/categories/2/').json()['max_price'] == 129
+
+
+@pytest.mark.django_db
+def test_import_price_list_sync(shop):
+    import_price_list(shop, make_price_list(10))
+    ids = dict(Product.objects.values_list('external_id', 'id'))
+    user = User.objects.create_user(email='buyer@test.ru')
+    order = Order.objects.create(user=user)
+    OrderItem.objects.create(order=order, product_id=ids['1'], quantity=1)
+
+    data = make_price_list(12)
+    data['goods'][1]['price'] = 1
+    data['goods'][2]['parameters']['Цвет'] = 'красный'
+    del data['goods'][3]
+    result = import_price_list(shop, data)
+
+    assert result == {'inserted': 2, 'updated': 2, 'deactivated': 1}
+    assert dict(Product.objects.values_list('external_id', 'id')).items() >= ids.items()
+    assert Product.objects.get(external_id='1').price == 1
+    assert Product.objects.get(external_id='2').product_parameters.get(parameter__name='Цвет').value == 'красный'
+    assert not Product.objects.get(external_id='3').is_active
+    assert OrderItem.objects.filter(order=order).exists()
+
+
+@pytest.mark.django_db
+def test_import_query_count_does_not_grow():
+    """
+    Бенчмарк: число запросов не зависит от размера прайс-листа в пределах пачки
+    """
+    import_price_list(Shop.objects.create(name='warm_up'), make_price_list(1))
+    counts = []
+    for size in (10, 500):
+        shop = Shop.objects.create(name=f'shop_{size}')
+        with CaptureQueriesContext(connection) as context:
+            import_price_list(shop, make_price_list(size))
+        counts.append(len(context.captured_queries))
+    assert counts[0] == counts[1]
+    assert counts[1] < 50
+
+
+@pytest.mark.django_db
+def test_partner_update_not_modified(price_list_server, partner):
+    start_import(partner, price_list_server.url)
+    shop = Shop.objects.get(user=partner)
+    assert shop.etag == '"v1"'
+    assert len(shop.content_hash) == 64
+    assert Product.objects.filter(shop=shop).count() == 10
+
+    with CaptureQueriesContext(connection) as context:
+        response = partner_update_task(ImportRun.objects.create(user=partner, url=price_list_server.url).id)
+    assert price_list_server.requests == 2
+    assert response['Message'] == 'Прайс-лист не изменился'
+    assert catalog_writes(context) == []
+
+
+@pytest.mark.django_db
+def test_partner_update_same_content(price_list_server, partner):
+    price_list_server.etag = ''
+    start_import(partner, price_list_server.url)
+    with CaptureQueriesContext(connection) as context:
+        response = partner_update_task(ImportRun.objects.create(user=partner, url=price_list_server.url).id)
+    assert response['Message'] == 'Прайс-лист не изменился'
+    assert catalog_writes(context) == []
+
+
+@pytest.mark.django_db
+def test_partner_update_touches_only_changed_rows(price_list_server, partner):
+    start_import(partner, price_list_server.url)
+    data = make_price_list(10)
+    data['goods'][4]['quantity'] = 100
+    price_list_server.content = yaml.dump(data, allow_unicode=True).encode()
+    price_list_server.etag = '"v2"'
+
+    with CaptureQueriesContext(connection) as context:
+        start_import(partner, price_list_server.url)
+    product = Product.objects.get(external_id='4')
+    product_writes = [sql for sql in writes(context) if sql.startswith(('INSERT INTO "main_product" ',
+                                                                         'UPDATE "main_product" SET "category_id"'))]
+    assert len(product_writes) == 1
+    assert product_writes[0].endswith(f'WHERE "main_product"."id" IN ({product.id})')
+    assert product.quantity == 100
+    assert Shop.objects.get(user=partner).etag == '"v2"'
+
+
+@pytest.mark.django_db
+def test_partner_update_in_chunks(price_list_server, partner, monkeypatch):
+    monkeypatch.setattr('main.tasks.CHUNK_SIZE', 3)
+    start_import(partner, price_list_server.url)
+    shop = Shop.objects.get(user=partner)
+    assert Product.objects.filter(shop=shop, is_active=True).count() == 10
+    assert ProductParameter.objects.filter(product__shop=shop).count() == 20
+    assert Category.objects.filter(shops=shop).count() == 2
+    assert shop.catalog_version == 1
+    assert shop.catalog_versions.get().state == 'live'
+
+
+@pytest.mark.django_db
+def test_catalog_version_is_published_atomically(shop):
+    import_price_list(shop, make_price_list(5))
+    data = make_price_list(8)
+    data['goods'][0]['price'] = 1
+
+    version = stage_price_list(shop, data)
+    plan_chunk(version, 0, version.size)
+    assert Product.objects.filter(shop=shop).count() == 5
+    assert Product.objects.get(shop=shop, external_id='0').price == 100
+    shop.refresh_from_db()
+    assert shop.catalog_version == 1
+
+    result = publish(version, [1, 2])
+    assert result == {'inserted': 3, 'updated': 1, 'deactivated': 0}
+    assert Product.objects.get(shop=shop, external_id='0').price == 1
+    shop.refresh_from_db()
+    assert shop.catalog_version == 2
+    assert list(shop.catalog_versions.values_list('number', 'state')) == [(2, 'live'), (1, 'retired')]
+
+
+@pytest.mark.django_db
+def test_stale_catalog_version_is_not_published(shop):
+    old = stage_price_list(shop, make_price_list(5))
+    new = stage_price_list(shop, make_price_list(3))
+    plan_chunk(new, 0, new.size)
+    publish(new, [1, 2])
+    plan_chunk(old, 0, old.size)
+    assert publish(old, [1, 2]) is None
+    assert Product.objects.filter(shop=shop, is_active=True).count() == 3
+    old.refresh_from_db()
+    assert old.state == 'retired'
+
+
+@pytest.mark.django_db
+def test_failed_catalog_version_is_not_published(shop):
+    import_price_list(shop, make_price_list(5))
+    version = stage_price_list(shop, make_price_list(3))
+    plan_chunk(version, 0, version.size)
+    CatalogVersion.objects.filter(id=version.id).update(created_at=now() - timedelta(days=2))
+    collect_versions()
+    assert publish(version, [1, 2]) is None
+    assert Product.objects.filter(shop=shop, is_active=True).count() == 5
+    shop.refresh_from_db()
+    assert shop.catalog_version == 1
+
+    # помеченная ошибочной, но еще не удаленная версия тоже не публикуется
+    version = stage_price_list(shop, make_price_list(3))
+    CatalogVersion.objects.filter(id=version.id).update(state='failed')
+    assert publish(version, [1, 2]) is None
+    assert Product.objects.filter(shop=shop, is_active=True).count() == 5
+
+
+@pytest.mark.django_db
+def test_collect_catalog_versions(shop):
+    import_price_list(shop, make_price_list(5))
+    building = stage_price_list(shop, make_price_list(5))
+    assert StagedProduct.objects.count() == 10
+
+    collect_versions()
+    assert StagedProduct.objects.filter(version=building).count() == 5
+    assert StagedProduct.objects.count() == 5
+
+    CatalogVersion.objects.update(created_at=now() - timedelta(days=2))
+    collect_versions()
+    assert not StagedProduct.objects.exists()
+    assert list(shop.catalog_versions.values_list('state', flat=True)) == ['live']
+
+
+@pytest.mark.django_db
+def test_import_run_is_tracked(price_list_server, partner):
+    run = start_import(partner, price_list_server.url)
+    assert run.state == 'done'
+    assert run.shop == Shop.objects.get(user=partner)
+    assert run.rows_total == run.rows_processed == 10
+    assert run.result == {'inserted': 10, 'updated': 0, 'deactivated': 0}
+    assert all(value > 0 for value in (run.download_time, run.parse_time, run.db_write_time, run.plan_time,
+                                       run.finalize_time))
+    assert start_import(partner, price_list_server.url).state == 'not_modified'
+
+
+@pytest.mark.django_db
+def test_import_run_failure(partner):
+    run = ImportRun.objects.create(user=partner, url='http://127.0.0.1:1/shop.yaml')
+    with pytest.raises(Exception):
+        partner_update_task(run.id)
+    run.refresh_from_db()
+    assert run.state == 'failed'
+    assert run.errors
+
+
+@pytest.mark.django_db
+def test_partner_update_status_endpoint(client, price_list_server, partner):
+    client.force_authenticate(partner)
+    response = client.post('/api/v1/partner/update', data={'url': price_list_server.url})
+    assert response.status_code == 200
+    assert response.json()['status'] is True
+    run_id = response.json()['id']
+
+    response = client.get(f'/api/v1/partner/update/{run_id}')
+    assert response.status_code == 200
+    assert response.json()['state'] == 'done'
+    assert response.json()['rows_processed'] == 10
+
+    client.force_authenticate(User.objects.create_user(email='other@test.ru', type='shop', is_active=True))
+    assert client.get(f'/api/v1/partner/update/{run_id}').status_code == 404
+
+    # повторная загрузка уже известного магазина сразу привязана к нему
+    caches['default'].clear()
+    client.force_authenticate(partner)
+    run_id = client.post('/api/v1/partner/update', data={'url': price_list_server.url}).json()['id']
+    assert ImportRun.objects.get(id=run_id).shop == Shop.objects.get(user=partner, url=price_list_server.url)
+
+
+@pytest.mark.django_db
+def test_partner_update_builds_snapshots(client, price_list_server, partner):
+    run = start_import(partner, price_list_server.url)
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(f'/api/v1/products?shop_id={run.shop_id}')
+    assert context.captured_queries == []
+    assert len(response.json()) == 10
+    assert response.has_header('ETag')
+
+
+@pytest.mark.django_db
+def test_parameters_are_resolved_from_cache(shop):
+    import_price_list(shop, make_price_list(5))
+    parameter_cache.warm()
+    with CaptureQueriesContext(connection) as context:
+        ids = parameter_cache.resolve(['Цвет', 'Диагональ (дюйм)'])
+    assert context.captured_queries == []
+    assert ids == dict(Parameter.objects.values_list('name', 'id'))
+
+    with CaptureQueriesContext(connection) as context:
+        ids = parameter_cache.resolve(['Цвет', 'Вес', 'Память'])
+    assert len(context.captured_queries) == 2
+    assert set(ids) == {'Цвет', 'Вес', 'Память'}
+    assert Parameter.objects.count() == 4
+
+
+def test_intern_cache_is_bounded():
+    cache = InternCache(Parameter, maxsize=2)
+    cache.warmed = True
+    cache.remember({'a': 1, 'b': 2})
+    cache.resolve(['a'])
+    cache.remember({'c': 3})
+    assert list(cache.ids) == ['a', 'c']
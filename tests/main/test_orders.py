@@ -0,0 +1,467 @@
+import json
+from datetime import timedelta
+
+import pytest
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from model_bakery import baker, seq
+from rest_framework.test import APIClient
+from main.benchmark import run_checkout_benchmark
+from main.counters import refresh_counters
+from main.snapshots import build_snapshots
+from main.models import Category, Shop, Product, Order, OrderItem, User, Contact
+from main.tasks import release_reservations_task, refresh_counters_task, send_order_emails_task
+from pd_diplom.celery import app as celery_app
+
+
+@pytest.fixture(autouse=True)
+def celery_eager():
+    celery_app.conf.task_always_eager = True
+    yield
+    celery_app.conf.task_always_eager = False
+
+
+@pytest.fixture
+def client():
+    return APIClient()
+
+
+@pytest.fixture
+def buyer(client):
+    user = User.objects.create_user(email='buyer@test.ru', is_active=True)
+    client.force_authenticate(user)
+    return user
+
+
+@pytest.fixture
+def products():
+    shop, category = baker.make(Shop), baker.make(Category)
+    shop.categories.add(category)
+    return baker.make(Product, shop=shop, category=category, quantity=10, price_rrc=seq(100), _quantity=50)
+
+
+def basket(user):
+    return dict(OrderItem.objects.filter(order__user=user, order__order_state='basket').values_list(
+        'product_id', 'quantity'))
+
+
+def post_items(client, items, method='post'):
+    return getattr(client, method)('/api/v1/basket', {'items': json.dumps(items)})
+
+
+@pytest.mark.django_db
+def test_basket_add(client, buyer, products):
+    response = post_items(client, [{'product': product.id, 'quantity': 1 + i % 3}
+                                   for i, product in enumerate(products)])
+    assert response.json() == {'status': True}
+    assert basket(buyer) == {product.id: 1 + i % 3 for i, product in enumerate(products)}
+
+    # повторное добавление заменяет количество, остальные позиции не меняются
+    post_items(client, [{'product': products[0].id, 'quantity': 5}, {'product': products[0].id, 'quantity': 7}])
+    assert basket(buyer)[products[0].id] == 7
+    assert len(basket(buyer)) == 50
+    assert Order.objects.filter(user=buyer).count() == 1
+
+
+@pytest.mark.django_db
+def test_basket_add_query_count_does_not_grow(client, buyer, products):
+    post_items(client, [{'product': products[0].id, 'quantity': 1}])
+    counts = []
+    for size in (1, 50):
+        with CaptureQueriesContext(connection) as context:
+            response = post_items(client, [{'product': product.id, 'quantity': 1} for product in products[:size]])
+        assert response.status_code == 200
+        counts.append(len(context.captured_queries))
+    assert counts[0] == counts[1]
+    assert counts[1] <= 6
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('items, error', [
+    ([{'product': 0, 'quantity': 1}], 'Такого товара нет в наличии'),
+    ([{'product': 'first', 'quantity': 11}], 'Такого количества товаров нет в наличии'),
+    ([{'product': 'first', 'quantity': 0}], 'Количество товара должно быть больше нуля'),
+    ([{'product': 'first'}], 'Позиция корзины'),
+    ({'product': 'first', 'quantity': 1}, 'Позиции корзины - JSON-список'),
+])
+def test_basket_add_is_all_or_nothing(client, buyer, products, items, error):
+    if isinstance(items, list):
+        items = [{'product': products[1].id, 'quantity': 1}] + items
+    items = json.loads(json.dumps(items).replace('"first"', str(products[0].id)))
+    response = post_items(client, items)
+    assert response.status_code == 403
+    assert response.json()['error'].startswith(error)
+    assert basket(buyer) == {}
+
+
+@pytest.mark.django_db
+def test_basket_put(client, buyer, products):
+    post_items(client, [{'product': product.id, 'quantity': 1} for product in products[:3]])
+    with CaptureQueriesContext(connection) as context:
+        response = post_items(client, [{'product': products[0].id, 'quantity': 4},
+                                       {'product': products[1].id, 'quantity': 2},
+                                       {'product': products[5].id, 'quantity': 2}], 'put')
+    assert response.json() == {'status': True}
+    assert len(context.captured_queries) <= 6
+    assert basket(buyer) == {products[0].id: 4, products[1].id: 2, products[2].id: 1}
+
+    response = post_items(client, [{'product': products[0].id, 'quantity': 3},
+                                   {'product': products[1].id, 'quantity': 20}], 'put')
+    assert response.status_code == 403
+    assert basket(buyer)[products[0].id] == 4
+
+
+def totals(order):
+    return Order.objects.values_list('items_count', 'total_sum').get(id=order.id)
+
+
+@pytest.mark.django_db
+def test_basket_totals(client, buyer, products):
+    post_items(client, [{'product': products[0].id, 'quantity': 2}, {'product': products[1].id, 'quantity': 1}])
+    order = Order.objects.get(user=buyer, order_state='basket')
+    assert totals(order) == (3, 2 * 101 + 102)
+
+    post_items(client, [{'product': products[1].id, 'quantity': 3}], 'put')
+    assert totals(order) == (5, 2 * 101 + 3 * 102)
+
+    item = OrderItem.objects.get(order=order, product=products[0])
+    client.delete('/api/v1/basket', {'items': str(item.id)})
+    assert totals(order) == (3, 3 * 102)
+    assert Order.objects.get(id=order.id).sum == 3
+
+
+@pytest.fixture
+def contact(buyer):
+    return Contact.objects.create(user=buyer, city='Москва', street='Тверская', phone='1')
+
+
+def stock(products):
+    return list(Product.objects.filter(id__in=[product.id for product in products]).order_by('id').values_list(
+        'quantity', flat=True))
+
+
+def fill_basket(client, user, items):
+    post_items(client, [{'product': product.id, 'quantity': quantity} for product, quantity in items])
+    return Order.objects.get(user=user, order_state='basket')
+
+
+def checkout(client, user, contact, items):
+    order = fill_basket(client, user, items)
+    return order, client.post('/api/v1/order', {'id': order.id, 'contact': contact.id})
+
+
+def catalog_stock(client, shop_id, products):
+    quantities = {row['id']: row['quantity'] for row in client.get(f'/api/v1/products?shop_id={shop_id}').json()}
+    return [quantities[product.id] for product in products]
+
+
+def in_stock_count(client, category_id):
+    return {row['id']: row['in_stock_count'] for row in client.get('/api/v1/categories/').json()}[category_id]
+
+
+@pytest.mark.django_db
+def test_checkout_reserves_stock(client, buyer, contact, products, mailoutbox, settings,
+                                 django_capture_on_commit_callbacks):
+    settings.RECIPIENTS_EMAIL = ['manager@test.ru']
+    shop_id, category_id = products[0].shop_id, products[0].category_id
+    refresh_counters(shop_id, [category_id])
+    # списки товаров из снимка и категорий из кеша до оформления
+    build_snapshots(shop_id)
+    assert 'X-Content-Hash' in client.get(f'/api/v1/products?shop_id={shop_id}')
+    etags = {url: client.get(url)['ETag'] for url in ('/api/v1/categories/', f'/api/v1/products?shop_id={shop_id}')}
+
+    with django_capture_on_commit_callbacks(execute=True):
+        order, response = checkout(client, buyer, contact, [(products[0], 10), (products[1], 3)])
+    assert response.json() == {'status': True, 'message': f'Заказ номер {order.id} создан!'}
+    assert stock(products[:3]) == [0, 7, 10]
+    order.refresh_from_db()
+    assert order.order_state == 'new' and order.contact == contact
+    assert order.reserved_until > now() + timedelta(hours=23)
+    assert len(mailoutbox) == 2
+
+    # клиенты видят новые остатки и счетчики, а не кеш и снимки до оформления
+    assert catalog_stock(client, shop_id, products[:3]) == [0, 7, 10]
+    assert in_stock_count(client, category_id) == 49
+    for url, etag in etags.items():
+        assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    # повторно та же корзина не оформляется
+    assert client.post('/api/v1/order', {'id': order.id, 'contact': contact.id}).status_code == 403
+    assert stock(products[:2]) == [0, 7]
+
+
+@pytest.mark.django_db
+def test_checkout_is_all_or_nothing(client, buyer, contact, products):
+    order = fill_basket(client, buyer, [(products[0], 5), (products[1], 2)])
+    Product.objects.filter(id=products[1].id).update(quantity=1)
+    response = client.post('/api/v1/order', {'id': order.id, 'contact': contact.id})
+    assert response.status_code == 403
+    assert response.json()['error'] == f'Такого количества товаров нет в наличии: {products[1].id}'
+    assert stock(products[:2]) == [10, 1]
+    assert Order.objects.get(id=order.id).order_state == 'basket'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('data', [{'id': 'abc', 'contact': 1}, {'id': 1, 'contact': 'abc'}])
+def test_checkout_bad_ids(client, buyer, data):
+    client.force_authenticate(buyer)
+    response = client.post('/api/v1/order', data, format='json')
+    assert response.status_code == 403
+    assert response.json()['error'] == 'id и contact - числа'
+
+
+@pytest.mark.django_db
+def test_checkout_foreign_basket_or_contact(client, buyer, contact, products):
+    order, _ = checkout(client, buyer, Contact(id=0), [(products[0], 1)])
+    other = User.objects.create_user(email='other@test.ru', is_active=True)
+    other_contact = Contact.objects.create(user=other, city='Москва', street='Тверская', phone='2')
+    assert client.post('/api/v1/order', {'id': order.id, 'contact': other_contact.id}).status_code == 403
+    client.force_authenticate(other)
+    assert client.post('/api/v1/order', {'id': order.id, 'contact': other_contact.id}).status_code == 403
+    assert stock(products[:1]) == [10]
+
+
+@pytest.mark.django_db
+def test_expired_reservations_are_released(client, buyer, contact, products, django_capture_on_commit_callbacks):
+    shop_id = products[0].shop_id
+    with django_capture_on_commit_callbacks(execute=True):
+        expired, _ = checkout(client, buyer, contact, [(products[0], 4), (products[1], 1)])
+        confirmed, _ = checkout(client, buyer, contact, [(products[0], 2)])
+    Order.objects.filter(id__in=[expired.id, confirmed.id]).update(reserved_until=now() - timedelta(minutes=1))
+    Order.objects.filter(id=confirmed.id).update(order_state='confirmed')
+    assert stock(products[:2]) == [4, 9]
+    assert catalog_stock(client, shop_id, products[:2]) == [4, 9]
+    assert in_stock_count(client, products[0].category_id) == 50
+
+    with django_capture_on_commit_callbacks(execute=True):
+        assert release_reservations_task() == 1
+    assert stock(products[:2]) == [8, 10]
+    assert catalog_stock(client, shop_id, products[:2]) == [8, 10]
+    assert Order.objects.get(id=expired.id).order_state == 'canceled'
+    assert Order.objects.get(id=confirmed.id).order_state == 'confirmed'
+    assert release_reservations_task() == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_checkout_under_load():
+    """
+    Нагрузочный тест: одновременные покупатели не раскупают больше, чем есть на складе
+    """
+    result = run_checkout_benchmark(buyers=80, products=4, stock=15, threads=8)
+    assert result['mismatched'] == []
+    assert result['confirmed'] > 0 and result['rejected'] > 0
+    assert result['min_stock'] >= 0
+    assert result['orders_per_second'] > 0
+    assert not Product.objects.exists() and not User.objects.exists()
+
+
+@pytest.mark.django_db
+def test_basket_delete_only_from_own_basket(client, buyer, contact, products):
+    order, _ = checkout(client, buyer, contact, [(products[0], 2)])
+    basket_order = fill_basket(client, buyer, [(products[1], 1), (products[2], 1), (products[3], 1)])
+    reserved = OrderItem.objects.get(order=order)
+    other = User.objects.create_user(email='other@test.ru', is_active=True)
+
+    # позиция оформленного заказа не удаляется, резерв на складе остается
+    response = client.delete('/api/v1/basket', {'items': str(reserved.id)})
+    assert response.status_code == 403
+    assert OrderItem.objects.filter(id=reserved.id).exists()
+    assert stock(products[:1]) == [8]
+    assert totals(order) == (2, 2 * 101)
+
+    items = dict(basket_order.ordered_items.values_list('product_id', 'id'))
+    client.force_authenticate(other)
+    assert client.delete('/api/v1/basket', {'items': str(items[products[1].id])}).status_code == 403
+    client.force_authenticate(buyer)
+    assert client.delete('/api/v1/basket', {'items': 'first'}).status_code == 403
+
+    response = client.delete('/api/v1/basket', {'items': f'{items[products[1].id]},{items[products[2].id]}'})
+    assert response.json() == {'status': True}
+    assert basket(buyer) == {products[3].id: 1}
+    assert totals(basket_order) == (1, 104)
+
+
+@pytest.mark.django_db
+def test_checkout_freezes_prices(client, buyer, contact, products):
+    order, _ = checkout(client, buyer, contact, [(products[0], 2), (products[1], 1)])
+    Product.objects.filter(id__in=[products[0].id, products[1].id]).update(price_rrc=1000)
+    assert dict(order.ordered_items.values_list('product_id', 'price')) == {products[0].id: 101, products[1].id: 102}
+    assert totals(order) == (3, 2 * 101 + 102)
+
+    partner = User.objects.create_user(email='partner@test.ru', type='shop', is_active=True)
+    Shop.objects.filter(id=products[0].shop_id).update(user=partner)
+    client.force_authenticate(partner)
+    with CaptureQueriesContext(connection) as context:
+        response = client.get('/api/v1/partner/orders')
+    assert [(row['id'], row['items_count'], row['total_sum']) for row in response.json()] == [
+        (order.id, 3, 2 * 101 + 102)]
+    assert not any('SUM(' in query['sql'] for query in context.captured_queries)
+
+
+def make_orders(user, products, count, **fields):
+    orders = Order.objects.bulk_create([Order(user=user, order_state='new', **fields) for _ in range(count)])
+    OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=1)
+                                   for order in orders for product in products[:2]])
+    return orders
+
+
+def list_queries(client, url):
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(context.captured_queries), response.json()
+
+
+@pytest.mark.django_db
+def test_order_list_query_count_does_not_grow(client, buyer, contact, products):
+    partner = User.objects.create_user(email='partner@test.ru', type='shop', is_active=True)
+    Shop.objects.filter(id=products[0].shop_id).update(user=partner)
+    counts = {}
+    for size in (1, 1000):
+        Order.objects.all().delete()
+        make_orders(buyer, products, size, contact=contact)
+        for user, url in ((buyer, '/api/v1/order'), (partner, '/api/v1/partner/orders')):
+            client.force_authenticate(user)
+            count, rows = list_queries(client, f'{url}?limit=1000')
+            assert len(rows) == size
+            assert all(len(row['ordered_items']) == 2 and row['contact']['id'] == contact.id for row in rows)
+            counts.setdefault(url, []).append(count)
+    assert all(first == last for first, last in counts.values())
+
+
+@pytest.mark.django_db
+def test_order_list_pagination(client, buyer, products):
+    orders = make_orders(buyer, products, 7)
+    # заказы одного момента различаются по id
+    Order.objects.filter(id__in=[order.id for order in orders[2:5]]).update(dt=orders[2].dt)
+    expected = list(Order.objects.filter(user=buyer).order_by('-dt', '-id').values_list('id', flat=True))
+    ids, url = [], '/api/v1/order?limit=3'
+    while url:
+        response = client.get(url)
+        ids.extend(row['id'] for row in response.json())
+        url = response.headers.get('Link', '').partition('<')[2].partition('>')[0]
+    assert ids == expected
+
+    # корзина - отдельно от оформленных заказов
+    fill_basket(client, buyer, [(products[0], 1)])
+    assert [row['order_state'] for row in client.get('/api/v1/basket').json()] == ['basket']
+    assert len(client.get('/api/v1/order?limit=1000').json()) == 7
+
+
+@pytest.mark.django_db
+def test_order_list_filters(client, buyer, products):
+    old, confirmed, new = make_orders(buyer, products, 3)
+    Order.objects.filter(id=old.id).update(dt=now() - timedelta(days=10), order_state='delivered')
+    Order.objects.filter(id=confirmed.id).update(order_state='confirmed')
+
+    def ids(query):
+        return [row['id'] for row in client.get(f'/api/v1/order?{query}').json()]
+
+    assert ids('order_state=confirmed,delivered') == [confirmed.id, old.id]
+    assert ids('order_state=new') == [new.id]
+    assert ids('date_from=' + (now() - timedelta(days=1)).date().isoformat()) == [new.id, confirmed.id]
+    assert ids('date_to=' + (now() - timedelta(days=5)).date().isoformat()) == [old.id]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('query', ['cursor=bad', 'limit=0', 'order_state=unknown', 'date_from=yesterday',
+                                   'date_to=2024-13-01'])
+def test_order_list_bad_request(client, buyer, query):
+    assert client.get(f'/api/v1/order?{query}').status_code == 400
+
+
+class FlakyBackend(EmailBackend):
+    """
+    Почтовый сервер, который считает соединения и отказывает на заданной по счету отправке
+    """
+    connections = 0
+    fail_on = None
+    calls = 0
+
+    def open(self):
+        FlakyBackend.connections += 1
+
+    def send_messages(self, messages):
+        FlakyBackend.calls += 1
+        if FlakyBackend.calls == FlakyBackend.fail_on:
+            raise ConnectionRefusedError
+        return super().send_messages(messages)
+
+
+@pytest.fixture
+def flaky_backend(settings, monkeypatch):
+    settings.EMAIL_BACKEND = 'tests.main.test_orders.FlakyBackend'
+    settings.ORDER_EMAIL_RETRY_DELAY = 0
+    for name, value in (('connections', 0), ('fail_on', None), ('calls', 0)):
+        monkeypatch.setattr(FlakyBackend, name, value)
+    return FlakyBackend
+
+
+@pytest.mark.django_db
+def test_checkout_sends_emails_after_commit(client, buyer, contact, products, settings, flaky_backend,
+                                            django_capture_on_commit_callbacks):
+    settings.RECIPIENTS_EMAIL = ['manager@test.ru']
+    with django_capture_on_commit_callbacks() as callbacks:
+        order, response = checkout(client, buyer, contact, [(products[0], 1)])
+    assert response.status_code == 200
+    assert mail.outbox == []
+
+    for callback in callbacks:
+        callback()
+    assert [(message.subject, message.to) for message in mail.outbox] == [
+        ('Заказ в интернет-магазине', ['buyer@test.ru']), (f'Новый заказ {order.id}', ['manager@test.ru'])]
+    assert flaky_backend.connections == 1
+
+
+def notified(orders):
+    return list(Order.objects.filter(id__in=[order.id for order in orders]).order_by('id').values_list(
+        'notifications_sent', flat=True))
+
+
+@pytest.mark.django_db
+def test_order_emails_are_sent_in_batches(buyer, products, settings, flaky_backend):
+    settings.RECIPIENTS_EMAIL = ['manager@test.ru']
+    settings.ORDER_EMAIL_BATCH_SIZE = 2
+    orders = make_orders(buyer, products, 5)
+    basket_order = Order.objects.create(user=buyer)
+
+    send_order_emails_task.delay()
+    assert len(mail.outbox) == 10
+    assert notified(orders) == [2] * 5 and notified([basket_order]) == [0]
+    # пачки по два заказа - по соединению на пачку
+    assert flaky_backend.connections == 3
+    assert send_order_emails_task.delay().get() == 0
+    assert send_order_emails_task.rate_limit == settings.ORDER_EMAIL_RATE_LIMIT
+
+
+@pytest.mark.django_db
+def test_order_emails_retry_without_duplicates(buyer, products, settings, flaky_backend):
+    settings.RECIPIENTS_EMAIL = ['manager@test.ru']
+    orders = make_orders(buyer, products, 3)
+    # сервер отказывает на письме менеджерам о первом заказе, письмо покупателю уже отправлено
+    flaky_backend.fail_on = 2
+    send_order_emails_task.delay()
+
+    assert [(message.subject, message.to) for message in mail.outbox] == [
+        message for order in orders for message in (
+            ('Заказ в интернет-магазине', ['buyer@test.ru']), (f'Новый заказ {order.id}', ['manager@test.ru']))]
+    assert notified(orders) == [2] * 3
+    assert flaky_backend.connections == 2
+
+
+@pytest.mark.django_db
+def test_counters_refresh_reaches_cached_categories(client, products, django_capture_on_commit_callbacks):
+    category_id = products[0].category_id
+    with django_capture_on_commit_callbacks(execute=True):
+        refresh_counters(products[0].shop_id)
+    etag = client.get('/api/v1/categories/')['ETag']
+    assert in_stock_count(client, category_id) == 50
+
+    Product.objects.filter(id=products[0].id).update(quantity=0)
+    with django_capture_on_commit_callbacks(execute=True):
+        refresh_counters_task([(products[0].shop_id, [category_id])])
+    assert in_stock_count(client, category_id) == 49
+    assert client.get('/api/v1/categories/', HTTP_IF_NONE_MATCH=etag).status_code == 200
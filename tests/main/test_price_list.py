@@ -0,0 +1,75 @@
+import tracemalloc
+from io import BytesIO
+
+import pytest
+import ujson
+import yaml
+from main.importer import import_price_list
+from main.models import Shop, Product, ProductParameter
+from main.price_list import read_price_list, price_list_format
+from tests.main.test_import import make_price_list
+
+
+def yaml_file(data):
+    return BytesIO(yaml.dump(data, allow_unicode=True, sort_keys=False).encode())
+
+
+def jsonl_file(data):
+    header = {'shop': data['shop'], 'categories': data['categories']}
+    lines = [ujson.dumps(item, ensure_ascii=False) for item in [header, *data['goods']]]
+    return BytesIO('\n'.join(lines).encode())
+
+
+@pytest.mark.parametrize('to_file, format', [(yaml_file, 'yaml'), (jsonl_file, 'jsonl')])
+def test_read_price_list(to_file, format):
+    source = make_price_list(5)
+    data = read_price_list(to_file(source), format)
+    assert data['shop'] == source['shop']
+    assert data['categories'] == source['categories']
+    assert list(data['goods']) == source['goods']
+
+
+def test_read_price_list_header_after_goods():
+    stream = BytesIO(b'goods:\n  - {id: 1}\n  - {id: 2}\nshop: test\ncategories: []\n')
+    data = read_price_list(stream)
+    assert data['shop'] == 'test'
+    assert list(data['goods']) == [{'id': 1}, {'id': 2}]
+
+
+def test_price_list_format():
+    assert price_list_format('https://example.com/shop.yaml') == 'yaml'
+    assert price_list_format('https://example.com/shop.jsonl?token=1') == 'jsonl'
+
+
+def test_read_price_list_memory_is_flat():
+    """
+    Пиковое потребление памяти при разборе не зависит от размера файла
+    """
+    peaks = []
+    for size in (300, 3000):
+        stream = yaml_file(make_price_list(size))
+        tracemalloc.start()
+        for _ in read_price_list(stream)['goods']:
+            pass
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < peaks[0] * 2
+
+
+@pytest.mark.django_db
+def test_import_streamed_price_list():
+    shop = Shop.objects.create(name='test_shop')
+    data = read_price_list(yaml_file(make_price_list(25)))
+    result = import_price_list(shop, data, batch_size=10)
+    assert result == {'inserted': 25, 'updated': 0, 'deactivated': 0}
+    assert Product.objects.filter(shop=shop).count() == 25
+
+
+@pytest.mark.django_db
+def test_import_yaml_price_list_with_dates():
+    shop = Shop.objects.create(name='test_shop')
+    source = make_price_list(1)
+    stream = BytesIO(yaml_file(source).getvalue().replace(
+        b'parameters:', 'parameters:\n    Дата выпуска: 2020-01-01'.encode(), 1))
+    assert import_price_list(shop, read_price_list(stream)) == {'inserted': 1, 'updated': 0, 'deactivated': 0}
+    assert ProductParameter.objects.get(parameter__name='Дата выпуска').value == '2020-01-01'
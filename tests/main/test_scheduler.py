@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+import pytest
+from django.db.models import F
+from django.utils.timezone import now
+from main.models import Shop, User, ImportRun
+from main.scheduler import schedule_imports, import_throughput
+from main.tasks import schedule_imports_task
+
+
+@pytest.fixture
+def shop_factory():
+    def factory(name, url):
+        user = User.objects.create_user(email=f'{name}@test.ru', type='shop', is_active=True)
+        return Shop.objects.create(name=name, url=url, user=user)
+
+    return factory
+
+
+def make_run(shop, state, age):
+    run = ImportRun.objects.create(user=shop.user, shop=shop, url=shop.url, state=state, finished_at=now() - age)
+    ImportRun.objects.filter(id=run.id).update(created_at=now() - age)
+    return run
+
+
+@pytest.mark.django_db
+def test_schedule_imports_limits(settings, shop_factory):
+    settings.IMPORT_CONCURRENCY = 3
+    settings.IMPORT_HOST_CONCURRENCY = 2
+    shops = [shop_factory(f'a{i}', f'http://a.example.com/{i}.yaml') for i in range(3)]
+    shops += [shop_factory(f'b{i}', f'http://b.example.com/{i}.yaml') for i in range(3)]
+
+    runs = schedule_imports()
+    assert [run.shop for run in runs] == [shops[0], shops[1], shops[3]]
+    assert all(run.state == 'queued' for run in runs)
+    assert schedule_imports() == []
+
+
+@pytest.mark.django_db
+def test_schedule_imports_skips_manual_runs(settings, shop_factory):
+    settings.IMPORT_CONCURRENCY = 10
+    settings.IMPORT_HOST_CONCURRENCY = 10
+    busy, other = [shop_factory(name, f'http://example.com/{name}.yaml') for name in ('busy', 'other')]
+    # ручная загрузка, магазин которой определится только при разборе прайс-листа
+    ImportRun.objects.create(user=busy.user, url=busy.url, state='running')
+    assert [run.shop for run in schedule_imports()] == [other]
+
+
+@pytest.mark.django_db
+def test_schedule_imports_order_by_staleness(settings, shop_factory):
+    settings.IMPORT_CONCURRENCY = 10
+    settings.IMPORT_HOST_CONCURRENCY = 10
+    fresh, old, never = [shop_factory(name, f'http://example.com/{name}.yaml') for name in ('fresh', 'old', 'never')]
+    for shop, age in ((fresh, timedelta(hours=1)), (old, timedelta(days=3))):
+        make_run(shop, 'done', age)
+
+    assert [run.shop for run in schedule_imports()] == [never, old]
+
+
+@pytest.mark.django_db
+def test_failing_shops_do_not_block_stale_shops(settings, shop_factory):
+    settings.IMPORT_CONCURRENCY = 2
+    settings.IMPORT_HOST_CONCURRENCY = 10
+    failing = [shop_factory(f'failing{i}', f'http://example.com/failing{i}.yaml') for i in range(2)]
+    healthy = shop_factory('healthy', 'http://example.com/healthy.yaml')
+    make_run(healthy, 'done', timedelta(days=30))
+
+    scheduled = []
+    for _ in range(3):
+        runs = schedule_imports()
+        scheduled.append({run.shop for run in runs})
+        # загрузки недоступных прайс-листов завершаются ошибкой, загрузка исправного - успешно
+        for run in runs:
+            ImportRun.objects.filter(id=run.id).update(
+                state='done' if run.shop == healthy else 'failed', finished_at=now())
+    assert scheduled == [set(failing), {healthy}, set()]
+
+
+@pytest.mark.django_db
+def test_failing_shop_backoff(settings, shop_factory):
+    settings.IMPORT_INTERVAL = 60 * 60
+    shop = shop_factory('shop', 'http://example.com/shop.yaml')
+    make_run(shop, 'done', timedelta(days=1))
+    make_run(shop, 'failed', timedelta(hours=3))
+    make_run(shop, 'failed', timedelta(hours=2))
+    # две неудачи подряд - следующая попытка через 4 часа после последней
+    assert schedule_imports() == []
+
+    ImportRun.objects.filter(shop=shop, state='failed').update(created_at=F('created_at') - timedelta(hours=2))
+    assert [run.shop for run in schedule_imports()] == [shop]
+
+
+@pytest.mark.django_db
+def test_schedule_imports_task(settings, shop_factory, monkeypatch):
+    calls = []
+    monkeypatch.setattr('main.tasks.partner_update_task.apply_async',
+                        lambda args, countdown: calls.append((args, countdown)))
+    shop_factory('shop', 'http://example.com/shop.yaml')
+    result = schedule_imports_task()
+    assert result['scheduled'] == 1
+    assert 0 <= calls[0][1] <= settings.IMPORT_JITTER
+
+
+@pytest.mark.django_db
+def test_import_throughput(shop_factory):
+    shop = shop_factory('shop', 'http://example.com/shop.yaml')
+    ImportRun.objects.create(user=shop.user, shop=shop, url=shop.url, state='done', finished_at=now(),
+                             rows_processed=1000, download_time=1, parse_time=1, db_write_time=1, plan_time=1,
+                             finalize_time=1)
+    assert import_throughput(timedelta(hours=2)) == {'shops_per_hour': 0.5, 'rows_per_second': 200}